@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'photos.middleware.PerformanceMiddleware',
+    'photos.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,13 +78,41 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# WAL lets readers and the writer run at once: a streamed gallery reading rows while the client
+# receives them does not block writes, and view counter flushes do not block reads
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode=WAL;',
+        },
     }
 }
 
+# Read replicas: comma separated SQLite files in PHOTOS_DB_REPLICAS are opened read-only as
+# 'replica0', 'replica1', ... e.g. PHOTOS_DB_REPLICAS=db.sqlite3 reads the primary's own file
+# through separate read-only connections, which keep the WAL mode the primary set on the file.
+# Tests run them as mirrors of 'default'
+
+for number, replica in enumerate(filter(None, os.environ.get('PHOTOS_DB_REPLICAS', '').split(','))):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{BASE_DIR / replica.strip()}?mode=ro',
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['photos.routers.PrimaryReplicaRouter']
+
+PHOTOS_DB_ROUTING = {
+    'PRIMARY': 'default',
+    'REPLICAS': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': 5,
+    # pins must be seen by every worker process, see CACHES['photos_db_pins']
+    'CACHE': 'photos_db_pins',
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -128,11 +159,185 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'photos.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # same bytes as rest_framework.renderers.JSONRenderer, faster with orjson installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'photos.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# Photos gallery pagination
+
+PHOTOS_GALLERY_PAGE_SIZE = 100
+PHOTOS_GALLERY_MAX_PAGE_SIZE = 500
+PHOTOS_BATCH_MAX_IDS = 100
+# rows read from db and encoded at once by gallery/?stream=1
+PHOTOS_GALLERY_STREAM_CHUNK_SIZE = 2000
+
+# Photos view counter: views are buffered per photo and hour in STORE and written every FLUSH_INTERVAL
+# seconds to count_of_views and view analytics buckets, by a background thread of each process
+# (BACKGROUND_FLUSH) and by requests that find a flush due
+
+PHOTOS_VIEW_COUNTER = {
+    'STORE': 'photos.counters.LocalMemoryCounterStore',
+    'FLUSH_INTERVAL': 5.0,
+    'BACKGROUND_FLUSH': True,
+}
+
+# Photos view analytics: hour buckets are upserted by flushes of the view counter; rollup_view_buckets
+# folds hours older than HOURLY_DAYS into days and deletes days older than DAILY_DAYS;
+# series endpoints return PERIODS hours or days by default, at most MAX_PERIODS
+
+PHOTOS_VIEW_ANALYTICS = {
+    'HOURLY_DAYS': 7,
+    'DAILY_DAYS': 365,
+    'PERIODS': 30,
+    'MAX_PERIODS': 366,
+}
+
+# Photos leaderboard: photos/leaderboard/ returns LIMIT most viewed photos of the user, at most MAX_LIMIT
+
+PHOTOS_LEADERBOARD = {
+    'LIMIT': 10,
+    'MAX_LIMIT': 100,
+}
+
+# Photos derivatives: resized copies rendered next to the original by jobs, generate_derivatives
+# renders missing ones on a process pool of WORKERS
+
+PHOTOS_DERIVATIVES = {
+    'SIZES': (128, 512, 1600),
+    'FORMATS': ('webp', 'jpeg'),
+    'WORKERS': None,
+}
+
+# Photos jobs: work done after a photo is stored (derivatives, colors, hashing) is queued in the database
+# and run by `manage.py run_jobs` workers; lanes are taken in order of priority, failed jobs run
+# again after BACKOFF * 2 ** attempt seconds (at most MAX_BACKOFF) until MAX_ATTEMPTS, jobs locked
+# longer than LOCK_TIMEOUT are taken as lost with their worker, done jobs are kept KEEP_DONE seconds
+
+PHOTOS_JOBS = {
+    'LANES': ('high', 'default', 'low'),
+    'DEFAULT_LANE': 'default',
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF': 2.0,
+    'MAX_BACKOFF': 600.0,
+    'LOCK_TIMEOUT': 600,
+    'KEEP_DONE': 24 * 3600,
+    'POLL_INTERVAL': 1.0,
+}
+
+# Photos similarity: perceptual hashes of a user's photos within DISTANCE bits are similar
+# (photos/{pk}/similar/, at most LIMIT of them), a new photo within DUPLICATE_DISTANCE bits
+# of an older one is marked as its duplicate_of
+
+PHOTOS_SIMILAR = {
+    'DISTANCE': 10,
+    'DUPLICATE_DISTANCE': 4,
+    'LIMIT': 100,
+}
+
+# Photos search: photos/search/?q= ranks matches of a word in title TITLE_WEIGHT times higher than
+# in description, every one of the first MAX_TERMS words of q matches as a prefix
+
+PHOTOS_SEARCH = {
+    'TITLE_WEIGHT': 10.0,
+    'DESCRIPTION_WEIGHT': 1.0,
+    'PAGE_SIZE': 20,
+    'MAX_PAGE_SIZE': 100,
+    'MAX_TERMS': 8,
+}
+
+# Photos resumable uploads: partial files live in TEMP_DIR, keep it on the MEDIA_ROOT filesystem
+# so finalized uploads are moved, not copied
+
+PHOTOS_UPLOADS = {
+    'TEMP_DIR': BASE_DIR / 'uploads',
+    'CHUNK_SIZE': 64 * 1024,
+    'MAX_SIZE': 100 * 1024 * 1024,
+    # seconds an unfinished upload is kept, expired ones are dropped by manage.py expire_uploads
+    'TTL': 24 * 60 * 60,
+}
+
+# Photos storage: images are kept under sha256 of their content in MEDIA_ROOT
+
+PHOTOS_STORAGE = 'photos.storage.ContentAddressedStorage'
+# seconds an unreferenced image is kept before the delete_image job removes it, longer than an upload takes
+PHOTOS_IMAGE_DELETE_DELAY = 10 * 60
+
+# Cache: rendered gallery pages per user live in their own bounded LRU (locmem culls least recently used);
+# read-your-writes pins of the replica router live in files shared by all worker processes of the host,
+# point it to memcached or redis when workers run on several hosts
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'photos_gallery': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'photos-gallery',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'photos_db_pins': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'db-pins',
+    },
+}
+
+PHOTOS_GALLERY_CACHE = {
+    'ALIAS': 'photos_gallery',
+    'PAGES_PER_USER': 8,
+    'TIMEOUT': 300,
+}
+
+# Photos batch upload: images of one request are decoded and stored on WORKERS threads
+
+PHOTOS_BATCH_UPLOAD = {
+    'MAX_FILES': 100,
+    'WORKERS': 4,
+}
+
+# Photos media: photos/{pk}/image/ checks ownership and sends the file itself, or hands it over
+# to the web server with ACCEL = 'nginx' (X-Accel-Redirect to ACCEL_PREFIX, an internal location
+# aliased to MEDIA_ROOT) or ACCEL = 'sendfile' (X-Sendfile for apache / lighttpd)
+
+PHOTOS_MEDIA = {
+    'ACCEL': None,
+    'ACCEL_PREFIX': '/protected-images/',
+}
+
+# Token cache of photos.authentication.CachedTokenAuthentication: other processes notice
+# logout or password change within TTL seconds
+
+PHOTOS_TOKEN_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TTL': 60,
+}
+
+# Photos metrics: photos.middleware.PerformanceMiddleware times auth / db / serialize / render
+# phases of requests, sends them in Server-Timing header (SERVER_TIMING) and keeps per-endpoint
+# histograms of this process for prometheus at /metrics, open to ALLOWED_IPS only (local scrapers by default),
+# None opens it to any address
+
+PHOTOS_METRICS = {
+    'SERVER_TIMING': True,
+    'ALLOWED_IPS': ['127.0.0.1'],
+}
+
+# Photos admin: changelists of more than COUNT_LIMIT photos show an estimated count, filtered ones
+# count at most COUNT_LIMIT rows; thumbnails are the smallest derivative shown at THUMBNAIL_SIZE px
+
+PHOTOS_ADMIN = {
+    'COUNT_LIMIT': 10000,
+    'THUMBNAIL_SIZE': 64,
 }
@@ -20,16 +20,23 @@ from django.contrib import admin
 from django.urls import path, include
 from .yasg import urlpatterns as doc_urls
 from rest_framework import routers
-from photos.views import PhotosViewSet
+from photos import async_views, metrics
+from photos.views import PhotosViewSet, UploadsViewSet
 
 router = routers.SimpleRouter()
 router.register(r'photos', PhotosViewSet)
+router.register(r'uploads', UploadsViewSet)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics.export),
     path('api/v1/', include('djoser.urls')),
     path('api/v1/', include('djoser.urls.authtoken')),
     path('api/v1/', include(router.urls)),
+    path('api/v1/async/photos/gallery/', async_views.gallery),
+    path('api/v1/async/photos/add_photo/', async_views.add_photo),
+    path('api/v1/async/photos/<int:pk>/photo/', async_views.photo),
+    path('api/v1/async/photos/<int:pk>/change_photo_title/', async_views.change_photo_title),
 ]
 
 urlpatterns += doc_urls
@@ -2,8 +2,158 @@
 register model here
 """
 
+from functools import cached_property
+
+from django.conf import settings
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Q
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+
+from . import media
+from .derivatives import FORMATS, SIZES, derivative_name
+from .models import MAX_PHOTO_ID, Photo
+
+CONFIG = getattr(settings, 'PHOTOS_ADMIN', {})
+COUNT_LIMIT = CONFIG.get('COUNT_LIMIT', 10000)
+THUMBNAIL_SIZE = CONFIG.get('THUMBNAIL_SIZE', 64)
+
+
+def estimate_count(model, using):
+    """
+    :param model: model of the table
+    :param using: database alias
+    :return int: approximate count of rows read from planner statistics on postgresql,
+                 else the highest primary key; both take the same time on any size of table
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 until the table is first vacuumed or analyzed
+        if row is not None and row[0] >= 0:
+            return row[0]
+    return model._default_manager.using(using).aggregate(last=Max('pk'))['last'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    admin changelist paginator that never counts a whole large table: an unfiltered list gets
+    estimate_count, a filtered one is counted up to COUNT_LIMIT rows, so later pages of a broad filter are cut off
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.has_filters():
+            estimate = estimate_count(queryset.model, queryset.db)
+            if estimate > COUNT_LIMIT:
+                return estimate
+        return queryset.order_by()[:COUNT_LIMIT].count()
+
+
+class DuplicateListFilter(admin.SimpleListFilter):
+    """
+    photos marked as near-duplicates, read in order from photo_duplicate_date_id_idx; that partial index
+    matches 'duplicate_of IS NOT NULL' only, which the NOT of EmptyFieldListFilter is not.
+    There is no choice of other photos, as nearly all of them are and no index would narrow them down
+    """
+    title = 'duplicate'
+    parameter_name = 'duplicate'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Yes'),)
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(duplicate_of__isnull=False)
+        return queryset
+
+
+@admin.register(Photo)
+class PhotoAdmin(admin.ModelAdmin):
+    """
+    changelist of photos of all users that loads in about the same time whatever the size of the table:
+    no exact counts, users fetched with the page, filters and search served by indexes
+    and thumbnails from already rendered derivatives
+    """
+    list_display = ('thumbnail', 'title', 'user', 'date_of_creation', 'count_of_views', 'duplicate')
+    list_display_links = ('thumbnail', 'title')
+    list_select_related = ('user',)
+    list_filter = (('date_of_creation', admin.DateFieldListFilter), DuplicateListFilter)
+    # photo_date_id_idx serves the order, so the page is read without sorting the table
+    ordering = ('-date_of_creation', '-id')
+    sortable_by = ('date_of_creation',)
+    search_fields = ('id', 'user__username')
+    search_help_text = 'Photo id or exact username'
+    readonly_fields = ('thumbnail', 'user', 'duplicate_of', 'count_of_views', 'date_of_creation')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        :param request: request of changelist
+        :param queryset: photos
+        :param search_term: photo id or exact username
+        :return tuple: (photos found through the primary key or the unique username, False as rows are not repeated)
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        # usernames may be all digits too
+        if term.isdigit() and int(term) <= MAX_PHOTO_ID:
+            return queryset.filter(Q(pk=int(term)) | Q(user__username=term)), False
+        return queryset.filter(user__username=term), False
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/thumbnail/', self.admin_site.admin_view(self.thumbnail_view),
+                 name='photos_photo_thumbnail'),
+            *super().get_urls(),
+        ]
+
+    def thumbnail_view(self, request, pk):
+        """
+        sends the smallest derivative of any user's photo to staff allowed to view photos;
+        media is not served from MEDIA_URL, and the image action is for owners only
+        :param request: method GET
+        :param pk: primary key - photo.id
+        :return HttpResponse: image bytes, with ETag / Last-Modified as in the image action
+        :raise PermissionDenied: if staff user may not view photos
+        :raise Http404: if photo, its image or the derivative does not exist
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        photo = get_object_or_404(Photo.objects.only('image'), pk=pk)
+        if not photo.image:
+            raise Http404('photo has no image')
+        return media.serve(request, photo.image.storage, derivative_name(photo.image.name, SIZES[0], FORMATS[0]))
 
-from .models import Photo
+    @admin.display(description='Thumbnail')
+    def thumbnail(self, photo):
+        """
+        :param photo: Photo
+        :return str: img of the smallest derivative, served by thumbnail_view
+        """
+        if not photo.image:
+            return ''
+        url = reverse('admin:photos_photo_thumbnail', args=[photo.pk])
+        return format_html('<img src="{}" alt="" loading="lazy" style="max-width: {}px; max-height: {}px">',
+                           url, THUMBNAIL_SIZE, THUMBNAIL_SIZE)
 
-admin.site.register(Photo)
+    @admin.display(description='Duplicate of')
+    def duplicate(self, photo):
+        """
+        :param photo: Photo
+        :return str: link to the photo it duplicates, made from duplicate_of_id without loading that photo
+        """
+        if photo.duplicate_of_id is None:
+            return ''
+        url = reverse('admin:photos_photo_change', args=[photo.duplicate_of_id])
+        return format_html('<a href="{}">{}</a>', url, photo.duplicate_of_id)
@@ -0,0 +1,109 @@
+"""
+time-bucketed view analytics: views summed per photo and hour by photos.counters.ViewCounter
+are written with its flushes as batched upserts, so a view costs no write of its own;
+hour buckets older than HOURLY_DAYS are rolled up into day buckets, kept for DAILY_DAYS
+"""
+
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import ViewBucket
+
+CONFIG = getattr(settings, 'PHOTOS_VIEW_ANALYTICS', {})
+HOURLY_DAYS = CONFIG.get('HOURLY_DAYS', 7)
+DAILY_DAYS = CONFIG.get('DAILY_DAYS', 365)
+PERIODS = CONFIG.get('PERIODS', 30)
+MAX_PERIODS = CONFIG.get('MAX_PERIODS', 366)
+STEPS = {ViewBucket.HOUR: timedelta(hours=1), ViewBucket.DAY: timedelta(days=1)}
+# rows of one INSERT when the backend does not limit query params
+BATCH_SIZE = 1000
+
+
+def bucket_start(moment, resolution):
+    """
+    :param moment: aware datetime
+    :param resolution: ViewBucket.HOUR or ViewBucket.DAY
+    :return datetime: start of the UTC hour or day holding moment
+    """
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if resolution == ViewBucket.DAY else moment
+
+
+def upsert(buckets, resolution):
+    """
+    adds views to bucket rows, creating missing ones: INSERT ... ON CONFLICT DO UPDATE with many rows
+    per statement (sqlite 3.24+, postgresql)
+    :param buckets: {(photo_id, user_id, start): views}
+    :param resolution: ViewBucket.HOUR or ViewBucket.DAY
+    """
+    connection = connections[router.db_for_write(ViewBucket)]
+    table, quote = ViewBucket._meta.db_table, connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in ('photo_id', 'user_id', 'resolution', 'start', 'views'))
+    max_params = connection.features.max_query_params
+    size = max_params // 5 if max_params else BATCH_SIZE
+    rows = [(photo_id, user_id, resolution, connection.ops.adapt_datetimefield_value(start), views)
+            for (photo_id, user_id, start), views in buckets.items()]
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), size):
+            batch = rows[offset:offset + size]
+            cursor.execute(
+                f'INSERT INTO {quote(table)} ({columns}) VALUES {", ".join(["(%s, %s, %s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT ({quote("photo_id")}, {quote("resolution")}, {quote("start")}) '
+                f'DO UPDATE SET {quote("views")} = {quote(table)}.{quote("views")} + excluded.{quote("views")}',
+                [value for row in batch for value in row])
+
+
+def series(resolution, periods=PERIODS, photo_id=None, user_id=None, now=None, pending=None):
+    """
+    views of a photo or of a whole gallery per hour or day, including views not flushed yet;
+    hours are known for the last HOURLY_DAYS only, older ones are rolled up into days
+    :param resolution: ViewBucket.HOUR or ViewBucket.DAY
+    :param periods: count of the last hours or days, the current one included
+    :param photo_id: photo, or
+    :param user_id: owner of the gallery
+    :param now: end of series, now by default
+    :param pending: {(photo_id, user_id, hour start): views} not flushed yet, see ViewCounter.pending_buckets
+    :return list: [{'start': datetime, 'views': int}, ...] oldest first, periods without views included
+    """
+    step = STEPS[resolution]
+    last = bucket_start(now or timezone.now(), resolution)
+    first = last - step * (periods - 1)
+    owner = {'photo_id': photo_id} if photo_id is not None else {'user_id': user_id}
+    buckets = ViewBucket.objects.filter(start__gte=first, start__lt=last + step, **owner)
+    if resolution == ViewBucket.HOUR:
+        buckets = buckets.filter(resolution=ViewBucket.HOUR)
+    totals = Counter(dict(buckets.annotate(period=Trunc('start', resolution, tzinfo=dt_timezone.utc))
+                          .values('period').annotate(total=Sum('views')).values_list('period', 'total')))
+    for (pending_photo_id, pending_user_id, hour), views in (pending or {}).items():
+        owned = pending_photo_id == photo_id if photo_id is not None else pending_user_id == user_id
+        start = bucket_start(hour, resolution)
+        if owned and first <= start <= last:
+            totals[start] += views
+    return [{'start': first + step * index, 'views': totals[first + step * index]} for index in range(periods)]
+
+
+def rollup(hourly_days=HOURLY_DAYS, daily_days=DAILY_DAYS, now=None):
+    """
+    folds hour buckets of days older than hourly_days into day buckets and deletes
+    day buckets older than daily_days
+    :param hourly_days: count of the last days whose hours are kept
+    :param daily_days: count of the last days kept at all
+    :param now: moment of rollup, now by default
+    :return tuple: (hour buckets folded, day buckets deleted)
+    """
+    today = bucket_start(now or timezone.now(), ViewBucket.DAY)
+    hours = ViewBucket.objects.filter(resolution=ViewBucket.HOUR, start__lt=today - timedelta(days=hourly_days))
+    with transaction.atomic(using=router.db_for_write(ViewBucket)):
+        days = hours.annotate(day=Trunc('start', 'day', tzinfo=dt_timezone.utc)) \
+            .values('photo_id', 'user_id', 'day').annotate(total=Sum('views')).order_by()
+        upsert({(row['photo_id'], row['user_id'], row['day']): row['total'] for row in days}, ViewBucket.DAY)
+        folded, _ = hours.delete()
+    deleted, _ = ViewBucket.objects.filter(resolution=ViewBucket.DAY,
+                                           start__lt=today - timedelta(days=daily_days)).delete()
+    return folded, deleted
@@ -3,6 +3,8 @@ ApiConfig
 """
 
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class ApiConfig(AppConfig):
@@ -11,3 +13,11 @@ class ApiConfig(AppConfig):
     """
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'photos'
+
+    def ready(self):
+        from . import checks, signals  # pylint: disable=import-outside-toplevel,unused-import
+        from .metrics import install_sql_timer  # pylint: disable=import-outside-toplevel
+        from .search import register_function, reinstall_after_migrate  # pylint: disable=import-outside-toplevel
+        connection_created.connect(install_sql_timer)
+        connection_created.connect(register_function)
+        post_migrate.connect(reinstall_after_migrate, sender=self)
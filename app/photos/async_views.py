@@ -0,0 +1,161 @@
+"""
+async views for photos, served natively under app/asgi.py without a thread per request
+"""
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from .authentication import aauthenticate_token
+from .cache import gallery_cache
+from .conditional import aget_gallery_version, gallery_etag, not_modified, photo_etag, set_validators
+from .counters import view_counter
+from .metrics import Phase
+from .models import Photo
+from .pagination import GalleryPagination
+from .serializers import GALLERY_FIELDS, PhotoSerializer, photo_representation
+from .streaming import stream_format, stream_gallery
+from .views import schedule_processing
+
+
+def respond(data, status=200):
+    """
+    :param data: payload
+    :param status: http status
+    :return JsonResponse: payload encoded like drf does
+    """
+    return JsonResponse(data, status=status, encoder=DjangoJSONEncoder,
+                        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+def fail(description):
+    """
+    :param description: reason of failure
+    :return JsonResponse: {'message': 'fail', 'description': description}
+    """
+    return respond({'message': 'fail', 'description': description})
+
+
+def token_required(*methods):
+    """
+    decorator of async view: allows listed http methods and authenticates user by token
+    :param methods: allowed http methods
+    """
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return respond({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+            with Phase('auth'):
+                user = await aauthenticate_token(request)
+            if user is None:
+                return respond({'detail': 'Authentication credentials were not provided.'}, status=401)
+            request.user = user
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@token_required('GET')
+async def gallery(request):
+    """
+    async version of PhotosViewSet.gallery
+    :param request: method GET: optional 'cursor', 'page_size', 'sort', 'date_from' and 'date_to' query params,
+                    'stream' query param '1' / 'json' or 'ndjson' to get the whole gallery
+    :return JsonResponse: json that includes page of user's photos and 'next' cursor,
+                          with 'stream' a streamed json array or ndjson of all user's photos
+    """
+    version, date_of_change = await aget_gallery_version(request.user.pk)
+    etag = gallery_etag(request, version)
+    response = not_modified(request, etag, date_of_change)
+    if response is not None:
+        return set_validators(response, etag, date_of_change)
+    fmt = stream_format(request)
+    if fmt is not None:
+        try:
+            return set_validators(stream_gallery(request, fmt, is_async=True), etag, date_of_change)
+        except ValueError as e:
+            return fail(str(e))
+    page_key = gallery_cache.page_key(request)
+    payload = gallery_cache.get(request.user.pk, version, page_key)
+    if payload is None:
+        paginator = GalleryPagination()
+        queryset = Photo.objects.filter(user=request.user).values(*GALLERY_FIELDS)
+        try:
+            rows = await paginator.apaginate_queryset(queryset, request)
+        except ValueError as e:
+            return fail(str(e))
+        payload = {'gallery': photo_representation.gallery(rows), 'next': paginator.next_cursor}
+        gallery_cache.set(request.user.pk, version, page_key, payload)
+    return set_validators(respond(payload), etag, date_of_change)
+
+
+@token_required('GET')
+async def photo(request, pk):
+    """
+    async version of PhotosViewSet.photo
+    :param request: method GET
+    :param pk: primary key - photo.id
+    :return JsonResponse: defined photo json representation
+                          else {'message': 'fail', 'description': 'permission denied'}
+    """
+    try:
+        instance = await Photo.objects.aget(pk=pk)
+    except Photo.DoesNotExist as e:
+        return fail(str(e))
+    if instance.user_id != request.user.pk:
+        return fail('permission denied')
+    view_counter.add(instance)
+    etag = photo_etag(instance)
+    response = not_modified(request, etag)
+    if response is None:
+        instance.count_of_views += view_counter.pending(instance.pk)
+        response = respond({'photo': photo_representation.photo(instance)})
+    await sync_to_async(view_counter.flush_if_due)()
+    return set_validators(response, etag)
+
+
+@token_required('POST')
+async def change_photo_title(request, pk):
+    """
+    async version of PhotosViewSet.change_photo_title
+    :param request: method POST: dict = {'title': 'value'}
+    :param pk: primary key - photo.id
+    :return JsonResponse: defined photo json representation with new title
+                          else {'message': 'fail', 'description': reason}
+    """
+    try:
+        instance = await Photo.objects.aget(pk=pk)
+    except Photo.DoesNotExist as e:
+        return fail(str(e))
+    if instance.user_id != request.user.pk:
+        return fail('permission denied')
+    try:
+        instance.title = request.POST['title']
+    except KeyError as e:
+        return fail(str(e))
+    await instance.asave(update_fields=['title'])
+    return set_validators(respond({'photo': PhotoSerializer(instance).data}), photo_etag(instance))
+
+
+@token_required('POST')
+async def add_photo(request):
+    """
+    async version of PhotosViewSet.add_photo, the image is written to storage off the event loop
+    :param request: method POST: image file, dict = {'title': 'value', 'description': 'value'}
+    :return JsonResponse: added photo json representation
+    """
+    try:
+        instance = await Photo.objects.acreate(
+            title=request.POST['title'],
+            description=request.POST['description'],
+            image=request.FILES.get('image'),
+            user=request.user)
+    except (KeyError, ValueError, TypeError) as e:
+        return fail(str(e))
+    await sync_to_async(schedule_processing)(instance)
+    return respond({'photo': PhotoSerializer(instance).data})
@@ -0,0 +1,141 @@
+"""
+token authentication with in-process cache of tokens, sync and async
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+class TokenCache:
+    """
+    TTL-bounded LRU of token key -> Token with its user.
+    Entries are dropped by signals when the token is deleted (djoser logout) or its user is saved
+    (password change, deactivation); other processes see the change within TTL seconds
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        config = getattr(settings, 'PHOTOS_TOKEN_CACHE', {})
+        self.max_entries = max_entries or config.get('MAX_ENTRIES', 10000)
+        self.ttl = ttl if ttl is not None else config.get('TTL', 60)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_of_user = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :param key: token key
+        :return Token: copy of cached token with its user or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            token = entry[0]
+        # requests must not share mutable instances
+        token = copy.copy(token)
+        token.user = copy.copy(token.user)
+        return token
+
+    def set(self, token):
+        """
+        :param token: Token with loaded user
+        """
+        with self._lock:
+            self._drop(token.key)
+            self._entries[token.key] = (token, time.monotonic() + self.ttl)
+            self._keys_of_user.setdefault(token.user_id, set()).add(token.key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_key(self, key):
+        """
+        :param key: token key
+        """
+        with self._lock:
+            self._drop(key)
+
+    def invalidate_user(self, user_id):
+        """
+        :param user_id: user.id
+        """
+        with self._lock:
+            for key in list(self._keys_of_user.get(user_id, ())):
+                self._drop(key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._keys_of_user.get(entry[0].user_id)
+            keys.discard(key)
+            if not keys:
+                del self._keys_of_user[entry[0].user_id]
+
+    def clear(self):
+        """
+        drops all entries
+        """
+        with self._lock:
+            self._entries.clear()
+            self._keys_of_user.clear()
+
+    def stats(self):
+        """
+        :return dict: hits, misses, hit rate and size of this process's cache
+        """
+        with self._lock:
+            hits, misses, entries = self.hits, self.misses, len(self._entries)
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0, 'entries': entries}
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that skips Token + User query for tokens seen within TTL
+    """
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is not None:
+            return token.user, token
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(token)
+        return user, token
+
+
+async def aauthenticate_token(request):
+    """
+    async version of CachedTokenAuthentication
+    :param request: django request with header Authorization: Token <key>
+    :return User: active user owning the token or None
+    """
+    header = request.headers.get('Authorization', '').split()
+    if len(header) != 2 or header[0].lower() != 'token':
+        return None
+    token = token_cache.get(header[1])
+    if token is not None:
+        return token.user
+    try:
+        token = await Token.objects.select_related('user').aget(key=header[1])
+    except Token.DoesNotExist:
+        return None
+    if not token.user.is_active:
+        return None
+    token_cache.set(token)
+    return token.user
@@ -0,0 +1,56 @@
+"""
+parallel validation, decoding and storing of images uploaded in one batch
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+
+from .metadata import read
+
+CONFIG = getattr(settings, 'PHOTOS_BATCH_UPLOAD', {})
+MAX_FILES = CONFIG.get('MAX_FILES', 100)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    :return ThreadPoolExecutor: lazily created pool shared by the process,
+                                Pillow releases the GIL while decoding
+    """
+    global _pool  # pylint: disable=global-statement
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=CONFIG.get('WORKERS', 4), thread_name_prefix='photos-batch')
+        return _pool
+
+
+def store_image(upload, storage):
+    """
+    decodes uploaded image to make sure it is not broken and reads its metadata from the decoded pixels,
+    then saves it; runs on worker thread
+    :param upload: UploadedFile
+    :param storage: storage of Photo.image
+    :return tuple: (name in storage, metadata, None) or (None, None, reason of failure)
+    """
+    try:
+        with Image.open(upload) as image:
+            image.load()
+            metadata = read(image)
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError) as e:
+        return None, None, f'{upload.name}: {e}'
+    upload.seek(0)
+    return storage.save(upload.name, upload), metadata, None
+
+
+def store_images(uploads, storage):
+    """
+    :param uploads: list of UploadedFile
+    :param storage: storage of Photo.image
+    :return list: (name, metadata, error) for every upload in the same order
+    """
+    return list(get_pool().map(lambda upload: store_image(upload, storage), uploads))
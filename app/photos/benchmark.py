@@ -0,0 +1,228 @@
+"""
+load generator and measurements for benchmarks of photos api, see seed_photos and bench_photos commands
+"""
+
+import io
+import json
+import os
+import random
+import resource
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+SCENARIOS = ('gallery', 'photo', 'change_photo_title', 'add_photo')
+
+
+def make_image(seed, size=(640, 480), fmt='JPEG'):
+    """
+    :param seed: makes every image different
+    :param size: width and height in px
+    :param fmt: Pillow format
+    :return bytes: encoded image with a gradient and noise, so it compresses like a photo
+    """
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    noise = Image.effect_noise(size, rng.randint(20, 80)).convert('RGB')
+    tint = Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3)))
+    image = Image.blend(Image.blend(image, noise, 0.3), tint, 0.4)
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=85)
+    return buffer.getvalue()
+
+
+def percentile(values, fraction):
+    """
+    :param values: sorted list of numbers
+    :param fraction: 0..1
+    :return float: percentile with linear interpolation, None for empty list
+    """
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def rss_of(pid):
+    """
+    :param pid: process id
+    :return int: resident set size in KiB or None if unknown
+    """
+    try:
+        with open(f'/proc/{pid}/status', encoding='ascii') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def multipart(fields, files):
+    """
+    :param fields: dict of form fields
+    :param files: dict of name -> (filename, bytes, content type)
+    :return tuple: (body, content type header)
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content, content_type) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Scenario:
+    """
+    builds requests of one scenario for a random seeded user
+    """
+
+    def __init__(self, name, users, image):
+        """
+        :param name: one of SCENARIOS
+        :param users: list of {'token': key, 'photos': [ids]} of seeded users
+        :param image: bytes of image sent by add_photo
+        """
+        self.name = name
+        self.users = [user for user in users if user['photos'] or name in ('gallery', 'add_photo')]
+        self.image = image
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def next_request(self):
+        """
+        :return tuple: (method, path, body, headers)
+        """
+        with self._lock:
+            self._counter += 1
+            number = self._counter
+        user = self.users[number % len(self.users)]
+        headers = {'Authorization': f'Token {user["token"]}'}
+        if self.name == 'gallery':
+            return 'GET', '/api/v1/photos/gallery/', None, headers
+        photo = user['photos'][number % len(user['photos'])] if user['photos'] else None
+        if self.name == 'photo':
+            return 'GET', f'/api/v1/photos/{photo}/photo/', None, headers
+        if self.name == 'change_photo_title':
+            body, content_type = multipart({'title': f'bench title {number}'}, {})
+            return 'POST', f'/api/v1/photos/{photo}/change_photo_title/', body, {**headers, 'Content-Type': content_type}
+        body, content_type = multipart({'title': f'bench upload {number}', 'description': 'bench'},
+                                       {'image': (f'bench{number}.jpg', self.image, 'image/jpeg')})
+        return 'POST', '/api/v1/photos/add_photo/', body, {**headers, 'Content-Type': content_type}
+
+
+def send(base_url, method, path, body, headers, timeout=60):
+    """
+    :return tuple: (status, seconds)
+    """
+    request = Request(base_url + path, data=body, headers=headers, method=method)
+    started = time.perf_counter()
+    try:
+        with urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0
+    return status, time.perf_counter() - started
+
+
+def run_load(scenario, base_url, concurrency, requests, server_pid=None):
+    """
+    sends requests of scenario from concurrency threads against running server
+    :return dict: latency percentiles in ms, throughput, errors and rss of server
+    """
+    rss_before = rss_of(server_pid) if server_pid else None
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: send(base_url, *scenario.next_request()), range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(seconds * 1000 for _, seconds in results)
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': sum(1 for status, _ in results if not 200 <= status < 400),
+        'throughput_rps': requests / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else None,
+        'server_rss_kib_before': rss_before,
+        'server_rss_kib_after': rss_of(server_pid) if server_pid else None,
+    }
+
+
+def count_queries(scenario):
+    """
+    runs one request of scenario in process with django test client
+    :return int: count of sql queries made by the request, None if the request failed
+    """
+    method, path, body, headers = scenario.next_request()
+    client = Client(HTTP_AUTHORIZATION=headers['Authorization'])
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), \
+            CaptureQueriesContext(connection) as queries:
+        if method == 'GET':
+            response = client.get(path)
+        else:
+            response = client.generic(method, path, body, content_type=headers['Content-Type'])
+    if not 200 <= response.status_code < 400:
+        return None
+    return len(queries)
+
+
+def own_rss_kib():
+    """
+    :return int: peak resident set size of the benchmark process in KiB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def compare(current, previous):
+    """
+    :param current: results of this run
+    :param previous: results of an earlier run
+    :return list: lines 'scenario metric previous -> current (change %)'
+    """
+    lines = []
+    for name, metrics in current['scenarios'].items():
+        before = previous.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries'):
+            old, new = before.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            lines.append(f'{name:20} {metric:15} {old:10.2f} -> {new:10.2f} ({(new - old) / old * 100:+.1f}%)')
+    return lines
+
+
+def load_results(path):
+    """
+    :param path: path of json written by bench_photos
+    :return dict: results
+    """
+    with open(path, encoding='utf-8') as results:
+        return json.load(results)
+
+
+def environment():
+    """
+    :return dict: facts about the machine that make runs comparable
+    """
+    return {'cpu_count': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'database': connection.vendor}
@@ -0,0 +1,104 @@
+"""
+per-user cache of gallery pages on django cache framework
+"""
+
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class GalleryCache:
+    """
+    keeps rendered gallery pages of a user in one cache entry tagged with gallery version,
+    so an entry left by another process after a change is never served.
+    LRU eviction and size bound come from the cache backend (locmem MAX_ENTRIES)
+    """
+
+    def __init__(self, alias=None, pages_per_user=None, timeout=None):
+        config = getattr(settings, 'PHOTOS_GALLERY_CACHE', {})
+        self.alias = alias or config.get('ALIAS', 'default')
+        self.pages_per_user = pages_per_user or config.get('PAGES_PER_USER', 8)
+        self.timeout = timeout if timeout is not None else config.get('TIMEOUT', 300)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        """
+        :return BaseCache: backend configured by alias
+        """
+        return caches[self.alias]
+
+    @staticmethod
+    def key(user_id):
+        """
+        :param user_id: user.id
+        :return str: cache key of user's gallery
+        """
+        return f'photos:gallery:{user_id}'
+
+    @staticmethod
+    def page_key(request):
+        """
+        :param request: drf or django request of gallery page
+        :return str: key of page inside user's entry: host and query params
+        """
+        raw = repr((request.get_host(), sorted(request.GET.lists())))
+        return hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+
+    def get(self, user_id, version, page_key):
+        """
+        :param user_id: user.id
+        :param version: current version of user's gallery
+        :param page_key: key made by page_key
+        :return dict: cached payload of the page or None
+        """
+        entry = self.cache.get(self.key(user_id))
+        payload = None
+        if entry is not None and entry['version'] == version:
+            payload = entry['pages'].get(page_key)
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return payload
+
+    def set(self, user_id, version, page_key, payload):
+        """
+        :param user_id: user.id
+        :param version: version of user's gallery the payload was built from
+        :param page_key: key made by page_key
+        :param payload: gallery page payload
+        """
+        key = self.key(user_id)
+        entry = self.cache.get(key)
+        if entry is None or entry['version'] != version:
+            entry = {'version': version, 'pages': {}}
+        pages = entry['pages']
+        pages.pop(page_key, None)
+        pages[page_key] = payload
+        while len(pages) > self.pages_per_user:
+            del pages[next(iter(pages))]
+        self.cache.set(key, entry, self.timeout)
+
+    def invalidate(self, user_id):
+        """
+        :param user_id: user.id
+        """
+        self.cache.delete(self.key(user_id))
+
+    def stats(self):
+        """
+        :return dict: hits, misses and hit rate of this process
+        """
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0}
+
+
+gallery_cache = GalleryCache()
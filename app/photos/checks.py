@@ -0,0 +1,29 @@
+"""
+system checks of photos settings
+"""
+
+from django.conf import settings
+from django.core import checks
+
+from . import routers
+
+PROCESS_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+
+@checks.register(checks.Tags.caches)
+def check_db_pin_cache(app_configs, **kwargs):  # pylint: disable=unused-argument
+    """
+    read-your-writes pins of ReplicaRoutingMiddleware are set by the worker handling a write
+    and read by whichever worker handles the next request, so their cache must be shared
+    :return list: warning if replicas are routed to and pins live in memory of one process
+    """
+    backend = settings.CACHES.get(routers.CACHE, {}).get('BACKEND')
+    if not routers.REPLICAS or backend not in PROCESS_CACHES:
+        return []
+    return [checks.Warning(
+        f"PHOTOS_DB_ROUTING['CACHE'] = {routers.CACHE!r} is not shared between processes",
+        hint='with several workers a client may read from a replica right after its write; '
+             'use a file based, memcached or redis cache',
+        obj='photos.routers',
+        id='photos.W001',
+    )]
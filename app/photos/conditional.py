@@ -0,0 +1,109 @@
+"""
+validators (ETag, Last-Modified) of gallery and photo responses
+"""
+
+import hashlib
+from operator import attrgetter
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import GalleryVersion
+
+# fields of photo representation but count_of_views, see serializers.PhotoRepresentation
+PHOTO_VALIDATOR_FIELDS = attrgetter('title', 'description', 'date_of_creation', 'image.name', 'user_id',
+                                    'width', 'height', 'orientation', 'taken_at', 'exif', 'dominant_color',
+                                    'blurhash', 'duplicate_of_id')
+
+
+def get_gallery_version(user_id):
+    """
+    :param user_id: user.id
+    :return tuple: (version, date_of_change) of user's gallery
+    """
+    row = GalleryVersion.objects.filter(user_id=user_id).values_list('version', 'date_of_change').first()
+    if row is None:
+        version, _ = GalleryVersion.objects.get_or_create(user_id=user_id)
+        row = version.version, version.date_of_change
+    return row
+
+
+async def aget_gallery_version(user_id):
+    """
+    async version of get_gallery_version
+    :param user_id: user.id
+    :return tuple: (version, date_of_change) of user's gallery
+    """
+    row = await GalleryVersion.objects.filter(user_id=user_id).values_list('version', 'date_of_change').afirst()
+    if row is None:
+        version, _ = await GalleryVersion.objects.aget_or_create(user_id=user_id)
+        row = version.version, version.date_of_change
+    return row
+
+
+def bump_gallery_version(user_id):
+    """
+    invalidates validators of user's gallery, nothing to do if they were never issued
+    :param user_id: user.id
+    """
+    bump_gallery_versions([user_id])
+
+
+def bump_gallery_versions(user_ids):
+    """
+    invalidates validators of galleries of many users with one UPDATE
+    :param user_ids: ids of users
+    """
+    GalleryVersion.objects.filter(user_id__in=user_ids).update(version=F('version') + 1,
+                                                               date_of_change=timezone.now())
+
+
+def _digest(*parts):
+    return hashlib.md5('\x00'.join(str(part) for part in parts).encode(), usedforsecurity=False).hexdigest()[:16]
+
+
+def gallery_etag(request, version):
+    """
+    strong ETag of a gallery page: version of gallery plus query params selecting the page
+    :param request: drf or django request
+    :param version: version of user's gallery
+    :return str: quoted ETag
+    """
+    params = sorted(request.GET.lists())
+    return f'"gallery-{request.user.pk}-{version}-{_digest(params)}"'
+
+
+def photo_etag(photo):
+    """
+    weak ETag of photo made of every field of its representation, so metadata written by jobs
+    with update() changes it too; count of views changes on every view and is not part of it
+    :param photo: Photo
+    :return str: ETag
+    """
+    return f'W/"photo-{photo.pk}-{_digest(*PHOTO_VALIDATOR_FIELDS(photo))}"'
+
+
+def not_modified(request, etag, last_modified=None):
+    """
+    :param request: drf or django request with If-None-Match / If-Modified-Since headers
+    :param etag: current ETag of resource
+    :param last_modified: current datetime of last change of resource
+    :return HttpResponse: 304 response if client's copy is fresh else None
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def set_validators(response, etag, last_modified=None):
+    """
+    :param response: response of gallery or photo endpoint
+    :param etag: ETag of resource
+    :param last_modified: datetime of last change of resource
+    :return response: response with ETag and Last-Modified headers
+    """
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
@@ -0,0 +1,235 @@
+"""
+write-behind buffered view counter for photos: views are summed per photo and hour, a flush adds them
+to count_of_views and to hour buckets of view analytics in one transaction
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .analytics import bucket_start, upsert
+from .cache import gallery_cache
+from .conditional import bump_gallery_versions
+from .models import Photo, ViewBucket
+
+logger = logging.getLogger(__name__)
+
+
+class LocalMemoryCounterStore:
+    """
+    pending view deltas kept in memory of the current process, next to running totals per photo
+    and ids of pending photos per owner, so reads of a few photos do not scan all deltas
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deltas = Counter()
+        self._totals = Counter()
+        self._photos_of = defaultdict(set)
+
+    def add(self, key, amount=1):
+        """
+        :param key: (photo.id, user.id, start of hour)
+        :param amount: count of new views
+        """
+        with self._lock:
+            self._deltas[key] += amount
+            self._totals[key[0]] += amount
+            self._photos_of[key[1]].add(key[0])
+
+    def total(self, pk):
+        """
+        :param pk: photo.id
+        :return int: pending views of photo in all its hours
+        """
+        with self._lock:
+            return self._totals[pk]
+
+    def totals(self, pks):
+        """
+        :param pks: photo ids
+        :return dict: {photo.id: pending views} of those photos having pending views
+        """
+        with self._lock:
+            return {pk: self._totals[pk] for pk in pks if pk in self._totals}
+
+    def totals_of_user(self, user_id):
+        """
+        :param user_id: owner of photos
+        :return dict: {photo.id: pending views} of user's photos having pending views
+        """
+        with self._lock:
+            return {pk: self._totals[pk] for pk in self._photos_of.get(user_id, ())}
+
+    def snapshot(self):
+        """
+        :return dict: {key: delta} of all pending deltas, left in the store
+        """
+        with self._lock:
+            return dict(self._deltas)
+
+    def drain(self):
+        """
+        takes all pending deltas out of the store
+        :return dict: {key: delta}
+        """
+        with self._lock:
+            deltas, self._deltas = self._deltas, Counter()
+            self._totals, self._photos_of = Counter(), defaultdict(set)
+        return dict(deltas)
+
+
+class ViewCounter:
+    """
+    collects views of photos per hour in a store and writes them as batched
+    UPDATE ... SET count_of_views = count_of_views + n statements plus upserts of hour buckets,
+    every flush_interval seconds from a background thread and on requests
+    """
+
+    def __init__(self, store=None, flush_interval=None, background=None):
+        config = getattr(settings, 'PHOTOS_VIEW_COUNTER', {})
+        if store is None:
+            store = import_string(config.get('STORE', 'photos.counters.LocalMemoryCounterStore'))()
+        if flush_interval is None:
+            flush_interval = config.get('FLUSH_INTERVAL', 5.0)
+        if background is None:
+            background = config.get('BACKGROUND_FLUSH', True)
+        self.store = store
+        self.flush_interval = flush_interval
+        self.background = background
+        self._flush_lock = threading.Lock()
+        self._flusher_lock = threading.Lock()
+        self._flusher = None
+        self._last_flush = time.monotonic()
+
+    def start_flusher(self):
+        """
+        starts the daemon thread flushing every flush_interval seconds, so views reach db
+        on an idle process too; started by the first view, once per process
+        """
+        with self._flusher_lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_periodically, name='photos-view-counter',
+                                                 daemon=True)
+                self._flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush_if_due()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('photo views flush thread failed, retrying')
+            finally:
+                close_old_connections()
+
+    def add(self, photo, amount=1, now=None):
+        """
+        registers views of photo, nothing is written to db here
+        :param photo: Photo
+        :param amount: count of views
+        :param now: moment of views, now by default
+        """
+        self.store.add((photo.pk, photo.user_id, bucket_start(now or timezone.now(), ViewBucket.HOUR)), amount)
+        if self.background and self._flusher is None:
+            self.start_flusher()
+
+    def add_many(self, photos):
+        """
+        registers one view of every photo
+        :param photos: iterable of Photo
+        """
+        start = bucket_start(timezone.now(), ViewBucket.HOUR)
+        for photo in photos:
+            self.store.add((photo.pk, photo.user_id, start), 1)
+        if self.background and self._flusher is None:
+            self.start_flusher()
+
+    def pending(self, pk):
+        """
+        :param pk: photo.id
+        :return int: views of photo not flushed to db yet
+        """
+        return self.store.total(pk)
+
+    def pending_many(self, pks):
+        """
+        :param pks: photo ids
+        :return dict: {photo.id: views not flushed to db yet} of those photos having pending views
+        """
+        return self.store.totals(pks)
+
+    def pending_of_user(self, user_id):
+        """
+        :param user_id: owner of photos
+        :return dict: {photo.id: views not flushed to db yet} of user's photos having pending views
+        """
+        return self.store.totals_of_user(user_id)
+
+    def pending_buckets(self):
+        """
+        :return dict: {(photo.id, user.id, start of hour): views not flushed to db yet}
+        """
+        return self.store.snapshot()
+
+    def flush(self):
+        """
+        writes all pending views in one transaction: one UPDATE of count_of_views per distinct delta
+        and upserts of hour buckets, views of photos deleted meanwhile are dropped. Validators and cache
+        of the owners' galleries are invalidated, as update() sends no signals and galleries show
+        count_of_views; if db fails the views are kept for the next flush, as the request or thread
+        running it has nothing to do with them
+        :return int: count of flushed views
+        """
+        with self._flush_lock:
+            self._last_flush = time.monotonic()
+            buckets = self.store.drain()
+            if not buckets:
+                return 0
+            deltas = Counter()
+            for (pk, _, _), views in buckets.items():
+                deltas[pk] += views
+            by_amount = defaultdict(list)
+            for pk, amount in deltas.items():
+                by_amount[amount].append(pk)
+            try:
+                with transaction.atomic(using=router.db_for_write(Photo)):
+                    for amount, pks in by_amount.items():
+                        Photo.objects.filter(pk__in=pks).update(count_of_views=F('count_of_views') + amount)
+                    owners = dict(Photo.objects.filter(pk__in=deltas).values_list('pk', 'user_id'))
+                    upsert({key: views for key, views in buckets.items() if key[0] in owners}, ViewBucket.HOUR)
+                    bump_gallery_versions(set(owners.values()))
+            except DatabaseError:
+                logger.exception('could not flush %s pending photo views, kept for the next flush',
+                                 sum(deltas.values()))
+                for key, views in buckets.items():
+                    self.store.add(key, views)
+                return 0
+            for user_id in set(owners.values()):
+                gallery_cache.invalidate(user_id)
+            return sum(deltas.values())
+
+    def flush_if_due(self):
+        """
+        flushes pending deltas if flush_interval seconds passed since the last flush
+        :return int: count of flushed views
+        """
+        if time.monotonic() - self._last_flush < self.flush_interval:
+            return 0
+        return self.flush()
+
+
+view_counter = ViewCounter()
+
+
+@atexit.register
+def _flush_on_exit():
+    view_counter.flush()
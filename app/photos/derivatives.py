@@ -0,0 +1,99 @@
+"""
+resized derivatives (thumbnails) of photos rendered with Pillow on a process pool
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+CONFIG = getattr(settings, 'PHOTOS_DERIVATIVES', {})
+SIZES = tuple(CONFIG.get('SIZES', (128, 512, 1600)))
+FORMATS = tuple(CONFIG.get('FORMATS', ('webp', 'jpeg')))
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+SAVE_OPTIONS = {
+    'webp': {'quality': 80, 'method': 4},
+    'jpeg': {'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def derivative_name(name, size, fmt):
+    """
+    :param name: name of original image in storage, e.g. 'cat.jpg'
+    :param size: max side of derivative in px
+    :param fmt: 'webp' or 'jpeg'
+    :return str: name of derivative next to original, e.g. 'cat_512.webp'
+    """
+    stem, _ = os.path.splitext(name)
+    return f'{stem}_{size}.{EXTENSIONS[fmt]}'
+
+
+def render_derivatives(source, targets):
+    """
+    runs in worker process: renders all derivatives of one image,
+    going from the biggest size down so every step resizes an already smaller image
+    :param source: path to original image
+    :param targets: list of (size, fmt, path)
+    :return list: paths of written files
+    """
+    written = []
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        for size in sorted({size for size, _, _ in targets}, reverse=True):
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            for target_size, fmt, path in targets:
+                if target_size != size:
+                    continue
+                result = image.convert('RGB') if fmt == 'jpeg' and image.mode != 'RGB' else image
+                result.save(path, fmt.upper(), **SAVE_OPTIONS[fmt])
+                written.append(path)
+    return written
+
+
+def get_pool():
+    """
+    :return ProcessPoolExecutor: lazily created pool shared by the process
+    """
+    global _pool  # pylint: disable=global-statement
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=CONFIG.get('WORKERS'))
+        return _pool
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error('could not render derivatives', exc_info=future.exception())
+
+
+def schedule_derivatives(name, storage):
+    """
+    sends rendering of derivatives of image to the process pool
+    :param name: name of original image in storage
+    :param storage: filesystem storage of the image
+    :return Future: resolves to list of written paths
+    """
+    targets = [(size, fmt, storage.path(derivative_name(name, size, fmt))) for size in SIZES for fmt in FORMATS]
+    future = get_pool().submit(render_derivatives, storage.path(name), targets)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def generate_derivatives(name, storage):
+    """
+    renders derivatives of image and waits for them
+    :param name: name of original image in storage
+    :param storage: filesystem storage of the image
+    :return list: paths of written files
+    """
+    return schedule_derivatives(name, storage).result()
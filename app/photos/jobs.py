@@ -0,0 +1,222 @@
+"""
+background jobs kept in the database: priority lanes, retries with backoff and idempotency keys,
+run by workers of the run_jobs command without any broker
+"""
+
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+CONFIG = getattr(settings, 'PHOTOS_JOBS', {})
+LANES = tuple(CONFIG.get('LANES', ('high', 'default', 'low')))
+DEFAULT_LANE = CONFIG.get('DEFAULT_LANE', 'default')
+MAX_ATTEMPTS = CONFIG.get('MAX_ATTEMPTS', 5)
+BACKOFF = CONFIG.get('BACKOFF', 2.0)
+MAX_BACKOFF = CONFIG.get('MAX_BACKOFF', 600.0)
+LOCK_TIMEOUT = CONFIG.get('LOCK_TIMEOUT', 600)
+KEEP_DONE = CONFIG.get('KEEP_DONE', 24 * 3600)
+POLL_INTERVAL = CONFIG.get('POLL_INTERVAL', 1.0)
+
+
+def task(lane=DEFAULT_LANE, max_attempts=MAX_ATTEMPTS):
+    """
+    marks module level function as task of jobs, it gets payload of job as keyword arguments
+    :param lane: default lane of its jobs, one of LANES
+    :param max_attempts: runs of a job before it is failed for good
+    """
+    def decorate(func):
+        func.job_name = f'{func.__module__}.{func.__qualname__}'
+        func.lane = lane
+        func.max_attempts = max_attempts
+        return func
+    return decorate
+
+
+def enqueue(func, payload=None, key=None, lane=None, delay=0):
+    """
+    queues job, in the transaction of the caller if there is one
+    :param func: function marked with @task
+    :param payload: json-ready dict of keyword arguments of func
+    :param key: idempotency key, while a job with it is queued or running that job is returned instead of a new one
+    :param lane: lane of job instead of the task's one
+    :param delay: seconds before job is due
+    :return Job: queued job
+    """
+    job = Job(name=func.job_name, payload=payload or {}, lane=lane or func.lane, max_attempts=func.max_attempts,
+              idempotency_key=key, run_at=timezone.now() + timedelta(seconds=delay))
+    if key is None:
+        job.save()
+        return job
+    while True:
+        try:
+            with transaction.atomic():
+                job.save()
+            return job
+        except IntegrityError:
+            # the existing job may finish meanwhile, then the key is free again
+            existing = Job.objects.filter(idempotency_key=key, state__in=Job.ACTIVE).first()
+            if existing is not None:
+                return existing
+            job.pk = None
+
+
+def backoff(attempts):
+    """
+    :param attempts: failed runs of job so far
+    :return float: seconds before the next run, doubled every attempt with jitter so failed jobs spread out
+    """
+    delay = min(MAX_BACKOFF, BACKOFF * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim(worker, lanes=LANES, limit=1):
+    """
+    takes due jobs, all of a higher lane before any of a lower one
+    :param worker: name of claiming worker
+    :param lanes: lanes to take jobs from, in order of priority
+    :param limit: max count of jobs
+    :return list: claimed jobs in state RUNNING
+    """
+    now = timezone.now()
+    claimed = []
+    for lane in lanes:
+        due = Job.objects.filter(state=Job.PENDING, lane=lane, run_at__lte=now).order_by('run_at', 'id')
+        for pk in due.values_list('pk', flat=True)[:limit - len(claimed)]:
+            # conditional update is atomic on every backend, of workers racing for a job only one wins
+            if Job.objects.filter(pk=pk, state=Job.PENDING).update(
+                    state=Job.RUNNING, locked_by=worker, locked_at=now, attempts=F('attempts') + 1):
+                claimed.append(pk)
+        if len(claimed) >= limit:
+            break
+    jobs = Job.objects.in_bulk(claimed)
+    return [jobs[pk] for pk in claimed]
+
+
+def finish(job, error=None):
+    """
+    records result of claimed job: done, queued again after backoff or failed after its last attempt
+    :param job: job returned by claim
+    :param error: traceback of failure, None on success
+    :return str: new state of job, None if its lock was taken over as stale
+    """
+    now = timezone.now()
+    if error is None:
+        state, changes = Job.DONE, {'finished_at': now, 'last_error': ''}
+    elif job.attempts < job.max_attempts:
+        state, changes = Job.PENDING, {'run_at': now + timedelta(seconds=backoff(job.attempts)), 'last_error': error}
+    else:
+        state, changes = Job.FAILED, {'finished_at': now, 'last_error': error}
+    updated = Job.objects.filter(pk=job.pk, state=Job.RUNNING, locked_by=job.locked_by).update(
+        state=state, locked_by='', **changes)
+    return state if updated else None
+
+
+def recover(now=None):
+    """
+    queues again jobs of crashed workers, locked for more than LOCK_TIMEOUT, and deletes
+    jobs done more than KEEP_DONE seconds ago; failed jobs are kept for inspection
+    :return tuple: (requeued, failed, deleted) counts
+    """
+    now = now or timezone.now()
+    stale = Job.objects.filter(state=Job.RUNNING, locked_at__lt=now - timedelta(seconds=LOCK_TIMEOUT))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        state=Job.FAILED, locked_by='', finished_at=now, last_error='worker lost')
+    requeued = stale.update(state=Job.PENDING, locked_by='', run_at=now, last_error='worker lost')
+    deleted, _ = Job.objects.filter(state=Job.DONE, finished_at__lt=now - timedelta(seconds=KEEP_DONE)).delete()
+    return requeued, failed, deleted
+
+
+def run(name, payload):
+    """
+    runs in pool's thread or process: calls task of job
+    :param name: Job.name, dotted path of task
+    :param payload: Job.payload
+    """
+    try:
+        import_string(name)(**payload)
+    finally:
+        close_old_connections()
+
+
+def make_pool(kind, workers):
+    """
+    :param kind: 'thread' for io-bound tasks or tasks releasing the GIL, 'process' for pure python work
+    :param workers: size of pool
+    :return Executor: pool running jobs
+    """
+    if kind == 'process':
+        # spawned processes do not share database connections of the parent, they open their own
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=django.setup)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='photos-jobs')
+
+
+class Worker:
+    """
+    claims due jobs while its pool has free slots and records their results;
+    database is used by the loop only, tasks run on the pool
+    """
+
+    def __init__(self, lanes=LANES, workers=4, pool='thread', poll_interval=POLL_INTERVAL):
+        self.name = f'{socket.gethostname()}:{os.getpid()}:{id(self):x}'
+        self.lanes = tuple(lanes)
+        self.workers = workers
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.stopping = False
+
+    def stop(self):
+        """
+        makes run() return once running jobs are finished
+        """
+        self.stopping = True
+
+    def run(self, once=False):
+        """
+        :param once: return when no job is due instead of waiting for new ones
+        :return dict: count of jobs by resulting state
+        """
+        counts = {Job.DONE: 0, Job.PENDING: 0, Job.FAILED: 0}
+        running = {}
+        recovered_at = 0.0
+        with make_pool(self.pool, self.workers) as pool:
+            while running or not self.stopping:
+                if time.monotonic() - recovered_at > min(60, LOCK_TIMEOUT):
+                    recover()
+                    recovered_at = time.monotonic()
+                if not self.stopping and len(running) < self.workers:
+                    for job in claim(self.name, self.lanes, self.workers - len(running)):
+                        running[pool.submit(run, job.name, job.payload)] = job
+                if not running:
+                    if once:
+                        break
+                    time.sleep(self.poll_interval)
+                    continue
+                done, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        logger.warning('job %s %s failed: %s', job.pk, job.name, error)
+                        error = ''.join(traceback.format_exception(error))
+                    state = finish(job, error)
+                    if state is not None:
+                        counts[state] += 1
+        return counts
@@ -0,0 +1,55 @@
+"""
+command to read metadata of images of existing photos
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from photos.metadata import extract
+from photos.models import Photo
+from photos.signals import invalidate_galleries
+
+
+class Command(BaseCommand):
+    """
+    fills metadata columns of photos uploaded before they existed; every distinct image
+    is read once on the process pool, photos sharing it are updated with one query
+    """
+    help = 'Read size, exif, dominant color, blurhash and perceptual hash of images of photos on a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--batch-size', type=int, default=500, help='images read per round')
+        parser.add_argument('--force', action='store_true', help='read again images with metadata')
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.exclude(image='')
+        if not options['force']:
+            photos = photos.filter(Q(width__isnull=True) | Q(phash__isnull=True))
+        storage = Photo.image.field.storage
+        names = photos.order_by('image').values_list('image', flat=True).distinct()
+        images = updated = failed = 0
+        last = ''
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            # keyset batches: no cursor stays open while the rows it reads are updated
+            while batch := list(names.filter(image__gt=last)[:options['batch_size']]):
+                last = batch[-1]
+                results = pool.map(extract, [storage.path(name) for name in batch])
+                with transaction.atomic():
+                    for name, metadata in zip(batch, results):
+                        if metadata['width'] is None:
+                            failed += 1
+                            self.stderr.write(f'{name}: not readable')
+                            continue
+                        updated += photos.filter(image=name).update(**metadata)
+                    # update() sends no signals, galleries of owners change here
+                    owners = Photo.objects.filter(image__in=batch).values_list('user_id', flat=True).distinct()
+                    invalidate_galleries(owners)
+                images += len(batch)
+                self.stdout.write(f'\r{images} images', ending='')
+        self.stdout.write('')
+        self.stdout.write(f'updated {updated} photos from {images - failed} images, {failed} images not readable')
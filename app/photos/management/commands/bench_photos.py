@@ -0,0 +1,68 @@
+"""
+command to benchmark photos api against a running local server
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from photos import benchmark
+from photos.models import Photo
+
+
+class Command(BaseCommand):
+    """
+    runs scenarios of benchmark.SCENARIOS against users made by seed_photos
+    and writes machine-readable results
+    """
+    help = 'Benchmark photos api: latency percentiles, throughput, query counts and rss'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--prefix', default='bench', help='prefix of seeded usernames')
+        parser.add_argument('--scenarios', default=','.join(benchmark.SCENARIOS))
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+        parser.add_argument('--server-pid', type=int, help='pid of server to sample rss of')
+        parser.add_argument('--sample-photos', type=int, default=100, help='photo ids per user to request')
+        parser.add_argument('--output', help='path of json results')
+        parser.add_argument('--compare', help='path of json results of an earlier run')
+        parser.add_argument('--no-queries', action='store_true', help='skip in-process query counting')
+
+    def handle(self, *args, **options):
+        scenarios = [name for name in options['scenarios'].split(',') if name]
+        unknown = set(scenarios) - set(benchmark.SCENARIOS)
+        if unknown:
+            raise CommandError(f'unknown scenarios: {", ".join(sorted(unknown))}')
+        users = [{'token': token.key,
+                  'photos': list(Photo.objects.filter(user_id=token.user_id).order_by('id')
+                                 .values_list('id', flat=True)[:options['sample_photos']])}
+                 for token in Token.objects.filter(user__username__startswith=f'{options["prefix"]}_')]
+        if not users:
+            raise CommandError(f'no users {options["prefix"]}_*, run seed_photos first')
+        image = benchmark.make_image(0)
+
+        results = {'meta': {**benchmark.environment(), 'base_url': options['base_url'], 'users': len(users)},
+                   'scenarios': {}}
+        for name in scenarios:
+            scenario = benchmark.Scenario(name, users, image)
+            if not scenario.users:
+                self.stderr.write(f'{name}: seeded users have no photos, skipped')
+                continue
+            metrics = benchmark.run_load(scenario, options['base_url'], options['concurrency'],
+                                         options['requests'], options['server_pid'])
+            if not options['no_queries']:
+                metrics['queries'] = benchmark.count_queries(scenario)
+            results['scenarios'][name] = metrics
+            self.stdout.write(f'{name:20} p50 {metrics["p50_ms"]:8.2f} ms  p95 {metrics["p95_ms"]:8.2f} ms  '
+                              f'p99 {metrics["p99_ms"]:8.2f} ms  {metrics["throughput_rps"]:8.1f} rps  '
+                              f'errors {metrics["errors"]}  queries {metrics.get("queries", "-")}')
+        results['meta']['bench_rss_kib'] = benchmark.own_rss_kib()
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(results, output, indent=2)
+        if options['compare']:
+            for line in benchmark.compare(results, benchmark.load_results(options['compare'])):
+                self.stdout.write(line)
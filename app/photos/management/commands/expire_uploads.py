@@ -0,0 +1,23 @@
+"""
+command to drop abandoned chunked uploads
+"""
+
+from django.core.management.base import BaseCommand
+
+from photos import uploads
+
+
+class Command(BaseCommand):
+    """
+    deletes upload sessions not finalized within the ttl with their partial files,
+    and partial files left without a session; meant to run hourly from cron
+    """
+    help = 'Delete expired upload sessions and orphaned partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=uploads.TTL,
+                            help='seconds an upload is kept since it was started')
+
+    def handle(self, *args, **options):
+        sessions, files = uploads.expire(options['ttl'])
+        self.stdout.write(f'deleted {sessions} expired uploads, removed {files} orphaned partial files')
@@ -0,0 +1,33 @@
+"""
+command to render missing derivatives of existing photos
+"""
+
+from django.core.management.base import BaseCommand
+
+from photos.derivatives import FORMATS, SIZES, derivative_name, schedule_derivatives
+from photos.models import Photo
+
+
+class Command(BaseCommand):
+    """
+    renders resized copies for photos uploaded before derivatives existed
+    """
+    help = 'Render missing derivatives of photos on the process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='render even if derivatives exist')
+
+    def handle(self, *args, **options):
+        futures = []
+        for photo in Photo.objects.exclude(image='').only('id', 'image').iterator(chunk_size=1000):
+            storage, name = photo.image.storage, photo.image.name
+            if not options['force'] and all(storage.exists(derivative_name(name, size, fmt))
+                                            for size in SIZES for fmt in FORMATS):
+                continue
+            futures.append((photo.pk, schedule_derivatives(name, storage)))
+        failed = 0
+        for pk, future in futures:
+            if future.exception() is not None:
+                failed += 1
+                self.stderr.write(f'photo {pk}: {future.exception()}')
+        self.stdout.write(f'rendered derivatives of {len(futures) - failed} photos, {failed} failed')
@@ -0,0 +1,58 @@
+"""
+command to move existing images into content-addressed storage
+"""
+
+from collections import Counter
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from photos.models import ImageBlob, Photo
+from photos.storage import ContentAddressedStorage
+
+
+class Command(BaseCommand):
+    """
+    rewrites flat MEDIA_ROOT images of photos into hash-prefixed names,
+    merges duplicates and rebuilds reference counts
+    """
+    help = 'Move images of photos into content-addressed storage and recount references'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-originals', action='store_true',
+                            help='do not delete flat files after they are moved')
+
+    def handle(self, *args, **options):
+        storage = Photo.image.field.storage
+        if not isinstance(storage, ContentAddressedStorage):
+            self.stderr.write('Photo.image does not use ContentAddressedStorage, see PHOTOS_STORAGE')
+            return
+        flat = FileSystemStorage(location=storage.location)
+        moved, missing, renamed = 0, 0, {}
+        for photo in Photo.objects.exclude(image='').only('id', 'image').iterator(chunk_size=1000):
+            old = photo.image.name
+            if storage.is_hashed(old):
+                continue
+            if old not in renamed:
+                if not flat.exists(old):
+                    missing += 1
+                    self.stderr.write(f'photo {photo.pk}: {old} does not exist')
+                    continue
+                with flat.open(old) as content:
+                    renamed[old] = storage.save(old, File(content, old))
+            Photo.objects.filter(pk=photo.pk).update(image=renamed[old])
+            moved += 1
+
+        references = Counter(Photo.objects.exclude(image='').values_list('image', flat=True).iterator())
+        with transaction.atomic():
+            ImageBlob.objects.all().delete()
+            ImageBlob.objects.bulk_create([ImageBlob(name=name, ref_count=count)
+                                           for name, count in references.items()], batch_size=1000)
+        if not options['keep_originals']:
+            for old in renamed:
+                if old not in references:
+                    flat.delete(old)
+        self.stdout.write(f'moved {moved} photos into {len(set(renamed.values()))} files, '
+                          f'{missing} images are missing, {len(references)} files are referenced')
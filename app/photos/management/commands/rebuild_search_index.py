@@ -0,0 +1,29 @@
+"""
+command to index titles and descriptions of all photos for search
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from photos import search
+from photos.models import Photo
+
+
+class Command(BaseCommand):
+    """
+    creates the search index and its triggers if they are missing and indexes all photos
+    in one pass, e.g. after restoring a dump made without them
+    """
+    help = 'Rebuild the full-text search index of photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError('the search index is kept by sqlite databases only')
+        if not search.install(connection):
+            search.rebuild(connection)
+        count = Photo.objects.using(options['database']).count()
+        self.stdout.write(f'indexed {count} photos')
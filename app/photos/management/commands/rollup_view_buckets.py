@@ -0,0 +1,25 @@
+"""
+command to compact old view analytics buckets
+"""
+
+from django.core.management.base import BaseCommand
+
+from photos import analytics
+
+
+class Command(BaseCommand):
+    """
+    folds hour buckets of old days into day buckets and drops day buckets past retention,
+    meant to run daily from cron
+    """
+    help = 'Roll up hourly photo view buckets into daily ones and delete expired daily buckets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hourly-days', type=int, default=analytics.HOURLY_DAYS,
+                            help='last days whose hourly buckets are kept')
+        parser.add_argument('--daily-days', type=int, default=analytics.DAILY_DAYS,
+                            help='last days whose daily buckets are kept')
+
+    def handle(self, *args, **options):
+        folded, deleted = analytics.rollup(options['hourly_days'], options['daily_days'])
+        self.stdout.write(f'rolled up {folded} hourly buckets, deleted {deleted} daily buckets')
@@ -0,0 +1,42 @@
+"""
+command running background jobs of photos
+"""
+
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from photos.jobs import LANES, POLL_INTERVAL, Worker
+
+
+class Command(BaseCommand):
+    """
+    worker taking due jobs from the database, higher lanes first, and running them on a pool;
+    start as many as needed on any hosts sharing the database, e.g. one per lane
+    """
+    help = 'Run queued background jobs on a thread or process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lanes', default=','.join(LANES),
+                            help='comma separated lanes to take jobs from, in order of priority')
+        parser.add_argument('--workers', type=int, default=4, help='jobs run at once')
+        parser.add_argument('--pool', choices=('thread', 'process'), default='thread')
+        parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                            help='seconds between looks for new jobs when idle')
+        parser.add_argument('--once', action='store_true', help='exit when no job is due')
+
+    def handle(self, *args, **options):
+        lanes = [lane.strip() for lane in options['lanes'].split(',') if lane.strip()]
+        unknown = set(lanes) - set(LANES)
+        if unknown or not lanes:
+            raise CommandError(f'lanes must be some of {", ".join(LANES)}')
+        if options['workers'] < 1:
+            raise CommandError('--workers must be positive')
+        worker = Worker(lanes, options['workers'], options['pool'], options['poll_interval'])
+        # running jobs are finished before exit, crashed ones come back after LOCK_TIMEOUT
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stop())
+        self.stdout.write(f'worker {worker.name}: lanes {", ".join(lanes)}, '
+                          f'{options["workers"]} {options["pool"]} workers')
+        counts = worker.run(once=options['once'])
+        self.stdout.write(f'{counts["done"]} jobs done, {counts["pending"]} to retry, {counts["failed"]} failed')
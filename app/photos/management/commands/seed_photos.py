@@ -0,0 +1,77 @@
+"""
+command to fill the database with users and photos for benchmarks
+"""
+
+import io
+from collections import Counter
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from rest_framework.authtoken.models import Token
+
+from photos.benchmark import make_image
+from photos.metadata import extract
+from photos.models import ImageBlob, Photo
+
+
+class Command(BaseCommand):
+    """
+    creates users × photos rows in batches; photos share a small set of generated images,
+    so millions of rows do not need millions of files
+    """
+    help = 'Seed users with tokens and photos for bench_photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--photos', type=int, default=1000, help='photos per user')
+        parser.add_argument('--images', type=int, default=20, help='distinct generated images')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='bench', help='prefix of usernames')
+        parser.add_argument('--password', default='bench-password')
+
+    def handle(self, *args, **options):
+        prefix, batch_size = options['prefix'], options['batch_size']
+        storage = Photo.image.field.storage
+        images = [make_image(i) for i in range(options['images'])]
+        names = [storage.save(f'{prefix}{i}.jpg', ContentFile(image)) for i, image in enumerate(images)]
+        metadata = {name: extract(io.BytesIO(image)) for name, image in zip(names, images)}
+
+        password = make_password(options['password'])
+        existing = User.objects.filter(username__startswith=f'{prefix}_').count()
+        users = User.objects.bulk_create(
+            [User(username=f'{prefix}_{existing + i}', password=password) for i in range(options['users'])],
+            batch_size=batch_size)
+        users = list(User.objects.filter(username__in=[user.username for user in users]))
+        Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users],
+                                  batch_size=batch_size)
+
+        references = Counter()
+
+        def photos():
+            for user in users:
+                for number in range(options['photos']):
+                    name = names[number % len(names)]
+                    references[name] += 1
+                    yield Photo(title=f'{prefix} photo {number}', description=f'seeded for {user.username}',
+                                image=name, user=user, **metadata[name])
+
+        created = 0
+        rows = photos()
+        while batch := list(islice(rows, batch_size)):
+            with transaction.atomic():
+                Photo.objects.bulk_create(batch)
+            created += len(batch)
+            self.stdout.write(f'\r{created} photos', ending='')
+        self.stdout.write('')
+
+        for name, count in references.items():
+            blob, is_new = ImageBlob.objects.get_or_create(name=name, defaults={'ref_count': count})
+            if not is_new:
+                ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + count)
+        self.stdout.write(f'seeded {len(users)} users ({prefix}_*) with {created} photos '
+                          f'over {len(names)} images')
@@ -0,0 +1,167 @@
+"""
+serving images of photos with access checks, HTTP ranges and conditional requests
+"""
+
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.negotiation import BaseContentNegotiation
+
+CONFIG = getattr(settings, 'PHOTOS_MEDIA', {})
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class PassThroughNegotiation(BaseContentNegotiation):
+    """
+    image responses are not rendered by drf, so Accept: image/* must not end in 406
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class FileRange:
+    """
+    file-like view of bytes [offset, offset + length) of an open file.
+    fileno() and tell() let sendfile-capable servers (gunicorn) send the range
+    straight from the page cache, read() keeps other servers within the range
+    """
+
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.remaining = length
+        file.seek(offset)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    @staticmethod
+    def seekable():
+        return False
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    :param header: value of Range header
+    :param size: size of file
+    :return tuple: (offset, length) of a single satisfiable range,
+                   None if header is absent or is not a single byte range
+    :raise ValueError: if range can not be satisfied
+    """
+    match = RANGE.match(header or '')
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = min(int(last), size)
+        if length == 0:
+            raise ValueError('range not satisfiable')
+        return size - length, length
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise ValueError('range not satisfiable')
+    return first, last - first + 1
+
+
+def if_range_holds(request, etag, mtime):
+    """
+    :param request: request with optional If-Range header
+    :param etag: current ETag of file
+    :param mtime: current modification time of file
+    :return bool: True if Range header may be applied
+    """
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    if value.startswith('"'):
+        return value == etag
+    date = parse_http_date_safe(value)
+    return date is not None and int(mtime) <= date
+
+
+def serve(request, storage, name):
+    """
+    :param request: drf request of owner of the file
+    :param storage: filesystem storage of the file
+    :param name: name of file in storage
+    :return HttpResponse: 200 / 206 / 304 / 416 response with the file or accel redirect
+    :raise Http404: if file does not exist
+    """
+    path = storage.path(name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError as e:
+        raise Http404('image does not exist') from e
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    # content-addressed names never change their bytes
+    is_hashed = getattr(storage, 'is_hashed', None)
+    immutable = is_hashed is not None and is_hashed(name)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=31536000, immutable' if immutable else 'private, no-cache',
+    }
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = build(request, path, name, stat, etag)
+    for header, value in headers.items():
+        response.setdefault(header, value)
+    return response
+
+
+def build(request, path, name, stat, etag):
+    """
+    body of serve: accel redirect, full file or its range
+    """
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    accel = CONFIG.get('ACCEL')
+    if accel == 'nginx':
+        # nginx serves the internal location itself, ranges included
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = CONFIG.get('ACCEL_PREFIX', '/protected-images/') + name
+        return response
+    if accel == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+
+    try:
+        requested = parse_range(request.headers.get('Range'), stat.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+    if requested is None or not if_range_holds(request, etag, stat.st_mtime):
+        # FileResponse is sent with wsgi.file_wrapper, which uses os.sendfile where available
+        return FileResponse(open(path, 'rb'), content_type=content_type)  # pylint: disable=consider-using-with
+    offset, length = requested
+    response = FileResponse(FileRange(open(path, 'rb'), offset, length),  # pylint: disable=consider-using-with
+                            status=206, content_type=content_type)
+    response['Content-Length'] = length
+    response['Content-Range'] = f'bytes {offset}-{offset + length - 1}/{stat.st_size}'
+    return response
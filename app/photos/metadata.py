@@ -0,0 +1,253 @@
+"""
+metadata of images: size, orientation, capture time, key exif fields, dominant color, blurhash
+and perceptual hash
+"""
+
+import math
+from datetime import datetime
+
+from django.utils import timezone
+from PIL import Image, ImageOps, TiffImagePlugin, UnidentifiedImageError
+
+HASH_CHUNKS = 4
+HASH_CHUNK_BITS = 16
+HASH_FIELDS = ('phash', *(f'phash_{index}' for index in range(HASH_CHUNKS)))
+FIELDS = ('width', 'height', 'orientation', 'taken_at', 'exif', 'dominant_color', 'blurhash', *HASH_FIELDS)
+SAMPLE_SIZE = 32
+EXIF_IFD = 0x8769
+ORIENTATION = 0x0112
+DATE_TIME_ORIGINAL = 0x9003
+OFFSET_TIME_ORIGINAL = 0x9011
+EXIF_TAGS = {
+    0x010F: 'make',
+    0x0110: 'model',
+    0xA434: 'lens_model',
+    0x829D: 'f_number',
+    0x829A: 'exposure_time',
+    0x8827: 'iso',
+    0x920A: 'focal_length',
+}
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+# srgb byte -> linear light
+LINEAR = [value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+          for value in (byte / 255 for byte in range(256))]
+
+
+def empty():
+    """
+    :return dict: values of FIELDS for an image that could not be read
+    """
+    return {'width': None, 'height': None, 'orientation': None, 'taken_at': None,
+            'exif': {}, 'dominant_color': '', 'blurhash': '', **dict.fromkeys(HASH_FIELDS)}
+
+
+def extract(file, pixels=True):
+    """
+    :param file: path or file-like object of image
+    :param pixels: False to read the header only, see read()
+    :return dict: values of FIELDS, empty() if it is not an image
+    """
+    try:
+        with Image.open(file) as image:
+            return read(image, pixels)
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError):
+        return empty()
+
+
+def field_file_metadata(image, pixels=True):
+    """
+    :param image: FieldFile of Photo.image, just uploaded or already stored
+    :param pixels: False to read the header only, see read()
+    :return dict: values of FIELDS, empty() if file is missing or is not an image
+    """
+    if not image._committed:  # pylint: disable=protected-access
+        file = image.file
+        file.seek(0)
+        try:
+            return extract(file, pixels)
+        finally:
+            file.seek(0)
+    try:
+        with image.storage.open(image.name) as file:
+            return extract(file, pixels)
+    except OSError:
+        return empty()
+
+
+def read(image, pixels=True):
+    """
+    :param image: opened Pillow image, loaded or not
+    :param pixels: False to skip decoding, dominant_color, blurhash and phash are left empty
+    :return dict: values of FIELDS; width and height are the ones of the image as displayed,
+                  after its exif orientation is applied
+    """
+    exif = image.getexif()
+    orientation = exif.get(ORIENTATION) or 1
+    width, height = image.size
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    details = exif.get_ifd(EXIF_IFD)
+    metadata = {
+        'width': width,
+        'height': height,
+        'orientation': orientation,
+        'taken_at': taken_at(details.get(DATE_TIME_ORIGINAL), details.get(OFFSET_TIME_ORIGINAL)),
+        'exif': exif_fields({**exif, **details}),
+        'dominant_color': '',
+        'blurhash': '',
+        **dict.fromkeys(HASH_FIELDS),
+    }
+    if not pixels:
+        return metadata
+    # not loaded jpeg is decoded at 1/2 .. 1/8 scale, enough for color and blurhash
+    image.draft('RGB', (SAMPLE_SIZE * 2, SAMPLE_SIZE * 2))
+    sample = ImageOps.exif_transpose(image).convert('RGB')
+    sample.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE))
+    metadata['dominant_color'] = dominant_color(sample)
+    metadata['blurhash'] = blurhash(sample, *components(sample.size))
+    metadata.update(hash_fields(dhash(sample)))
+    return metadata
+
+
+def taken_at(value, offset):
+    """
+    :param value: exif DateTimeOriginal, e.g. '2024:05:01 12:30:00'
+    :param offset: exif OffsetTimeOriginal, e.g. '+03:00', or None
+    :return datetime: aware capture time, in current time zone when the offset is unknown; None if invalid
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        if isinstance(offset, str) and offset.strip():
+            return datetime.strptime(f'{value.strip()}{offset.strip()}', '%Y:%m:%d %H:%M:%S%z')
+        return timezone.make_aware(datetime.strptime(value.strip(), '%Y:%m:%d %H:%M:%S'))
+    except (ValueError, OverflowError):
+        return None
+
+
+def exif_fields(tags):
+    """
+    :param tags: exif tags by number
+    :return dict: json-ready EXIF_TAGS values
+    """
+    fields = {}
+    for tag, name in EXIF_TAGS.items():
+        value = tags.get(tag)
+        if isinstance(value, tuple) and len(value) == 1:
+            value = value[0]
+        if isinstance(value, TiffImagePlugin.IFDRational):
+            value = round(float(value), 6) if value.denominator else None
+        elif isinstance(value, str):
+            value = value.strip('\x00 ')
+        elif not isinstance(value, int):
+            value = None
+        if value not in (None, ''):
+            fields[name] = value
+    return fields
+
+
+def dhash(sample):
+    """
+    difference hash: bit per pair of horizontally adjacent pixels of 9x8 grayscale image,
+    stable under re-encoding, resizing and small color changes
+    :param sample: small rgb image
+    :return int: unsigned 64 bit hash
+    """
+    pixels = list(sample.convert('L').resize((9, 8), Image.Resampling.BILINEAR).getdata())
+    value = 0
+    for y in range(8):
+        row = pixels[y * 9:(y + 1) * 9]
+        for left, right in zip(row, row[1:]):
+            value = value << 1 | (left > right)
+    return value
+
+
+def hash_fields(value):
+    """
+    :param value: unsigned 64 bit perceptual hash
+    :return dict: values of HASH_FIELDS: the hash as signed 64 bit int fitting BigIntegerField
+                  and its HASH_CHUNKS chunks for multi-index lookup
+    """
+    fields = {'phash': value - (1 << 64) if value >= 1 << 63 else value}
+    for index in range(HASH_CHUNKS):
+        fields[f'phash_{index}'] = value >> (HASH_CHUNK_BITS * index) & (1 << HASH_CHUNK_BITS) - 1
+    return fields
+
+
+def dominant_color(sample):
+    """
+    :param sample: small rgb image
+    :return str: most frequent color of 8-color palette of sample, e.g. '#a0b1c2'
+    """
+    quantized = sample.quantize(colors=8)
+    _, index = max(quantized.getcolors())
+    red, green, blue = quantized.getpalette()[index * 3:index * 3 + 3]
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def components(size):
+    """
+    :param size: (width, height) of sample
+    :return tuple: blurhash components along x and y, more along the longer side
+    """
+    width, height = size
+    return (4, 3) if width >= height else (3, 4)
+
+
+def encode83(value, length):
+    """
+    :return str: value in base83 of blurhash
+    """
+    return ''.join(BASE83[value // 83 ** (length - position - 1) % 83] for position in range(length))
+
+
+def to_srgb(value):
+    """
+    :param value: linear light 0..1
+    :return int: srgb byte
+    """
+    value = min(max(value, 0.0), 1.0)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(sample, x_components, y_components):
+    """
+    :param sample: small rgb image
+    :param x_components: 1..9 cosine components along x
+    :param y_components: 1..9 cosine components along y
+    :return str: blurhash of sample, see https://github.com/woltapp/blurhash
+    """
+    width, height = sample.size
+    pixels = [(LINEAR[red], LINEAR[green], LINEAR[blue]) for red, green, blue in sample.getdata()]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            scale = (1 if i == j == 0 else 2) / (width * height)
+            red = green = blue = 0.0
+            for y in range(height):
+                row, weight_y = pixels[y * width:(y + 1) * width], cos_y[j][y] * scale
+                for x, (pixel_red, pixel_green, pixel_blue) in enumerate(row):
+                    weight = cos_x[i][x] * weight_y
+                    red += weight * pixel_red
+                    green += weight * pixel_green
+                    blue += weight * pixel_blue
+            factors.append((red, green, blue))
+
+    dc, ac = factors[0], factors[1:]
+    result = encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantized = max(0, min(82, int(max(abs(value) for factor in ac for value in factor) * 166 - 0.5)))
+        maximum = (quantized + 1) / 166
+    else:
+        quantized, maximum = 0, 1.0
+    result += encode83(quantized, 1)
+    result += encode83((to_srgb(dc[0]) << 16) + (to_srgb(dc[1]) << 8) + to_srgb(dc[2]), 4)
+    for factor in ac:
+        red, green, blue = (max(0, min(18, int(math.copysign(abs(value / maximum) ** 0.5, value) * 9 + 9.5)))
+                            for value in factor)
+        result += encode83(red * 19 * 19 + green * 19 + blue, 2)
+    return result
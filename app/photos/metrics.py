@@ -0,0 +1,302 @@
+"""
+per request timings of auth, db, serialization and rendering phases,
+their per-endpoint histograms and prometheus text exposition of them
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .authentication import token_cache
+from .cache import gallery_cache
+
+CONFIG = getattr(settings, 'PHOTOS_METRICS', {})
+SECONDS_BUCKETS = tuple(CONFIG.get('BUCKETS', (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                                                0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)))
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = ContextVar('photos_request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    seconds spent in phases of one request, count and total time of its sql queries
+    """
+    __slots__ = ('started', 'phases', 'queries', 'db', 'open')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.queries = 0
+        self.db = 0.0
+        self.open = set()
+
+    def add(self, name, seconds):
+        """
+        :param name: name of phase
+        :param seconds: time spent in phase
+        """
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def server_timing(self, total):
+        """
+        :param total: seconds from start of request to response
+        :return str: value of Server-Timing header, durations in ms
+        """
+        entries = [f'{name};dur={seconds * 1000:.3f}' for name, seconds in self.phases.items()]
+        entries.append(f'db;dur={self.db * 1000:.3f};desc="{self.queries} queries"')
+        entries.append(f'total;dur={total * 1000:.3f}')
+        return ', '.join(entries)
+
+
+def start_request():
+    """
+    starts collecting timings in the current context
+    :return tuple: (RequestTimings, token for finish_request)
+    """
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def finish_request(token):
+    """
+    stops collecting timings started by start_request
+    """
+    _current.reset(token)
+
+
+class Phase:
+    """
+    context manager adding time of its block to phase of current request,
+    nested blocks of the same phase are counted once, outside of a request it does nothing
+    """
+    __slots__ = ('name', 'timings', 'started')
+
+    def __init__(self, name):
+        self.name = name
+        self.timings = None
+        self.started = 0.0
+
+    def start(self):
+        """
+        :return Phase: self, timing from now if a request is being measured
+        """
+        timings = _current.get()
+        if timings is not None and self.name not in timings.open:
+            timings.open.add(self.name)
+            self.timings = timings
+            self.started = time.perf_counter()
+        return self
+
+    def stop(self):
+        """
+        adds time since start to the phase
+        """
+        if self.timings is not None:
+            self.timings.add(self.name, time.perf_counter() - self.started)
+            self.timings.open.discard(self.name)
+            self.timings = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+
+def sql_timer(execute, sql, params, many, context):
+    """
+    execute wrapper of every db connection, counts queries and their time for current request
+    """
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.db += time.perf_counter() - started
+
+
+def install_sql_timer(sender, connection, **kwargs):  # pylint: disable=unused-argument
+    """
+    connection_created receiver: adds sql_timer to the new connection once
+    """
+    if sql_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, sql_timer)
+
+
+class TimedAuthenticationMixin:
+    """
+    mixin of drf views: authentication is measured as the 'auth' phase
+    """
+
+    def perform_authentication(self, request):
+        with Phase('auth'):
+            super().perform_authentication(request)
+
+
+def escape(value):
+    """
+    :param value: label value
+    :return str: value escaped for prometheus text format
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=''):
+    """
+    :return str: '{name="value",...}' or '' without labels
+    """
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """
+    prometheus histogram with fixed buckets, one series per tuple of label values
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, value):
+        """
+        :param labels: tuple of label values in order of labelnames
+        :param value: observed value
+        """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # per bucket counts, the last one is +Inf; sum; count
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        """
+        :return list: lines of prometheus text format
+        """
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count)
+                        for labels, (counts, total, count) in self._series.items()]
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, amount in zip(self.buckets + ('+Inf',), counts):
+                cumulative += amount
+                bucket = format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{bucket} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Counter:
+    """
+    prometheus counter, one series per tuple of label values
+    """
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, labels, amount=1):
+        """
+        :param labels: tuple of label values in order of labelnames
+        :param amount: increment
+        """
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def collect(self):
+        """
+        :return list: lines of prometheus text format
+        """
+        with self._lock:
+            snapshot = sorted(self._series.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{format_labels(self.labelnames, labels)} {value}' for labels, value in snapshot)
+        return lines
+
+
+class Registry:
+    """
+    metrics of requests served by this process
+    """
+
+    def __init__(self):
+        self.requests = Counter('photos_requests_total', 'Requests by endpoint, method and status.',
+                                ('endpoint', 'method', 'status'))
+        self.duration = Histogram('photos_request_duration_seconds', 'Time from request to response.',
+                                  ('endpoint', 'method'), SECONDS_BUCKETS)
+        self.phases = Histogram('photos_request_phase_seconds',
+                                'Time spent in auth, db, serialize and render phases of a request.',
+                                ('endpoint', 'phase'), SECONDS_BUCKETS)
+        self.queries = Histogram('photos_request_queries', 'SQL queries per request.',
+                                 ('endpoint',), QUERIES_BUCKETS)
+
+    def observe(self, endpoint, method, status, timings, total):
+        """
+        :param endpoint: name of the matched url pattern
+        :param method: http method
+        :param status: http status of response
+        :param timings: RequestTimings of request
+        :param total: seconds from request to response
+        """
+        self.requests.inc((endpoint, method, str(status)))
+        self.duration.observe((endpoint, method), total)
+        for name, seconds in timings.phases.items():
+            self.phases.observe((endpoint, name), seconds)
+        self.phases.observe((endpoint, 'db'), timings.db)
+        self.queries.observe((endpoint,), timings.queries)
+
+    def collect(self):
+        """
+        :return str: all metrics in prometheus text format
+        """
+        lines = []
+        for metric in (self.requests, self.duration, self.phases, self.queries):
+            lines.extend(metric.collect())
+        for cache, stats in (('gallery', gallery_cache.stats()), ('token', token_cache.stats())):
+            for name in ('hits', 'misses'):
+                lines.append(f'# TYPE photos_{cache}_cache_{name}_total counter')
+                lines.append(f'photos_{cache}_cache_{name}_total {stats[name]}')
+        lines.append('# TYPE photos_token_cache_entries gauge')
+        lines.append(f'photos_token_cache_entries {token_cache.stats()["entries"]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def export(request):
+    """
+    prometheus scrape endpoint with metrics of this process
+    :param request: method GET from an address of PHOTOS_METRICS['ALLOWED_IPS'], 127.0.0.1 only by default,
+                    any address if it is None
+    :return HttpResponse: metrics in prometheus text format
+    """
+    allowed = CONFIG.get('ALLOWED_IPS', ['127.0.0.1'])
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.collect(), content_type=CONTENT_TYPE)
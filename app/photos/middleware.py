@@ -0,0 +1,125 @@
+"""
+middleware of photos: request timings for Server-Timing header and /metrics,
+routing of reads to database replicas
+"""
+
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.cache import caches
+
+from . import routers
+from .metrics import CONFIG, Phase, finish_request, registry, start_request
+
+
+class PerformanceMiddleware:
+    """
+    times the request and its auth / db / serialize / render phases, counts sql queries,
+    adds them to Server-Timing header and per-endpoint histograms of metrics.registry.
+    Works in both sync and async mode, so it never moves a request to another thread.
+    Should be the first middleware to include the others in 'total'
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = CONFIG.get('SERVER_TIMING', True)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # async handler would run a sync hook in a thread
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings, token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            finish_request(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings, token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            finish_request(token)
+        return self.finish(request, response, timings)
+
+    def process_template_response(self, request, response):  # pylint: disable=method-hidden,unused-argument
+        """
+        drf responses are rendered after the view returned, time it as the 'render' phase
+        """
+        timer = Phase('render').start()
+        response.add_post_render_callback(lambda rendered: timer.stop())
+        return response
+
+    async def aprocess_template_response(self, request, response):
+        """
+        async version of process_template_response
+        """
+        return self.process_template_response(request, response)
+
+    def finish(self, request, response, timings):
+        """
+        :return HttpResponse: response with Server-Timing header, timings are added to registry
+        """
+        total = time.perf_counter() - timings.started
+        match = getattr(request, 'resolver_match', None)
+        endpoint = match.view_name if match is not None else 'unmatched'
+        registry.observe(endpoint, request.method, response.status_code, timings, total)
+        if self.server_timing:
+            response['Server-Timing'] = timings.server_timing(total)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    routes reads of the request with photos.routers, a client that made a successful
+    unsafe request reads from the primary for routers.STICKY_SECONDS afterwards
+    to see its own writes. The pin is kept in cache routers.CACHE, shared by all workers
+    if the cache is. Does nothing without replicas
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not routers.REPLICAS:
+            return self.get_response(request)
+        key = routers.pin_key(request)
+        cache = caches[routers.CACHE]
+        pinned = key is not None and request.method in routers.SAFE_METHODS and cache.get(key) is not None
+        token = routers.route_request(request, pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.end_request(token)
+        if key is not None and routers.must_pin(request, response):
+            cache.set(key, True, routers.STICKY_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        if not routers.REPLICAS:
+            return await self.get_response(request)
+        key = routers.pin_key(request)
+        cache = caches[routers.CACHE]
+        pinned = key is not None and request.method in routers.SAFE_METHODS and await cache.aget(key) is not None
+        token = routers.route_request(request, pinned)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.end_request(token)
+        if key is not None and routers.must_pin(request, response):
+            await cache.aset(key, True, routers.STICKY_SECONDS)
+        return response
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['user', 'date_of_creation', 'id'], name='photo_user_date_id_idx'),
+        ),
+    ]
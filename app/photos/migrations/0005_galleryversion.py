@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('photos', '0004_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GalleryVersion',
+            fields=[
+                ('user', models.OneToOneField(editable=False, on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('version', models.PositiveBigIntegerField(default=1)),
+                ('date_of_change', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:10
+
+from django.db import migrations
+
+from photos import search
+
+
+def install_search_index(apps, schema_editor):
+    search.install(schema_editor.connection)
+
+
+def uninstall_search_index(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0008_photo_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index, elidable=False),
+    ]
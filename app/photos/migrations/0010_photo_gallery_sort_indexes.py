@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0009_photo_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['user', 'count_of_views', 'id', 'date_of_creation'],
+                               name='photo_user_views_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['user', 'title', 'id', 'date_of_creation'], name='photo_user_title_id_idx'),
+        ),
+    ]
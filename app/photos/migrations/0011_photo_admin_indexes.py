@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photos', '0010_photo_gallery_sort_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['date_of_creation', 'id'], name='photo_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(condition=models.Q(('duplicate_of__isnull', False)), fields=['date_of_creation', 'id'],
+                               name='photo_duplicate_date_id_idx'),
+        ),
+    ]
@@ -2,8 +2,16 @@
 here are models for photos app
 """
 
+import uuid
+
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
+
+from .storage import photo_storage
+
+# largest primary key of BigAutoField, a bigger id overflows the db parameter
+MAX_PHOTO_ID = 2 ** 63 - 1
 
 
 class Photo(models.Model):
@@ -14,6 +22,148 @@ class Photo(models.Model):
     description = models.CharField(max_length=512, default='')
     count_of_views = models.PositiveIntegerField(default=0, editable=False)
     date_of_creation = models.DateField(auto_now_add=True, editable=False)
-    image = models.ImageField(null=False, blank=False)
+    image = models.ImageField(null=False, blank=False, storage=photo_storage)
+    user = models.ForeignKey(User, verbose_name='Пользователь',
+                             on_delete=models.CASCADE, editable=False)
+    # metadata of image, see photos.metadata; width and height are the displayed ones
+    width = models.PositiveIntegerField(null=True, editable=False)
+    height = models.PositiveIntegerField(null=True, editable=False)
+    orientation = models.PositiveSmallIntegerField(null=True, editable=False)
+    taken_at = models.DateTimeField(null=True, editable=False)
+    exif = models.JSONField(default=dict, editable=False)
+    dominant_color = models.CharField(max_length=7, default='', editable=False)
+    blurhash = models.CharField(max_length=64, default='', editable=False)
+    # perceptual hash and its 16 bit chunks, each indexed per user, see photos.similarity
+    phash = models.BigIntegerField(null=True, editable=False)
+    phash_0 = models.PositiveIntegerField(null=True, editable=False)
+    phash_1 = models.PositiveIntegerField(null=True, editable=False)
+    phash_2 = models.PositiveIntegerField(null=True, editable=False)
+    phash_3 = models.PositiveIntegerField(null=True, editable=False)
+    duplicate_of = models.ForeignKey('self', null=True, related_name='duplicates',
+                                     on_delete=models.SET_NULL, editable=False)
+
+    class Meta:
+        """
+        Meta class
+        """
+        indexes = [
+            models.Index(fields=['user', 'date_of_creation', 'id'], name='photo_user_date_id_idx'),
+            # sorts of gallery, date_of_creation lets a date range be checked without reading rows
+            models.Index(fields=['user', 'count_of_views', 'id', 'date_of_creation'], name='photo_user_views_id_idx'),
+            models.Index(fields=['user', 'title', 'id', 'date_of_creation'], name='photo_user_title_id_idx'),
+            # admin changelist of all users: its order and date filter
+            models.Index(fields=['date_of_creation', 'id'], name='photo_date_id_idx'),
+            models.Index(fields=['date_of_creation', 'id'], name='photo_duplicate_date_id_idx',
+                         condition=models.Q(duplicate_of__isnull=False)),
+            models.Index(fields=['user', 'phash_0'], name='photo_user_phash_0_idx'),
+            models.Index(fields=['user', 'phash_1'], name='photo_user_phash_1_idx'),
+            models.Index(fields=['user', 'phash_2'], name='photo_user_phash_2_idx'),
+            models.Index(fields=['user', 'phash_3'], name='photo_user_phash_3_idx'),
+        ]
+
+
+class UploadSession(models.Model):
+    """
+    resumable upload of photo's image sent in chunks
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    title = models.CharField(max_length=256, null=False, blank=False)
+    description = models.CharField(max_length=512, default='')
+    file_name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0, editable=False)
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    date_of_creation = models.DateTimeField(auto_now_add=True, editable=False)
     user = models.ForeignKey(User, verbose_name='Пользователь',
                              on_delete=models.CASCADE, editable=False)
+
+
+class ImageBlob(models.Model):
+    """
+    stored image file shared by photos with equal content,
+    kept with ref_count 0 until tasks.delete_image removes the file
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    ref_count = models.PositiveIntegerField(default=0)
+
+
+class GalleryVersion(models.Model):
+    """
+    version of user's gallery bumped on every change of his photos,
+    validator of gallery responses
+    """
+    user = models.OneToOneField(User, verbose_name='Пользователь', primary_key=True,
+                                on_delete=models.CASCADE, editable=False)
+    version = models.PositiveBigIntegerField(default=1)
+    date_of_change = models.DateTimeField(auto_now=True)
+
+
+class Job(models.Model):
+    """
+    background job run by run_jobs workers, see photos.jobs
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = [(PENDING, 'pending'), (RUNNING, 'running'), (DONE, 'done'), (FAILED, 'failed')]
+    ACTIVE = (PENDING, RUNNING)
+
+    name = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    lane = models.CharField(max_length=32, default='default')
+    state = models.CharField(max_length=16, choices=STATES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
+    locked_by = models.CharField(max_length=255, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    date_of_creation = models.DateTimeField(auto_now_add=True, editable=False)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        """
+        Meta class
+        """
+        indexes = [
+            models.Index(fields=['state', 'lane', 'run_at', 'id'], name='job_state_lane_run_at_idx'),
+        ]
+        constraints = [
+            # one queued or running job per key, a finished key can be queued again
+            models.UniqueConstraint(fields=['idempotency_key'], condition=models.Q(state__in=('pending', 'running')),
+                                    name='job_active_idempotency_key'),
+        ]
+
+
+class ViewBucket(models.Model):
+    """
+    views of a photo within one hour or one day starting at start (UTC), see photos.analytics
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    RESOLUTIONS = [(HOUR, 'hour'), (DAY, 'day')]
+
+    # indexed by the constraint and the indexes below
+    photo = models.ForeignKey(Photo, related_name='view_buckets', on_delete=models.CASCADE, db_index=False)
+    # owner of photo, series of a whole gallery read its buckets without the photos
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    resolution = models.CharField(max_length=4, choices=RESOLUTIONS)
+    start = models.DateTimeField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        """
+        Meta class
+        """
+        indexes = [
+            # covers series of a gallery
+            models.Index(fields=['user', 'start', 'resolution', 'views'], name='viewbucket_user_start_idx'),
+            # rollup and retention
+            models.Index(fields=['resolution', 'start'], name='viewbucket_res_start_idx'),
+        ]
+        constraints = [
+            # conflict target of upserts, also serves series of a photo
+            models.UniqueConstraint(fields=['photo', 'resolution', 'start'], name='viewbucket_photo_resolution_start'),
+        ]
@@ -0,0 +1,246 @@
+"""
+keyset (cursor) pagination for photos
+"""
+
+import base64
+import binascii
+import json
+from datetime import date
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+def encode_cursor(values):
+    """
+    pack ordering values of the last row into an opaque cursor
+    :param values: list of json serializable values
+    :return str: url-safe cursor
+    """
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """
+    unpack cursor made by encode_cursor
+    :param cursor: str from query string
+    :param length: expected count of values
+    :return list: ordering values
+    :raise ValueError: if cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError('invalid cursor') from e
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError('invalid cursor')
+    return values
+
+
+class KeysetPagination(BasePagination):
+    """
+    paginates queryset by a unique ordering instead of OFFSET,
+    so every page is an index range scan starting right after the previous one
+    """
+    ordering = ('id',)
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 500
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+        self.size = self.page_size
+        self.context = []
+        self.next_cursor = None
+
+    def get_page_size(self, request):
+        """
+        page size from query string bounded by max_page_size
+        :param request: drf or django request
+        :return int: page size
+        """
+        try:
+            size = int(request.GET[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_cursor_context(self, request):
+        """
+        :param request: drf or django request
+        :return list: query params the rows of pages depend on, kept in cursors so a cursor
+                      is not followed with other ones; none by default
+        """
+        return []
+
+    def get_cursor_values(self, queryset, cursor):
+        """
+        :param queryset: paginated queryset
+        :param cursor: cursor from query string
+        :return list: ordering values of the cursor converted to types of their fields
+        :raise ValueError: if cursor is malformed, made for another context or a value does not fit its field
+        """
+        values = decode_cursor(cursor, len(self.context) + len(self.ordering))
+        if values[:len(self.context)] != self.context:
+            raise ValueError('cursor was made for another sort or date range')
+        values = values[len(self.context):]
+        opts = queryset.model._meta
+        try:
+            values = [opts.get_field(name.lstrip('-')).to_python(value) for name, value in zip(self.ordering, values)]
+        except (ValidationError, TypeError) as e:
+            raise ValueError('invalid cursor') from e
+        if None in values:
+            raise ValueError('invalid cursor')
+        return values
+
+    def get_keyset_filter(self, values):
+        """
+        builds condition "row goes after values" for the current ordering
+        :param values: ordering values of the last row of previous page
+        :return Q: filter condition
+        """
+        fields = [(name.lstrip('-'), 'lt' if name.startswith('-') else 'gt') for name in self.ordering]
+        after = Q()
+        for position in reversed(range(len(fields))):
+            name, lookup = fields[position]
+            step = Q(**{f'{name}__{lookup}': values[position]})
+            if position < len(fields) - 1:
+                step |= Q(**{name: values[position]}) & after
+            after = step
+        # leading bound lets the database start an index range scan
+        name, lookup = fields[0]
+        return Q(**{f'{name}__{lookup}e': values[0]}) & after
+
+    def get_page_queryset(self, queryset, request):
+        """
+        :param queryset: unordered queryset (model instances or values())
+        :param request: drf or django request with optional cursor and page_size
+        :return QuerySet: ordered slice holding the page and one row more
+        :raise ValueError: if cursor is malformed
+        """
+        self.size = self.get_page_size(request)
+        self.context = self.get_cursor_context(request)
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.GET.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.get_keyset_filter(self.get_cursor_values(queryset, cursor)))
+        return queryset[:self.size + 1]
+
+    def get_page(self, rows):
+        """
+        :param rows: evaluated get_page_queryset
+        :return list: rows of the page, next_cursor is set if more rows follow
+        """
+        self.next_cursor = None
+        if len(rows) > self.size:
+            rows = rows[:self.size]
+            self.next_cursor = encode_cursor(self.context + [self.get_value(rows[-1], name.lstrip('-'))
+                                                             for name in self.ordering])
+        return rows
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        :param queryset: unordered queryset (model instances or values())
+        :param request: drf request with optional cursor and page_size
+        :param view: view, unused
+        :return list: rows of the requested page
+        :raise ValueError: if cursor is malformed
+        """
+        return self.get_page(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """
+        async version of paginate_queryset
+        :param queryset: unordered queryset (model instances or values())
+        :param request: django request with optional cursor and page_size
+        :return list: rows of the requested page
+        :raise ValueError: if cursor is malformed
+        """
+        return self.get_page([row async for row in self.get_page_queryset(queryset, request)])
+
+    @staticmethod
+    def get_value(row, name):
+        """
+        :param row: dict from values() or model instance
+        :param name: field name
+        :return: value of field
+        """
+        if isinstance(row, dict):
+            return row[name]
+        return getattr(row, name)
+
+    def get_paginated_response(self, data):
+        """
+        :param data: serialized rows of the page
+        :return Response: rows with cursor of the next page
+        """
+        return Response({'results': data, 'next': self.next_cursor})
+
+
+class GalleryPagination(KeysetPagination):
+    """
+    user's gallery pages ordered by one of SORTS, by default (date_of_creation, id),
+    optionally limited to a range of date_of_creation; every sort is a range scan
+    of its photo_user_*_idx in either direction, the date range is checked on its entries
+    """
+    SORTS = {
+        'date': ('date_of_creation', 'id'),
+        '-date': ('-date_of_creation', '-id'),
+        'views': ('count_of_views', 'id'),
+        '-views': ('-count_of_views', '-id'),
+        'title': ('title', 'id'),
+        '-title': ('-title', '-id'),
+    }
+    ordering = SORTS['date']
+    sort_query_param = 'sort'
+    date_from_query_param = 'date_from'
+    date_to_query_param = 'date_to'
+    page_size = getattr(settings, 'PHOTOS_GALLERY_PAGE_SIZE', 100)
+    max_page_size = getattr(settings, 'PHOTOS_GALLERY_MAX_PAGE_SIZE', 500)
+
+    def get_ordering(self, request):
+        """
+        :param request: drf or django request with optional 'sort' query param
+        :return tuple: ordering of the sort
+        :raise ValueError: if sort is unknown
+        """
+        sort = request.GET.get(self.sort_query_param, 'date')
+        if sort not in self.SORTS:
+            raise ValueError(f'sort must be one of {", ".join(self.SORTS)}')
+        return self.SORTS[sort]
+
+    def get_cursor_context(self, request):
+        """
+        :param request: drf or django request
+        :return list: sort and date range, a cursor only continues pages of the same ones
+        """
+        return [request.GET.get(self.sort_query_param, 'date'), request.GET.get(self.date_from_query_param, ''),
+                request.GET.get(self.date_to_query_param, '')]
+
+    def filter_queryset(self, queryset, request):
+        """
+        :param queryset: queryset of user's photos
+        :param request: drf or django request with optional 'date_from' and 'date_to' query params,
+                        inclusive dates as YYYY-MM-DD
+        :return QuerySet: photos created in the range
+        :raise ValueError: if a date is malformed
+        """
+        for param, lookup in ((self.date_from_query_param, 'gte'), (self.date_to_query_param, 'lte')):
+            value = request.GET.get(param)
+            if value:
+                try:
+                    queryset = queryset.filter(**{f'date_of_creation__{lookup}': date.fromisoformat(value)})
+                except ValueError as e:
+                    raise ValueError(f'invalid {param}') from e
+        return queryset
+
+    def get_page_queryset(self, queryset, request):
+        self.ordering = self.get_ordering(request)
+        return super().get_page_queryset(self.filter_queryset(queryset, request), request)
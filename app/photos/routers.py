@@ -0,0 +1,91 @@
+"""
+database router sending reads of safe requests to replicas and everything else to the primary
+"""
+
+import hashlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+CONFIG = getattr(settings, 'PHOTOS_DB_ROUTING', {})
+PRIMARY = CONFIG.get('PRIMARY', DEFAULT_DB_ALIAS)
+REPLICAS = tuple(CONFIG.get('REPLICAS', ()))
+STICKY_SECONDS = CONFIG.get('STICKY_SECONDS', 5)
+CACHE = CONFIG.get('CACHE', 'default')
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+_route = ContextVar('photos_db_route', default=None)
+
+
+def pin_key(request):
+    """
+    :param request: django request
+    :return str: cache key of client's credentials (token or session), None for anonymous client
+    """
+    credentials = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credentials:
+        return None
+    return 'photos:db-pin:' + hashlib.sha256(credentials.encode()).hexdigest()
+
+
+def route_request(request, pinned):
+    """
+    chooses database of reads made while handling request in the current context
+    :param request: django request
+    :param pinned: True if client wrote recently and must read its own writes
+    :return Token: token for end_request
+    """
+    if pinned or request.method not in SAFE_METHODS or not REPLICAS:
+        alias = PRIMARY
+    else:
+        # one replica per request, so its reads see one consistent state
+        alias = random.choice(REPLICAS)
+    return _route.set(alias)
+
+
+def end_request(token):
+    """
+    restores routing of reads to the state before route_request
+    """
+    _route.reset(token)
+
+
+def must_pin(request, response):
+    """
+    :return bool: True if client's next reads must go to the primary for STICKY_SECONDS
+    """
+    return request.method not in SAFE_METHODS and response.status_code < 400
+
+
+class PrimaryReplicaRouter:
+    """
+    reads of GET / HEAD / OPTIONS requests go to a replica chosen by route_request,
+    reads of unsafe requests, of recently writing clients, inside transactions and
+    outside of requests (commands, workers) go to the primary, writes always go to the primary
+    """
+
+    def __init__(self, primary=PRIMARY, replicas=REPLICAS):
+        self.primary = primary
+        self.pool = {primary, *replicas}
+
+    def db_for_read(self, model, **hints):  # pylint: disable=unused-argument
+        alias = _route.get()
+        if alias is None or connections[self.primary].in_atomic_block:
+            return self.primary
+        return alias
+
+    def db_for_write(self, model, **hints):  # pylint: disable=unused-argument
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):  # pylint: disable=unused-argument
+        if obj1._state.db in self.pool and obj2._state.db in self.pool:  # pylint: disable=protected-access
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):  # pylint: disable=unused-argument
+        if db in self.pool:
+            # replicas get schema and data from the primary
+            return db == self.primary
+        return None
@@ -0,0 +1,152 @@
+"""
+full-text search over titles and descriptions of photos with a sqlite FTS5 index kept in sync by triggers.
+Every word is indexed as '<user id>_<word>', so a query reads doclists of one user only and
+bm25 counts documents among the user's photos, the cost does not grow with photos of others.
+Words are split by photos_search_text(), a sql function registered on connections made by django;
+photos_photo written by other clients needs it too
+"""
+
+import re
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Q
+
+from .models import Photo
+
+CONFIG = getattr(settings, 'PHOTOS_SEARCH', {})
+TITLE_WEIGHT = CONFIG.get('TITLE_WEIGHT', 10.0)
+DESCRIPTION_WEIGHT = CONFIG.get('DESCRIPTION_WEIGHT', 1.0)
+PAGE_SIZE = CONFIG.get('PAGE_SIZE', 20)
+MAX_PAGE_SIZE = CONFIG.get('MAX_PAGE_SIZE', 100)
+MAX_TERMS = CONFIG.get('MAX_TERMS', 8)
+TERM = re.compile(r'\w+')
+
+TABLE = Photo._meta.db_table
+INDEX = f'{TABLE}_fts'
+FUNCTION = 'photos_search_text'
+OLD_ROW = f'old.id, {FUNCTION}(old.user_id, old.title), {FUNCTION}(old.user_id, old.description)'
+NEW_ROW = f'new.id, {FUNCTION}(new.user_id, new.title), {FUNCTION}(new.user_id, new.description)'
+# contentless index: texts stay in photos_photo only, triggers pass old values to 'delete'
+INSTALL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX} USING fts5("
+    f"title, description, content='', tokenize=\"unicode61 remove_diacritics 2 tokenchars '_'\")",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_insert AFTER INSERT ON {TABLE} BEGIN "
+    f"INSERT INTO {INDEX}(rowid, title, description) VALUES ({NEW_ROW}); END",
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_delete AFTER DELETE ON {TABLE} BEGIN "
+    f"INSERT INTO {INDEX}({INDEX}, rowid, title, description) VALUES ('delete', {OLD_ROW}); END",
+    # view counter flushes and metadata updates do not touch the index
+    f"CREATE TRIGGER IF NOT EXISTS {INDEX}_update AFTER UPDATE OF title, description, user_id ON {TABLE} BEGIN "
+    f"INSERT INTO {INDEX}({INDEX}, rowid, title, description) VALUES ('delete', {OLD_ROW}); "
+    f"INSERT INTO {INDEX}(rowid, title, description) VALUES ({NEW_ROW}); END",
+)
+UNINSTALL = (
+    f'DROP TRIGGER IF EXISTS {INDEX}_insert',
+    f'DROP TRIGGER IF EXISTS {INDEX}_delete',
+    f'DROP TRIGGER IF EXISTS {INDEX}_update',
+    f'DROP TABLE IF EXISTS {INDEX}',
+)
+SEARCH = (
+    f'SELECT {TABLE}.* FROM {INDEX} JOIN {TABLE} ON {TABLE}.id = {INDEX}.rowid '
+    f'WHERE {INDEX} MATCH %s AND {TABLE}.user_id = %s '
+    f'ORDER BY bm25({INDEX}, %s, %s), {TABLE}.id DESC LIMIT %s OFFSET %s'
+)
+
+
+def search_text(user_id, text):
+    """
+    sql function photos_search_text
+    :param user_id: owner of photo
+    :param text: title or description
+    :return str: words of text prefixed with user_id, e.g. '5_sunset 5_at 5_sea'
+    """
+    return ' '.join(f'{user_id}_{word}' for word in TERM.findall(text or ''))
+
+
+def register_function(sender, connection, **kwargs):  # pylint: disable=unused-argument
+    """
+    connection_created receiver: makes photos_search_text available to triggers of sqlite connections
+    """
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(FUNCTION, 2, search_text, deterministic=True)
+
+
+def install(connection):
+    """
+    creates index and its triggers where they are missing, a new index gets existing rows
+    :param connection: database connection, nothing is done unless it is sqlite
+    :return bool: True if index was created
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        created = INDEX not in connection.introspection.table_names(cursor)
+        for statement in INSTALL:
+            cursor.execute(statement)
+    if created:
+        rebuild(connection)
+    return created
+
+
+def uninstall(connection):
+    """
+    drops index and its triggers
+    :param connection: database connection, nothing is done unless it is sqlite
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for statement in UNINSTALL:
+            cursor.execute(statement)
+
+
+def reinstall_after_migrate(using, **kwargs):  # pylint: disable=unused-argument
+    """
+    post_migrate receiver: sqlite migrations remake photos_photo for some changes and its triggers
+    go with the old table, they are created again for the new one
+    """
+    connection = connections[using]
+    if connection.vendor == 'sqlite' and INDEX in connection.introspection.table_names():
+        install(connection)
+
+
+def rebuild(connection):
+    """
+    indexes all rows of photos_photo again in one pass and merges the index into one segment
+    :param connection: sqlite database connection
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {INDEX}({INDEX}) VALUES ('delete-all')")
+        cursor.execute(f'INSERT INTO {INDEX}(rowid, title, description) '
+                       f'SELECT id, {FUNCTION}(user_id, title), {FUNCTION}(user_id, description) FROM {TABLE}')
+        cursor.execute(f"INSERT INTO {INDEX}({INDEX}) VALUES ('optimize')")
+
+
+def match_expression(user_id, terms):
+    """
+    :param user_id: owner of photos
+    :param terms: words of query
+    :return str: FTS5 query: photos of user with every term as a prefix of a word of title or description
+    """
+    return ' AND '.join(f'"{user_id}_{term}"*' for term in terms)
+
+
+def search(user_id, text, limit=PAGE_SIZE, offset=0):
+    """
+    :param user_id: owner of photos
+    :param text: query, its first MAX_TERMS words are matched as prefixes
+    :param limit: max count of photos
+    :param offset: count of better matches to skip
+    :return list: photos, better matches of title first; on databases other than sqlite
+                  photos containing every word, newest first, found by a scan of user's photos
+    """
+    terms = TERM.findall(text.lower())[:MAX_TERMS]
+    if not terms:
+        return []
+    if connections[router.db_for_read(Photo)].vendor != 'sqlite':
+        queryset = Photo.objects.filter(user_id=user_id)
+        for term in terms:
+            queryset = queryset.filter(Q(title__icontains=term) | Q(description__icontains=term))
+        return list(queryset.order_by('-id')[offset:offset + limit])
+    params = [match_expression(user_id, terms), user_id, TITLE_WEIGHT, DESCRIPTION_WEIGHT, limit, offset]
+    return list(Photo.objects.raw(SEARCH, params))
@@ -2,18 +2,179 @@
 serializers for photos
 """
 
+from functools import cache
+from operator import attrgetter
+
+from django.urls import reverse
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Photo
+from .models import Photo, UploadSession
+from .derivatives import FORMATS, SIZES
+from .metadata import HASH_FIELDS
+from .metrics import Phase
+
+# columns of gallery rows, perceptual hash is internal to duplicate lookup
+GALLERY_FIELDS = tuple(field.attname for field in Photo._meta.concrete_fields if field.attname not in HASH_FIELDS)
+
+
+@cache
+def _image_path():
+    """
+    :return tuple: parts of path of the image action before and after photo.id, urls are resolved once
+    """
+    head, tail = reverse('photo-image', args=[0]).rsplit('/0/', 1)
+    return head + '/', '/' + tail
+
+
+def image_url(pk):
+    """
+    :param pk: photo.id
+    :return str: url of the image action, which sends the image to its owner only;
+                 files of the storage are never linked
+    """
+    head, tail = _image_path()
+    return f'{head}{pk}{tail}'
+
+
+class TimedDataMixin:
+    """
+    building of .data is measured as the 'serialize' phase of request
+    """
 
+    @property
+    def data(self):
+        with Phase('serialize'):
+            return super().data
 
-class PhotoSerializer(serializers.ModelSerializer):
+
+class TimedListSerializer(TimedDataMixin, serializers.ListSerializer):
+    """
+    ListSerializer measured as the 'serialize' phase
+    """
+
+
+class PhotoSerializer(TimedDataMixin, serializers.ModelSerializer):
     """
     Photo model serializer
     """
+    image = serializers.SerializerMethodField()
+    derivatives = serializers.SerializerMethodField()
 
     class Meta:
         """
         Meta class
         """
         model = Photo
-        fields = ('title', 'description', 'count_of_views', 'date_of_creation', 'image', 'user')
+        list_serializer_class = TimedListSerializer
+        fields = ('title', 'description', 'count_of_views', 'date_of_creation', 'image', 'user',
+                  'width', 'height', 'orientation', 'taken_at', 'exif', 'dominant_color', 'blurhash',
+                  'duplicate_of', 'derivatives')
+
+    @staticmethod
+    def get_image(photo):
+        """
+        :param photo: Photo
+        :return str: url of photo.image or None
+        """
+        return image_url(photo.pk) if photo.image else None
+
+    @staticmethod
+    def get_derivatives(photo):
+        """
+        :param photo: Photo
+        :return dict: urls of resized copies of photo.image by size and format
+        """
+        if not photo.image:
+            return {}
+        return photo_representation.derivatives(image_url(photo.pk))
+
+
+class UploadSessionSerializer(TimedDataMixin, serializers.ModelSerializer):
+    """
+    UploadSession model serializer
+    """
+
+    class Meta:
+        """
+        Meta class
+        """
+        model = UploadSession
+        list_serializer_class = TimedListSerializer
+        fields = ('id', 'title', 'description', 'file_name', 'size', 'received', 'sha256')
+
+
+class PhotoRepresentation:
+    """
+    read-only twin of PhotoSerializer for responses: plain dicts equal to PhotoSerializer(photo).data
+    with attribute getters and derivative query strings built once, dates are left to the renderer.
+    Output of both renders to the same bytes
+    """
+
+    def __init__(self):
+        self.attributes = attrgetter('title', 'description', 'count_of_views', 'date_of_creation', 'user_id',
+                                     'width', 'height', 'orientation', 'taken_at', 'exif', 'dominant_color', 'blurhash',
+                                     'duplicate_of_id')
+        # ((size, ((fmt, '?size=size&format=fmt'), ...)), ...) in order of SIZES and FORMATS
+        self.suffixes = tuple((str(size), tuple((fmt, f'?size={size}&format={fmt}') for fmt in FORMATS))
+                              for size in SIZES)
+
+    def derivatives(self, url):
+        """
+        :param url: url of the image action of photo
+        :return dict: {'128': {'webp': url?size=128&format=webp, ...}, ...}
+        """
+        return {size: {fmt: url + suffix for fmt, suffix in formats} for size, formats in self.suffixes}
+
+    def to_representation(self, photo):
+        """
+        :param photo: Photo
+        :return dict: representation equal to PhotoSerializer(photo).data
+        """
+        (title, description, count_of_views, date_of_creation, user,
+         width, height, orientation, taken_at, exif, dominant_color, blurhash, duplicate_of) = self.attributes(photo)
+        if not photo.image.name:
+            image, derivatives = None, {}
+        else:
+            image = image_url(photo.pk)
+            derivatives = self.derivatives(image)
+        return {'title': title, 'description': description, 'count_of_views': count_of_views,
+                'date_of_creation': date_of_creation, 'image': image, 'user': user,
+                'width': width, 'height': height, 'orientation': orientation,
+                # DateTimeField shows time in the current time zone
+                'taken_at': timezone.localtime(taken_at) if taken_at else None,
+                'exif': exif, 'dominant_color': dominant_color, 'blurhash': blurhash,
+                'duplicate_of': duplicate_of, 'derivatives': derivatives}
+
+    def photo(self, photo):
+        """
+        :param photo: Photo
+        :return dict: representation of photo
+        """
+        with Phase('serialize'):
+            return self.to_representation(photo)
+
+    def photos(self, photos):
+        """
+        :param photos: iterable of Photo
+        :return list: representations of photos
+        """
+        with Phase('serialize'):
+            return [self.to_representation(photo) for photo in photos]
+
+    def gallery(self, rows):
+        """
+        turns image names of gallery rows into urls of image and its derivatives
+        :param rows: list of dicts from Photo.objects.values(*GALLERY_FIELDS)
+        :return list: the same rows
+        """
+        with Phase('serialize'):
+            for row in rows:
+                if row['image']:
+                    row['image'] = image_url(row['id'])
+                    row['derivatives'] = self.derivatives(row['image'])
+                else:
+                    row['image'], row['derivatives'] = None, {}
+        return rows
+
+
+photo_representation = PhotoRepresentation()
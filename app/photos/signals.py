@@ -0,0 +1,146 @@
+"""
+signal handlers for photos app
+"""
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.contrib.auth.models import User
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .cache import gallery_cache
+from .conditional import bump_gallery_version
+from .jobs import enqueue
+from .metadata import field_file_metadata
+from .models import ImageBlob, Photo
+
+
+def retain_image(name):
+    """
+    counts one more photo referencing stored file
+    :param name: name of file in storage
+    :return int: count of photos referencing the file
+    """
+    with transaction.atomic():
+        blob, created = ImageBlob.objects.select_for_update().get_or_create(name=name, defaults={'ref_count': 1})
+        if not created:
+            ImageBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1)
+            return blob.ref_count + 1
+    return 1
+
+
+def release_image(name):
+    """
+    counts one photo less referencing stored file; a file nobody references any more is left
+    to the delete_image job, which deletes it unless the same content was stored again meanwhile
+    :param name: name of file in storage
+    """
+    from . import tasks  # pylint: disable=import-outside-toplevel,cyclic-import
+    with transaction.atomic():
+        ImageBlob.objects.filter(name=name).update(ref_count=F('ref_count') - 1)
+        if ImageBlob.objects.filter(name=name, ref_count=0).exists():
+            enqueue(tasks.delete_image, {'name': name}, key=f'delete:{name}', delay=tasks.DELETE_DELAY)
+
+
+def register_created_photos(photos):
+    """
+    does the work of post_save handlers for photos inserted with bulk_create,
+    which sends no signals
+    :param photos: created Photo instances
+    :return list: names of images stored for the first time
+    """
+    fresh = [photo.image.name for photo in photos if photo.image and retain_image(photo.image.name) == 1]
+    invalidate_galleries({photo.user_id for photo in photos})
+    return fresh
+
+
+def invalidate_galleries(user_ids):
+    """
+    invalidates validators and cache of galleries changed without signals (bulk_create, update())
+    :param user_ids: ids of owners of changed photos
+    """
+    for user_id in user_ids:
+        bump_gallery_version(user_id)
+        gallery_cache.invalidate(user_id)
+
+
+@receiver(post_init, sender=Photo)
+def remember_image_name(sender, instance, **kwargs):
+    """
+    keeps name of image loaded from db to notice its replacement on save
+    """
+    instance.stored_image_name = instance.__dict__.get('image') and str(instance.__dict__['image'])
+
+
+@receiver(pre_save, sender=Photo)
+def fill_image_metadata(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    reads metadata from header of image once, when photo gets a new image, decoding for
+    dominant_color, blurhash and perceptual hash is left to the read_image_pixels job; callers of bulk_create
+    and of save(update_fields=...) fill it themselves
+    """
+    if raw or update_fields is not None or not instance.image:
+        return
+    if instance._state.adding:  # pylint: disable=protected-access
+        if instance.width is not None:
+            return
+    elif instance.image.name == instance.stored_image_name:
+        return
+    for field, value in field_file_metadata(instance.image, pixels=False).items():
+        setattr(instance, field, value)
+
+
+@receiver(post_save, sender=Photo)
+def count_image_references(sender, instance, created, raw=False, **kwargs):
+    """
+    keeps ImageBlob.ref_count in sync when photo gets or replaces its image
+    """
+    if raw:
+        return
+    name = instance.image.name if instance.image else ''
+    previous = None if created else instance.stored_image_name
+    if name != previous:
+        if name:
+            retain_image(name)
+        if previous:
+            release_image(previous)
+    instance.stored_image_name = name
+
+
+@receiver(post_delete, sender=Photo)
+def release_deleted_photo_image(sender, instance, **kwargs):
+    """
+    drops reference of deleted photo to its image
+    """
+    if instance.image:
+        release_image(instance.image.name)
+
+
+@receiver(post_save, sender=Photo)
+@receiver(post_delete, sender=Photo)
+def invalidate_photo_gallery(sender, instance, raw=False, **kwargs):
+    """
+    every change of photo made through the model invalidates validators and cache of owner's gallery
+    """
+    if not raw:
+        bump_gallery_version(instance.user_id)
+        gallery_cache.invalidate(instance.user_id)
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    """
+    logout (djoser deletes the token) takes effect immediately in this process
+    """
+    token_cache.invalidate_key(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_tokens_of_changed_user(sender, instance, **kwargs):
+    """
+    password change or deactivation must not be hidden by cached tokens
+    """
+    token_cache.invalidate_user(instance.pk)
@@ -0,0 +1,96 @@
+"""
+near-duplicate lookup by perceptual hash: multi-index hashing over indexed chunks of the hash,
+so a lookup reads a few index ranges instead of every photo of the user
+"""
+
+from functools import reduce
+from itertools import combinations
+
+from django.conf import settings
+
+from .metadata import HASH_CHUNK_BITS, HASH_CHUNKS
+from .models import Photo
+
+CONFIG = getattr(settings, 'PHOTOS_SIMILAR', {})
+DISTANCE = CONFIG.get('DISTANCE', 10)
+DUPLICATE_DISTANCE = CONFIG.get('DUPLICATE_DISTANCE', 4)
+LIMIT = CONFIG.get('LIMIT', 100)
+# probing chunks within 2 bits, distances up to 3 * HASH_CHUNKS - 1 are found by pigeonhole
+MAX_DISTANCE = 3 * HASH_CHUNKS - 1
+MASK = (1 << 64) - 1
+
+
+def hamming(first, second):
+    """
+    :param first: phash, signed or unsigned
+    :param second: phash, signed or unsigned
+    :return int: count of differing bits
+    """
+    return ((first ^ second) & MASK).bit_count()
+
+
+def neighbours(chunk, radius):
+    """
+    :param chunk: HASH_CHUNK_BITS bit value
+    :param radius: max count of flipped bits
+    :return list: chunk and all values differing from it in at most radius bits
+    """
+    values = [chunk]
+    for flipped in range(1, radius + 1):
+        for bits in combinations(range(HASH_CHUNK_BITS), flipped):
+            values.append(reduce(lambda value, bit: value ^ 1 << bit, bits, chunk))
+    return values
+
+
+def candidates(user_id, phash, distance):
+    """
+    a hash within distance of phash has at least one chunk within distance // HASH_CHUNKS bits
+    of the chunk of phash, so only photos matching one of these chunk values are read, each chunk
+    through its own (user, chunk) index; chunks are joined with UNION, sqlite plans OR of them
+    as a scan of all photos of the user
+    :param user_id: owner of photos
+    :param phash: perceptual hash to look up
+    :param distance: max hamming distance, at most MAX_DISTANCE
+    :return QuerySet: user's photos possibly within distance, a superset of the result
+    """
+    value, radius = phash & MASK, distance // HASH_CHUNKS
+    matches = []
+    for index in range(HASH_CHUNKS):
+        chunk = value >> (HASH_CHUNK_BITS * index) & (1 << HASH_CHUNK_BITS) - 1
+        lookup = {'user_id': user_id, f'phash_{index}__in': neighbours(chunk, radius)}
+        matches.append(Photo.objects.filter(**lookup).values('pk'))
+    return Photo.objects.filter(pk__in=matches[0].union(*matches[1:]))
+
+
+def similar(photo, distance=DISTANCE, limit=LIMIT):
+    """
+    :param photo: Photo with phash
+    :param distance: max hamming distance, at most MAX_DISTANCE
+    :param limit: max count of photos
+    :return list: (distance, Photo) of other photos of its owner, nearest and then oldest first
+    """
+    found = []
+    for pk, other_phash in candidates(photo.user_id, photo.phash, distance).values_list('pk', 'phash'):
+        other_distance = hamming(photo.phash, other_phash)
+        if other_distance <= distance and pk != photo.pk:
+            found.append((other_distance, pk))
+    found = sorted(found)[:limit]
+    photos = Photo.objects.in_bulk([pk for _, pk in found])
+    return [(other_distance, photos[pk]) for other_distance, pk in found if pk in photos]
+
+
+def mark_duplicates(ids):
+    """
+    upload time duplicate check: points duplicate_of of just added photos to the nearest
+    older photo of their owner within DUPLICATE_DISTANCE
+    :param ids: ids of added photos
+    :return int: count of photos found to be duplicates
+    """
+    marked = 0
+    for photo in Photo.objects.filter(pk__in=ids, phash__isnull=False, duplicate_of__isnull=True):
+        older = candidates(photo.user_id, photo.phash, DUPLICATE_DISTANCE).filter(pk__lt=photo.pk)
+        nearest = min(((hamming(photo.phash, other_phash), pk) for pk, other_phash in older.values_list('pk', 'phash')),
+                      default=None)
+        if nearest is not None and nearest[0] <= DUPLICATE_DISTANCE:
+            marked += Photo.objects.filter(pk=photo.pk).update(duplicate_of=nearest[1])
+    return marked
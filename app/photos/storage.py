@@ -0,0 +1,96 @@
+"""
+content-addressed storage for photos' images
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    keeps every file under sha256 of its bytes in hash-prefixed subdirectories,
+    e.g. 'ab/cd/abcd...ef.jpg', so equal uploads share one file on disk
+    """
+    chunk_size = 64 * 1024
+
+    @staticmethod
+    def hashed_name(digest, extension):
+        """
+        :param digest: sha256 hex digest of file
+        :param extension: extension with dot, e.g. '.jpg'
+        :return str: name of file in storage
+        """
+        return f'{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}'
+
+    @staticmethod
+    def is_hashed(name):
+        """
+        :param name: name of file in storage
+        :return bool: True if name was made by hashed_name
+        """
+        parts = name.split('/')
+        stem = os.path.splitext(parts[-1])[0]
+        return len(parts) == 3 and len(stem) == 64 and stem[:2] == parts[0] and stem[2:4] == parts[1]
+
+    def get_available_name(self, name, max_length=None):
+        # final name depends only on the content, see _save
+        return name
+
+    def _save(self, name, content):
+        incoming = self.path('.incoming')
+        os.makedirs(incoming, exist_ok=True)
+        hasher = hashlib.sha256()
+        descriptor, temp_path = tempfile.mkstemp(dir=incoming)
+        try:
+            with os.fdopen(descriptor, 'wb') as temp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(self.chunk_size):
+                    hasher.update(chunk)
+                    temp.write(chunk)
+            return self.adopt(temp_path, hasher.hexdigest(), os.path.splitext(name)[1])
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def adopt(self, path, digest, extension):
+        """
+        moves already hashed file into storage, the file is dropped if the content is stored already.
+        Both happen under the row lock of its ImageBlob, which tasks.delete_image holds while deleting,
+        and a kept file is touched, so a pending deletion leaves it to the photo about to retain it
+        :param path: path of file on the same filesystem
+        :param digest: sha256 hex digest of file
+        :param extension: extension with dot, e.g. '.jpg'
+        :return str: name of file in storage
+        """
+        name = self.hashed_name(digest, extension)
+        full_path = self.path(name)
+        blobs = apps.get_model('photos', 'ImageBlob').objects
+        with transaction.atomic():
+            list(blobs.select_for_update().filter(name=name))  # no row: nothing deletes the file
+            if os.path.exists(full_path):
+                os.utime(full_path)
+                os.remove(path)
+                return name
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(path, self.file_permissions_mode)
+            # same bytes under the same name, so a concurrent writer can safely be overwritten
+            shutil.move(path, full_path)
+        return name
+
+
+def photo_storage():
+    """
+    storage of Photo.image configured by settings.PHOTOS_STORAGE
+    :return Storage: storage instance
+    """
+    return import_string(getattr(settings, 'PHOTOS_STORAGE', 'photos.storage.ContentAddressedStorage'))()
@@ -0,0 +1,102 @@
+"""
+streaming of a whole gallery as json array or ndjson with memory bounded by one chunk of rows
+"""
+
+from itertools import islice
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from .models import Photo
+from .pagination import GalleryPagination
+from .renderers import ORJSONRenderer
+from .serializers import GALLERY_FIELDS, photo_representation
+
+CHUNK_SIZE = getattr(settings, 'PHOTOS_GALLERY_STREAM_CHUNK_SIZE', 2000)
+CONTENT_TYPES = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+
+
+def stream_format(request):
+    """
+    :param request: request with 'stream' query param: '1' / 'json' or 'ndjson'
+    :return str: 'json', 'ndjson' or None if the gallery is not streamed
+    """
+    value = request.GET.get('stream')
+    if not value or value == '0':
+        return None
+    return 'ndjson' if value == 'ndjson' else 'json'
+
+
+def gallery_queryset(request):
+    """
+    :param request: drf or django request of gallery's owner with optional sort and date range
+                    query params of GalleryPagination
+    :return QuerySet: rows of user's gallery filtered and ordered like its pages,
+                      bound to the database the router gives now, as rows are read after the view returned
+    :raise ValueError: if sort or a date is malformed
+    """
+    paginator = GalleryPagination()
+    queryset = paginator.filter_queryset(Photo.objects.filter(user=request.user), request)
+    queryset = queryset.order_by(*paginator.get_ordering(request)).values(*GALLERY_FIELDS)
+    return queryset.using(queryset.db)
+
+
+def encode(rows, fmt, first):
+    """
+    :param rows: chunk of gallery rows
+    :param fmt: 'json' or 'ndjson'
+    :param first: True for the first chunk of json array
+    :return bytes: encoded chunk, items are the same as in paginated gallery
+    """
+    render = ORJSONRenderer().render
+    items = [render(row) for row in photo_representation.gallery(rows)]
+    if fmt == 'ndjson':
+        return b'\n'.join(items) + b'\n'
+    return (b'' if first else b',') + b','.join(items)
+
+
+def chunks(queryset, fmt):
+    """
+    :return generator: encoded chunks of CHUNK_SIZE rows
+    """
+    rows = queryset.iterator(chunk_size=CHUNK_SIZE)
+    if fmt == 'json':
+        yield b'['
+    first = True
+    while batch := list(islice(rows, CHUNK_SIZE)):
+        yield encode(batch, fmt, first)
+        first = False
+    if fmt == 'json':
+        yield b']'
+
+
+async def achunks(queryset, fmt):
+    """
+    async version of chunks
+    """
+    if fmt == 'json':
+        yield b'['
+    first = True
+    batch = []
+    async for row in queryset.aiterator(chunk_size=CHUNK_SIZE):
+        batch.append(row)
+        if len(batch) == CHUNK_SIZE:
+            yield encode(batch, fmt, first)
+            first, batch = False, []
+    if batch:
+        yield encode(batch, fmt, first)
+    if fmt == 'json':
+        yield b']'
+
+
+def stream_gallery(request, fmt, is_async=False):
+    """
+    :param request: drf or django request of gallery's owner
+    :param fmt: 'json' for one json array, 'ndjson' for one json object per line
+    :param is_async: True to read rows with aiterator for async views
+    :return StreamingHttpResponse: whole gallery of request.user
+    :raise ValueError: if sort or a date is malformed
+    """
+    queryset = gallery_queryset(request)
+    content = achunks(queryset, fmt) if is_async else chunks(queryset, fmt)
+    return StreamingHttpResponse(content, content_type=CONTENT_TYPES[fmt])
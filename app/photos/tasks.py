@@ -0,0 +1,89 @@
+"""
+tasks of background jobs of photos, run by run_jobs workers
+"""
+
+import os
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .derivatives import FORMATS, SIZES, derivative_name, render_derivatives
+from .jobs import enqueue, task
+from .metadata import HASH_FIELDS, extract
+from .models import ImageBlob, Photo
+from .signals import invalidate_galleries
+from .similarity import mark_duplicates
+
+DELETE_DELAY = getattr(settings, 'PHOTOS_IMAGE_DELETE_DELAY', 10 * 60)
+
+
+@task(lane='high')
+def render_image_derivatives(name):
+    """
+    renders resized copies of stored image, shown in galleries instead of the original
+    :param name: name of original image in storage
+    """
+    storage = Photo.image.field.storage
+    if not storage.exists(name):
+        return  # deleted before its turn came
+    targets = [(size, fmt, storage.path(derivative_name(name, size, fmt))) for size in SIZES for fmt in FORMATS]
+    render_derivatives(storage.path(name), targets)
+
+
+@task()
+def read_image_pixels(name):
+    """
+    decodes stored image for dominant_color, blurhash and perceptual hash of photos having it
+    without them, then checks them for duplicates
+    :param name: name of image in storage
+    """
+    photos = Photo.objects.filter(Q(blurhash='') | Q(phash__isnull=True), image=name)
+    rows = list(photos.values_list('pk', 'user_id'))
+    if not rows:
+        return
+    storage = Photo.image.field.storage
+    with storage.open(name) as file:
+        pixels = extract(file)
+    if pixels['phash'] is None:
+        return  # not an image, nothing to retry
+    Photo.objects.filter(pk__in=[pk for pk, _ in rows]).update(
+        **{field: pixels[field] for field in ('dominant_color', 'blurhash', *HASH_FIELDS)})
+    mark_duplicates([pk for pk, _ in rows])
+    invalidate_galleries({user_id for _, user_id in rows})
+
+
+@task()
+def find_duplicates(ids):
+    """
+    upload time duplicate check of photos added with their perceptual hash
+    :param ids: ids of added photos
+    """
+    owners = set(Photo.objects.filter(pk__in=ids).values_list('user_id', flat=True))
+    if mark_duplicates(ids):
+        invalidate_galleries(owners)
+
+
+@task(lane='low')
+def delete_image(name):
+    """
+    deletes stored file and its derivatives once no photo references it. The row lock of its ImageBlob,
+    taken by storage.adopt too, orders deletion and storing of the same content; a file stored again
+    less than DELETE_DELAY ago is kept for the photo about to retain it and checked once more later
+    :param name: name of file in storage
+    """
+    storage = Photo.image.field.storage
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(name=name, ref_count=0).first()
+        if blob is None:
+            return  # retained again
+        path = storage.path(name)
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) < DELETE_DELAY:
+            enqueue(delete_image, {'name': name}, delay=DELETE_DELAY)
+            return
+        storage.delete(name)
+        for size in SIZES:
+            for fmt in FORMATS:
+                storage.delete(derivative_name(name, size, fmt))
+        blob.delete()
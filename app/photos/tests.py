@@ -1,16 +1,80 @@
 """
     tests for photos app
 """
-from datetime import datetime
-from unittest import TestCase
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from unittest import TestCase, mock
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, connection
+from django.core.cache import cache, caches
+from django.http import HttpResponse
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase as DjangoTestCase, \
+    override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image, ImageDraw
 import pytest
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
-from .models import Photo
-from .serializers import PhotoSerializer
+from .models import ImageBlob, Job, Photo, UploadSession, ViewBucket
+from .storage import ContentAddressedStorage
+from . import analytics, checks, jobs, media, metadata, search, signals, similarity, streaming, tasks, uploads
+from .derivatives import derivative_name, generate_derivatives
+from .authentication import TokenCache, token_cache
+from .benchmark import Scenario, compare, count_queries, percentile
+from .cache import GalleryCache, gallery_cache
+from .counters import LocalMemoryCounterStore, ViewCounter, view_counter
+from .metrics import Histogram, RequestTimings, registry
+from .middleware import ReplicaRoutingMiddleware
+from . import routers
+from .pagination import GalleryPagination, decode_cursor, encode_cursor
+from .renderers import ORJSONRenderer
+from .serializers import GALLERY_FIELDS, PhotoSerializer, photo_representation
 from .views import PhotosViewSet
 
 
+def reset_process_state():
+    """
+    drops state kept by this process across requests: pending views and cached galleries and tokens
+    """
+    view_counter.store.drain()
+    gallery_cache.cache.clear()
+    token_cache.clear()
+
+
+class PhotosTestCase(DjangoTestCase):
+    """
+    TestCase whose tests start and end with no process-wide state, so none of it leaks between tests
+    or is flushed into the real database at exit; views are flushed by the tests, a background thread
+    writing from its own connection would race their transactions
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.enterClassContext(mock.patch.object(view_counter, 'background', False))
+
+    def setUp(self):
+        super().setUp()
+        reset_process_state()
+
+    def tearDown(self):
+        reset_process_state()
+        super().tearDown()
+
+
 class TestPhotosViewSet(TestCase):
     """
     Tests for PhotosViewSet class
@@ -356,7 +420,16 @@ class TestPhotoSerializer(TestCase):
                                                'count_of_views',
                                                'date_of_creation',
                                                'image',
-                                               'user'}
+                                               'user',
+                                               'width',
+                                               'height',
+                                               'orientation',
+                                               'taken_at',
+                                               'exif',
+                                               'dominant_color',
+                                               'blurhash',
+                                               'duplicate_of',
+                                               'derivatives'}
 
     def test_missing_fields(self):
         """
@@ -450,3 +523,1546 @@ class TestPhotoSerializer(TestCase):
             }
         }
         assert serializer.data == expected_data
+
+
+class TestGalleryPagination(PhotosTestCase):
+    """
+    Tests for keyset pagination of user's gallery
+    """
+
+    def test_gallery_pages_follow_cursor(self):
+        """
+        Tests that walking next cursors returns every photo exactly once in order
+        """
+        user = User.objects.create_user(username='paging_user', password='testpass')
+        ids = [Photo.objects.create(title=f'Photo {i}', image=f'paging{i}.jpg', user=user).id
+               for i in range(5)]
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        seen = []
+        response = client.get('/api/v1/photos/gallery/', {'page_size': 2})
+        while True:
+            assert response.status_code == 200
+            assert len(response.data['gallery']) <= 2
+            seen += [photo['id'] for photo in response.data['gallery']]
+            if response.data['next'] is None:
+                break
+            response = client.get('/api/v1/photos/gallery/',
+                                  {'page_size': 2, 'cursor': response.data['next']})
+        assert seen == ids
+
+    def test_gallery_invalid_cursor(self):
+        """
+        Tests that malformed cursor is reported as fail
+        """
+        user = User.objects.create_user(username='bad_cursor_user', password='testpass')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        context = ['date', '', '']
+        for cursor in ('not-a-cursor', encode_cursor(['2023-05-25', 1]), encode_cursor(context + ['abc', 1]),
+                       encode_cursor(context + [[1], 1]), encode_cursor(context + ['2023-05-25', 'x']),
+                       encode_cursor(context + [None, 1])):
+            response = client.get('/api/v1/photos/gallery/', {'cursor': cursor})
+            assert response.data['message'] == 'fail'
+            assert response.data['description'] == 'invalid cursor'
+
+    def test_gallery_cursor_keeps_sort_and_date_range(self):
+        """
+        Tests that a cursor is refused with a sort or date range other than the ones of its page
+        """
+        user = User.objects.create_user(username='cursor_context_user', password='testpass')
+        for i in range(3):
+            photo = Photo.objects.create(title=f'Photo {i}', image=f'context{i}.jpg', user=user)
+            Photo.objects.filter(pk=photo.pk).update(date_of_creation=date(2024, 5, i + 1))
+        client = APIClient()
+        client.force_authenticate(user=user)
+        params = {'sort': 'title', 'date_from': '2024-05-01', 'page_size': 1}
+        cursor = client.get('/api/v1/photos/gallery/', params).data['next']
+
+        response = client.get('/api/v1/photos/gallery/', dict(params, cursor=cursor))
+        assert [photo['title'] for photo in response.data['gallery']] == ['Photo 1']
+        for changed in ({'sort': 'date'}, {'sort': '-title'}, {'date_from': '2024-05-02'}, {'date_to': '2024-05-03'}):
+            response = client.get('/api/v1/photos/gallery/', dict(params, cursor=cursor, **changed))
+            assert response.data == {'message': 'fail',
+                                     'description': 'cursor was made for another sort or date range'}
+
+    def test_cursor_round_trip(self):
+        """
+        Tests that cursor is opaque and decodes back to ordering values
+        """
+        cursor = encode_cursor(['2023-05-25', 42])
+        assert '2023' not in cursor
+        assert decode_cursor(cursor, 2) == ['2023-05-25', 42]
+        with pytest.raises(ValueError):
+            decode_cursor(cursor, 3)
+
+    def test_gallery_sorted_and_filtered_by_date(self):
+        """
+        Tests that pages of a sort within a date range hold the matching photos in order
+        """
+        user = User.objects.create_user(username='sorting_user', password='testpass')
+        for i, (title, views, day) in enumerate([('b', 5, 1), ('a', 7, 2), ('d', 5, 3), ('c', 1, 4), ('e', 9, 20)]):
+            photo = Photo.objects.create(title=title, image=f'sorting{i}.jpg', user=user)
+            Photo.objects.filter(pk=photo.pk).update(count_of_views=views, date_of_creation=date(2024, 5, day))
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        def titles(params):
+            seen = []
+            response = client.get('/api/v1/photos/gallery/', dict(params, page_size=2))
+            while True:
+                seen += [photo['title'] for photo in response.data['gallery']]
+                if response.data['next'] is None:
+                    return seen
+                response = client.get('/api/v1/photos/gallery/',
+                                      dict(params, page_size=2, cursor=response.data['next']))
+
+        assert titles({'sort': '-views'}) == ['e', 'a', 'd', 'b', 'c']
+        assert titles({'sort': '-views', 'date_from': '2024-05-02', 'date_to': '2024-05-04'}) == ['a', 'd', 'c']
+        assert titles({'sort': 'title', 'date_to': '2024-05-03'}) == ['a', 'b', 'd']
+        assert titles({'sort': '-date', 'date_from': '2024-05-03'}) == ['e', 'c', 'd']
+        response = client.get('/api/v1/photos/gallery/', {'sort': 'views', 'date_from': '2024-05-04', 'stream': 'json'})
+        assert [photo['title'] for photo in json.loads(b''.join(response.streaming_content))] == ['c', 'e']
+
+        assert client.get('/api/v1/photos/gallery/', {'sort': 'size'}).data['message'] == 'fail'
+        response = client.get('/api/v1/photos/gallery/', {'date_from': '05/01/2024', 'stream': 'json'})
+        assert response.data['description'] == 'invalid date_from'
+
+    def test_gallery_sorts_use_index_range_scans(self):
+        """
+        Tests that every sort, with or without date range and cursor, reads an index range of the user;
+        without date range rows come in index order, with no sort step
+        """
+        factory = RequestFactory()
+        rows = Photo.objects.filter(user_id=1).values(*GALLERY_FIELDS)
+        cursors = {'date': date(2024, 5, 1), 'views': 3, 'title': 'sunset'}
+        indexes = {'date': 'photo_user_date_id_idx', 'views': 'photo_user_views_id_idx',
+                   'title': 'photo_user_title_id_idx'}
+        for sort in GalleryPagination.SORTS:
+            field = sort.lstrip('-')
+            for dates in ({}, {'date_from': '2024-01-01'}, {'date_from': '2024-01-01', 'date_to': '2024-12-31'}):
+                context = [sort, dates.get('date_from', ''), dates.get('date_to', '')]
+                for cursor in ({}, {'cursor': encode_cursor(context + [cursors[field], 10])}):
+                    request = factory.get('/', dict(sort=sort, **dates, **cursor))
+                    plan = GalleryPagination().get_page_queryset(rows, request).explain()
+                    assert 'SEARCH photos_photo USING INDEX photo_user_' in plan, (sort, dates, cursor, plan)
+                    assert 'SCAN' not in plan, (sort, dates, cursor, plan)
+                    if not dates:
+                        assert indexes[field] in plan and 'TEMP B-TREE' not in plan, (sort, cursor, plan)
+
+
+class TestViewCounter(PhotosTestCase):
+    """
+    Tests for buffered view counter
+    """
+
+    def test_views_are_buffered_and_flushed_in_batch(self):
+        """
+        Tests that views are not written until flush and then land with one update
+        """
+        user = User.objects.create_user(username='counter_user', password='testpass')
+        photo = Photo.objects.create(title='Counted', image='counted.jpg', user=user)
+        counter = ViewCounter(store=LocalMemoryCounterStore(), flush_interval=3600)
+        for _ in range(3):
+            counter.add(photo)
+        assert counter.pending(photo.pk) == 3
+        assert Photo.objects.get(pk=photo.pk).count_of_views == 0
+
+        assert counter.flush() == 3
+        assert counter.pending(photo.pk) == 0
+        assert Photo.objects.get(pk=photo.pk).count_of_views == 3
+
+    def test_pending_views_read_from_running_totals(self):
+        """
+        Tests that pending views of a photo are read without scanning hour buckets of all photos
+        """
+        counter = ViewCounter(store=LocalMemoryCounterStore(), flush_interval=3600)
+        now = datetime.now(timezone.utc)
+        for pk in range(1, 4):
+            counter.add(Photo(pk=pk, user_id=1), pk, now=now)
+        counter.add(Photo(pk=2, user_id=1), now=now - timedelta(hours=1))
+        with mock.patch.object(counter.store, 'snapshot', side_effect=AssertionError('scanned')):
+            assert [counter.pending(pk) for pk in range(1, 5)] == [1, 3, 3, 0]
+            assert counter.pending_many([2, 4]) == {2: 3}
+        counter.store.drain()
+        assert counter.pending(2) == 0 and counter.pending_many([1, 2, 3]) == {}
+
+    def test_failed_flush_keeps_views(self):
+        """
+        Tests that a db error during flush is not raised into the caller and the views wait for the next flush
+        """
+        user = User.objects.create_user(username='locked_user', password='testpass')
+        photo = Photo.objects.create(title='Locked', image='locked.jpg', user=user)
+        counter = ViewCounter(store=LocalMemoryCounterStore(), flush_interval=3600)
+        counter.add(photo, 2)
+        with mock.patch('photos.counters.transaction.atomic', side_effect=DatabaseError('database is locked')):
+            assert counter.flush() == 0
+        assert counter.pending(photo.pk) == 2
+        assert counter.flush() == 2
+
+    def test_background_thread_flushes_idle_process(self):
+        """
+        Tests that views are flushed every flush_interval without further requests
+        """
+        counter = ViewCounter(store=LocalMemoryCounterStore(), flush_interval=0.01, background=True)
+        flushed = threading.Event()
+        with mock.patch.object(counter, 'flush', side_effect=lambda: flushed.set() or 0):
+            counter.add(Photo(pk=1, user_id=1))
+            assert flushed.wait(5)
+        # the daemon thread outlives the test, let it sleep
+        counter.flush_interval = 3600
+
+    def test_photo_view_shows_pending_views(self):
+        """
+        Tests that photo endpoint shows views which are not flushed yet
+        """
+        user = User.objects.create_user(username='pending_user', password='testpass')
+        photo = Photo.objects.create(title='Pending', image='pending.jpg', user=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        client.get(f'/api/v1/photos/{photo.pk}/photo/')
+        response = client.get(f'/api/v1/photos/{photo.pk}/photo/')
+        assert response.data['photo']['count_of_views'] == 2
+        view_counter.flush()
+        assert Photo.objects.get(pk=photo.pk).count_of_views == 2
+
+    def test_leaderboard_merges_pending_views(self):
+        """
+        Tests that leaderboard ranks by flushed and pending views alike, agrees with photo endpoint
+        and reads the top of the views index without sorting
+        """
+        user = User.objects.create_user(username='leader_user', password='testpass')
+        other = User.objects.create_user(username='leader_other', password='testpass')
+        photos = {}
+        for title, views in (('a', 5), ('b', 3), ('c', 0), ('d', 1)):
+            photos[title] = Photo.objects.create(title=title, image=f'leader_{title}.jpg', user=user)
+            Photo.objects.filter(pk=photos[title].pk).update(count_of_views=views)
+        other_photo = Photo.objects.create(title='x', image='leader_x.jpg', user=other)
+        view_counter.add(other_photo, 100)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        for _ in range(3):
+            client.get(f'/api/v1/photos/{photos["c"].pk}/photo/')
+        shown = client.get(f'/api/v1/photos/{photos["c"].pk}/photo/').data['photo']['count_of_views']
+        # only pending photos of the user are read by primary key
+        assert view_counter.pending_of_user(user.pk) == {photos['c'].pk: 4}
+        assert view_counter.pending_of_user(other.pk) == {other_photo.pk: 100}
+
+        response = client.get('/api/v1/photos/leaderboard/', {'limit': 3})
+        assert [(photo['title'], photo['count_of_views']) for photo in response.data['photos']] == \
+               [('a', 5), ('c', shown), ('b', 3)] and shown == 4
+        view_counter.flush()
+        assert client.get('/api/v1/photos/leaderboard/', {'limit': 3}).data == response.data
+        assert client.get('/api/v1/photos/leaderboard/', {'limit': 0}).data['message'] == 'fail'
+
+        plan = Photo.objects.filter(user_id=user.pk).order_by('-count_of_views', '-id')[:3].explain()
+        assert 'photo_user_views_id_idx' in plan and 'TEMP B-TREE' not in plan
+
+
+class TestDerivatives(PhotosTestCase):
+    """
+    Tests for resized copies of photos
+    """
+
+    def test_derivatives_rendered_next_to_original(self):
+        """
+        Tests that every size and format is rendered and fits into its box
+        """
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            Image.new('RGB', (2000, 1000), 'red').save(os.path.join(media_root, 'wide.jpg'))
+            generate_derivatives('wide.jpg', default_storage)
+            for size in (128, 512, 1600):
+                for fmt, ext in (('webp', 'webp'), ('jpeg', 'jpg')):
+                    name = derivative_name('wide.jpg', size, fmt)
+                    assert name == f'wide_{size}.{ext}'
+                    with Image.open(os.path.join(media_root, name)) as image:
+                        assert max(image.size) == size
+
+    def test_gallery_contains_derivative_urls(self):
+        """
+        Tests that gallery items carry urls of derivatives
+        """
+        user = User.objects.create_user(username='derivatives_user', password='testpass')
+        stranger = User.objects.create_user(username='derivatives_stranger', password='testpass')
+        thumb = Photo.objects.create(title='Thumb', image='thumb.jpg', user=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        response = client.get('/api/v1/photos/gallery/')
+        photo = response.data['gallery'][0]
+        assert photo['image'] == f'/api/v1/photos/{thumb.pk}/image/'
+        assert photo['derivatives']['128']['webp'] == f'/api/v1/photos/{thumb.pk}/image/?size=128&format=webp'
+        assert photo['derivatives']['512']['jpeg'] == f'/api/v1/photos/{thumb.pk}/image/?size=512&format=jpeg'
+
+        client.force_authenticate(user=stranger)
+        response = client.get(photo['derivatives']['128']['webp'])
+        assert response.data == {'message': 'fail', 'description': 'permission denied'}
+
+
+class TestChunkedUpload(PhotosTestCase):
+    """
+    Tests for resumable chunked uploads
+    """
+
+    def test_upload_in_chunks_and_finalize(self):
+        """
+        Tests that chunks are accepted in order, resumed after a rejected one
+        and finalized into a photo
+        """
+        user = User.objects.create_user(username='chunk_user', password='testpass')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), 'blue').save(buffer, 'PNG')
+        content = buffer.getvalue()
+        middle = len(content) // 2
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                mock.patch.object(uploads, 'TEMP_DIR', os.path.join(media_root, 'uploads')):
+            response = client.post('/api/v1/uploads/', {
+                'title': 'Chunked', 'file_name': 'chunked.png', 'size': len(content),
+                'sha256': hashlib.sha256(content).hexdigest()})
+            upload_id = response.data['upload']['id']
+
+            response = client.put(f'/api/v1/uploads/{upload_id}/chunk/', content[middle:],
+                                  content_type='application/octet-stream',
+                                  HTTP_CONTENT_RANGE=f'bytes {middle}-{len(content) - 1}/{len(content)}')
+            assert response.data['message'] == 'fail'
+            assert response.data['upload']['received'] == 0
+
+            for first, last in ((0, middle - 1), (middle, len(content) - 1)):
+                response = client.put(f'/api/v1/uploads/{upload_id}/chunk/', content[first:last + 1],
+                                      content_type='application/octet-stream',
+                                      HTTP_CONTENT_RANGE=f'bytes {first}-{last}/{len(content)}')
+                assert response.data['upload']['received'] == last + 1
+
+            response = client.post(f'/api/v1/uploads/{upload_id}/finalize/')
+            assert response.data['photo']['title'] == 'Chunked'
+            photo = Photo.objects.get(user=user)
+            with open(os.path.join(media_root, photo.image.name), 'rb') as stored:
+                assert stored.read() == content
+            assert not UploadSession.objects.filter(pk=upload_id).exists()
+
+    def test_empty_chunk_and_repeated_finalize_fail(self):
+        """
+        Tests that a chunk without body and a second finalize are refused instead of raising
+        """
+        user = User.objects.create_user(username='chunk_user', password='testpass')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+        content = buffer.getvalue()
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                mock.patch.object(uploads, 'TEMP_DIR', os.path.join(media_root, 'uploads')):
+            response = client.post('/api/v1/uploads/', {
+                'title': 'Empty', 'file_name': 'empty.png', 'size': len(content)})
+            upload_id = response.data['upload']['id']
+            session = UploadSession.objects.get(pk=upload_id)
+
+            response = client.put(f'/api/v1/uploads/{upload_id}/chunk/', b'',
+                                  content_type='application/octet-stream',
+                                  HTTP_CONTENT_RANGE=f'bytes 0-{len(content) - 1}/{len(content)}')
+            assert response.data['message'] == 'fail'
+            assert response.data['upload']['received'] == 0
+
+            response = client.put(f'/api/v1/uploads/{upload_id}/chunk/', content,
+                                  content_type='application/octet-stream',
+                                  HTTP_CONTENT_RANGE=f'bytes 0-{len(content) - 1}/{len(content)}')
+            assert response.data['upload']['received'] == len(content)
+            session.refresh_from_db()
+            uploads.finish(session, Photo.image.field.storage)
+            # the request that lost the race still holds the session
+            with pytest.raises(uploads.UploadError):
+                uploads.finish(session, Photo.image.field.storage)
+
+    def test_expire_drops_abandoned_uploads(self):
+        """
+        Tests that sessions older than the ttl and partial files without a session are removed
+        """
+        user = User.objects.create_user(username='chunk_user', password='testpass')
+        with tempfile.TemporaryDirectory() as temp_dir, mock.patch.object(uploads, 'TEMP_DIR', temp_dir):
+            old = UploadSession.objects.create(title='Old', file_name='old.png', size=10, user=user)
+            fresh = UploadSession.objects.create(title='Fresh', file_name='fresh.png', size=10, user=user)
+            uploads.start(old)
+            uploads.start(fresh)
+            UploadSession.objects.filter(pk=old.pk).update(
+                date_of_creation=datetime.now(timezone.utc) - timedelta(days=2))
+            orphan = os.path.join(temp_dir, f'{uuid.uuid4()}.part')
+            open(orphan, 'wb').close()
+            stale = time.time() - 2 * 24 * 60 * 60
+            for path in (orphan, uploads.part_path(fresh)):
+                os.utime(path, (stale, stale))
+
+            assert uploads.expire(ttl=24 * 60 * 60) == (1, 1)
+            assert list(UploadSession.objects.values_list('pk', flat=True)) == [fresh.pk]
+            assert not os.path.exists(uploads.part_path(old))
+            assert not os.path.exists(orphan)
+            assert os.path.exists(uploads.part_path(fresh))
+
+    def test_parse_content_range(self):
+        """
+        Tests that Content-Range must fit the declared size
+        """
+        assert uploads.parse_content_range('bytes 0-9/100', 100) == (0, 10)
+        with pytest.raises(uploads.UploadError):
+            uploads.parse_content_range('bytes 90-100/100', 100)
+        with pytest.raises(uploads.UploadError):
+            uploads.parse_content_range(None, 100)
+
+
+class TestContentAddressedStorage(PhotosTestCase):
+    """
+    Tests for content-addressed storage of images
+    """
+
+    def test_equal_content_is_stored_once(self):
+        """
+        Tests that equal uploads share one hashed file
+        """
+        with tempfile.TemporaryDirectory() as media_root:
+            storage = ContentAddressedStorage(location=media_root)
+            first = storage.save('a.JPG', ContentFile(b'same bytes'))
+            second = storage.save('b.jpg', ContentFile(b'same bytes'))
+            digest = hashlib.sha256(b'same bytes').hexdigest()
+            assert first == second == f'{digest[:2]}/{digest[2:4]}/{digest}.jpg'
+            assert storage.is_hashed(first)
+            assert not storage.is_hashed('a.jpg')
+            assert os.listdir(os.path.join(media_root, '.incoming')) == []
+
+    def test_file_deleted_with_last_reference(self):
+        """
+        Tests that stored file lives while any photo references it and is deleted
+        with its derivatives by the job queued when the last reference is dropped
+        """
+        user = User.objects.create_user(username='blob_user', password='testpass')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            photos = [Photo.objects.create(title=f'Copy {i}', image=ContentFile(b'blob', name='copy.jpg'),
+                                           user=user) for i in range(2)]
+            name = photos[0].image.name
+            assert photos[1].image.name == name
+            assert ImageBlob.objects.get(name=name).ref_count == 2
+            derivative = default_storage.save(derivative_name(name, 128, 'webp'), ContentFile(b'small'))
+
+            photos[0].delete()
+            assert not Job.objects.filter(name=tasks.delete_image.job_name).exists()
+            photos[1].delete()
+            job = Job.objects.get(name=tasks.delete_image.job_name)
+            assert job.run_at > job.date_of_creation
+            self.store_long_ago(media_root, name)
+            jobs.run(job.name, job.payload)
+            assert not os.path.exists(os.path.join(media_root, name))
+            assert not os.path.exists(os.path.join(media_root, derivative))
+            assert not ImageBlob.objects.filter(name=name).exists()
+
+    @staticmethod
+    def store_long_ago(media_root, name):
+        past = time.time() - tasks.DELETE_DELAY - 1
+        os.utime(os.path.join(media_root, name), (past, past))
+
+    def test_stored_file_is_kept(self):
+        """
+        Tests that saving content stored already keeps the file and drops the new copy
+        """
+        with tempfile.TemporaryDirectory() as media_root:
+            storage = ContentAddressedStorage(location=media_root)
+            name = storage.save('a.jpg', ContentFile(b'content'))
+            inode = os.stat(storage.path(name)).st_ino
+            storage.save('b.jpg', ContentFile(b'content'))
+            assert os.stat(storage.path(name)).st_ino == inode
+            assert os.listdir(os.path.join(media_root, '.incoming')) == []
+
+    def test_file_kept_when_content_is_saved_again(self):
+        """
+        Tests that the file of the last released reference survives the delete job when a photo
+        with the same content is stored before the job and retains it before or after the job
+        """
+        user = User.objects.create_user(username='blob_user', password='testpass')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            photo = Photo.objects.create(title='Single', image=ContentFile(b'blob', name='single.jpg'), user=user)
+            name = photo.image.name
+            photo.delete()
+            self.store_long_ago(media_root, name)
+            job = Job.objects.get(name=tasks.delete_image.job_name)
+
+            # another upload stores the content, the job runs before its photo is saved
+            assert photo.image.storage.save('again.jpg', ContentFile(b'blob')) == name
+            jobs.run(job.name, job.payload)
+            assert os.path.exists(os.path.join(media_root, name))
+            again = Photo.objects.create(title='Again', image=name, user=user)
+            assert ImageBlob.objects.get(name=name).ref_count == 1
+
+            # the job queued again finds the file referenced
+            self.store_long_ago(media_root, name)
+            job = Job.objects.filter(name=tasks.delete_image.job_name).exclude(pk=job.pk).get()
+            jobs.run(job.name, job.payload)
+            assert os.path.exists(os.path.join(media_root, name))
+            assert Photo.objects.get(pk=again.pk).image.name == name
+
+
+class TestConditionalRequests(PhotosTestCase):
+    """
+    Tests for ETag / Last-Modified validators of gallery and photo
+    """
+
+    def test_gallery_not_modified_until_photo_changes(self):
+        """
+        Tests that fresh gallery copy gets 304 without querying photos
+        and that adding or renaming photo changes ETag
+        """
+        user = User.objects.create_user(username='etag_user', password='testpass')
+        photo = Photo.objects.create(title='Tagged', image='tagged.jpg', user=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        response = client.get('/api/v1/photos/gallery/')
+        etag = response['ETag']
+        assert response['Last-Modified']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/v1/photos/gallery/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert len(queries) == 1
+        assert 'photos_photo' not in queries[0]['sql']
+
+        response = client.get('/api/v1/photos/gallery/', {'page_size': 1}, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+        client.post(f'/api/v1/photos/{photo.pk}/change_photo_title/', {'title': 'Renamed'})
+        response = client.get('/api/v1/photos/gallery/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+        etag = response['ETag']
+
+        Photo.objects.create(title='Another', image='another.jpg', user=user)
+        response = client.get('/api/v1/photos/gallery/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_photo_etag(self):
+        """
+        Tests that photo with unchanged title answers 304
+        """
+        user = User.objects.create_user(username='photo_etag_user', password='testpass')
+        photo = Photo.objects.create(title='Tagged', image='tagged.jpg', user=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        etag = client.get(f'/api/v1/photos/{photo.pk}/photo/')['ETag']
+        response = client.get(f'/api/v1/photos/{photo.pk}/photo/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        Photo.objects.filter(pk=photo.pk).update(title='Renamed')
+        response = client.get(f'/api/v1/photos/{photo.pk}/photo/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    def test_photo_modified_after_pixels_job(self):
+        """
+        Tests that colors written by the pixels job change ETag of photo cached before processing
+        """
+        user = User.objects.create_user(username='pixels_etag_user', password='testpass')
+        buffer = io.BytesIO()
+        Image.new('RGB', (32, 32), (200, 30, 30)).save(buffer, 'PNG')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            photo = Photo.objects.create(title='Raw', image=ContentFile(buffer.getvalue(), name='raw.png'), user=user)
+            response = client.get(f'/api/v1/photos/{photo.pk}/photo/')
+            etag = response['ETag']
+            assert response.data['photo']['blurhash'] == ''
+
+            tasks.read_image_pixels(photo.image.name)
+            response = client.get(f'/api/v1/photos/{photo.pk}/photo/', HTTP_IF_NONE_MATCH=etag)
+            assert response.status_code == 200
+            assert response.data['photo']['blurhash'] and response.data['photo']['dominant_color']
+
+    def test_photo_modified_after_duplicates_job(self):
+        """
+        Tests that duplicate_of written by the duplicates job changes ETag of photo cached before
+        """
+        user = User.objects.create_user(username='duplicate_etag_user', password='testpass')
+        original, copy = (Photo.objects.create(title=title, image=f'{title}.jpg', user=user, width=1,
+                                               **metadata.hash_fields(7)) for title in ('original', 'copy'))
+        client = APIClient()
+        client.force_authenticate(user=user)
+        etag = client.get(f'/api/v1/photos/{copy.pk}/photo/')['ETag']
+
+        tasks.find_duplicates([copy.pk])
+        response = client.get(f'/api/v1/photos/{copy.pk}/photo/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response.data['photo']['duplicate_of'] == original.pk
+
+    def test_photo_modified_after_metadata_backfill(self):
+        """
+        Tests that size and exif written by the backfill command change ETag of photo cached before
+        """
+        user = User.objects.create_user(username='backfill_etag_user', password='testpass')
+        buffer = io.BytesIO()
+        Image.new('RGB', (48, 32), (30, 200, 30)).save(buffer, 'PNG')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            name = default_storage.save('old.png', ContentFile(buffer.getvalue()))
+            photo, = Photo.objects.bulk_create([Photo(title='Old', image=name, user=user)])
+            response = client.get(f'/api/v1/photos/{photo.pk}/photo/')
+            etag = response['ETag']
+            assert response.data['photo']['width'] is None
+
+            call_command('backfill_image_metadata', workers=1, stdout=io.StringIO(), stderr=io.StringIO())
+            response = client.get(f'/api/v1/photos/{photo.pk}/photo/', HTTP_IF_NONE_MATCH=etag)
+            assert response.status_code == 200
+            assert (response.data['photo']['width'], response.data['photo']['height']) == (48, 32)
+
+    def test_gallery_modified_after_views_flush(self):
+        """
+        Tests that flushed views change ETag of the gallery showing count_of_views
+        """
+        user = User.objects.create_user(username='views_etag_user', password='testpass')
+        photo = Photo.objects.create(title='Viewed', image='viewed.jpg', user=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        etag = client.get('/api/v1/photos/gallery/')['ETag']
+        client.get(f'/api/v1/photos/{photo.pk}/photo/')
+        view_counter.flush()
+
+        response = client.get('/api/v1/photos/gallery/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response.data['gallery'][0]['count_of_views'] == 1
+
+
+class TestGalleryCache(PhotosTestCase):
+    """
+    Tests for per-user cache of gallery pages
+    """
+
+    def test_gallery_served_from_cache_until_change(self):
+        """
+        Tests that repeated gallery request does not query photos
+        and that new photo invalidates the entry
+        """
+        user = User.objects.create_user(username='cache_user', password='testpass')
+        Photo.objects.create(title='Cached', image='cached.jpg', user=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        client.get('/api/v1/photos/gallery/')
+        before = gallery_cache.stats()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/v1/photos/gallery/')
+        assert [photo['title'] for photo in response.data['gallery']] == ['Cached']
+        assert not any('photos_photo' in query['sql'] for query in queries)
+        assert gallery_cache.stats()['hits'] == before['hits'] + 1
+
+        Photo.objects.create(title='Fresh', image='fresh.jpg', user=user)
+        response = client.get('/api/v1/photos/gallery/')
+        assert [photo['title'] for photo in response.data['gallery']] == ['Cached', 'Fresh']
+
+    def test_views_flush_drops_entry(self):
+        """
+        Tests that flushed views remove cached pages of the owner's gallery
+        """
+        user = User.objects.create_user(username='cache_views_user', password='testpass')
+        photo = Photo.objects.create(title='Viewed', image='viewed.jpg', user=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        client.get('/api/v1/photos/gallery/')
+        assert gallery_cache.cache.get(gallery_cache.key(user.pk)) is not None
+
+        view_counter.add(photo)
+        view_counter.flush()
+        assert gallery_cache.cache.get(gallery_cache.key(user.pk)) is None
+        response = client.get('/api/v1/photos/gallery/')
+        assert response.data['gallery'][0]['count_of_views'] == 1
+
+    def test_entry_of_old_version_is_ignored(self):
+        """
+        Tests that entry built from another gallery version is a miss
+        """
+        cache = GalleryCache(alias='photos_gallery', pages_per_user=2)
+        cache.set(1, 1, 'first', {'gallery': []})
+        assert cache.get(1, 1, 'first') == {'gallery': []}
+        assert cache.get(1, 2, 'first') is None
+        cache.set(1, 1, 'second', {})
+        cache.set(1, 1, 'third', {})
+        assert cache.get(1, 1, 'first') is None
+
+
+class TestAsyncViews(PhotosTestCase):
+    """
+    Tests for async views of photos
+    """
+
+    async def test_async_views_with_token(self):
+        """
+        Tests that async views authenticate by token and mirror sync payloads
+        """
+        user = await User.objects.acreate(username='async_user', password='testpass')
+        token = await Token.objects.acreate(user=user)
+        photo = await Photo.objects.acreate(title='Async', image='async.jpg', user=user)
+        client = AsyncClient()
+        response = await client.get('/api/v1/async/photos/gallery/')
+        assert response.status_code == 401
+
+        auth = {'headers': {'Authorization': f'Token {token.key}'}}
+        response = await client.get('/api/v1/async/photos/gallery/', **auth)
+        assert response.status_code == 200
+        assert [item['title'] for item in response.json()['gallery']] == ['Async']
+
+        response = await client.get(f'/api/v1/async/photos/{photo.pk}/photo/', **auth)
+        assert response.json()['photo']['count_of_views'] == 1
+
+        response = await client.post(f'/api/v1/async/photos/{photo.pk}/change_photo_title/',
+                                     {'title': 'Renamed'}, **auth)
+        assert response.json()['photo']['title'] == 'Renamed'
+        assert (await Photo.objects.aget(pk=photo.pk)).title == 'Renamed'
+
+
+class TestBatchUpload(PhotosTestCase):
+    """
+    Tests for batch upload of photos
+    """
+
+    @staticmethod
+    def make_image(name, color):
+        buffer = io.BytesIO()
+        Image.new('RGB', (32, 32), color).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_bad_items_do_not_sink_the_batch(self):
+        """
+        Tests that valid images are inserted in one query and broken ones are reported per item
+        """
+        user = User.objects.create_user(username='batch_user', password='testpass')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        images = [self.make_image('red.png', 'red'),
+                  SimpleUploadedFile('broken.png', b'not an image', content_type='image/png'),
+                  self.make_image('red_copy.png', 'red'),
+                  self.make_image('green.png', 'green')]
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+                CaptureQueriesContext(connection) as queries:
+            response = client.post('/api/v1/photos/add_photos/', {
+                'image': images,
+                'title': ['Red', 'Broken', 'Red again', ''],
+                'description': ['first', '', 'copy', '']})
+        results = response.data['photos']
+        assert results[0]['photo']['title'] == 'Red'
+        assert results[1]['message'] == 'fail'
+        assert results[2]['photo']['title'] == 'Red again'
+        assert results[3]['message'] == 'fail'
+        assert 'title' in results[3]['description']
+        assert Photo.objects.filter(user=user).count() == 2
+        assert len([query for query in queries if query['sql'].startswith('INSERT INTO "photos_photo"')]) == 1
+        assert Job.objects.filter(name=tasks.render_image_derivatives.job_name).count() == 1
+        name = Photo.objects.filter(user=user).first().image.name
+        assert ImageBlob.objects.get(name=name).ref_count == 2
+
+
+class TestPhotosBatch(PhotosTestCase):
+    """
+    Tests for fetching many photos in one request
+    """
+
+    def test_batch_returns_own_photos_and_counts_views_once(self):
+        """
+        Tests that batch selects photos in one query, hides other user's photo
+        and flushes views with a single update
+        """
+        user = User.objects.create_user(username='batch_fetch_user', password='testpass')
+        stranger = User.objects.create_user(username='batch_stranger', password='testpass')
+        own = [Photo.objects.create(title=f'Own {i}', image=f'own{i}.jpg', user=user) for i in range(3)]
+        foreign = Photo.objects.create(title='Foreign', image='foreign.jpg', user=stranger)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        ids = [own[2].pk, foreign.pk, own[0].pk, own[1].pk]
+
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch.object(view_counter, 'flush_interval', 3600):
+            response = client.get('/api/v1/photos/batch/', {'ids': ','.join(map(str, ids))})
+        assert [photo['title'] for photo in response.data['photos']] == ['Own 2', 'Own 0', 'Own 1']
+        assert all(photo['count_of_views'] == 1 for photo in response.data['photos'])
+        assert response.data['missing'] == [foreign.pk]
+        assert len([query for query in queries if 'photos_photo' in query['sql']]) == 1
+
+        with CaptureQueriesContext(connection) as queries:
+            view_counter.flush()
+        updates = [query['sql'] for query in queries
+                   if query['sql'].startswith('UPDATE') and 'photos_photo' in query['sql']]
+        assert len(updates) == 1
+        assert ' IN (' in updates[0]
+        assert list(Photo.objects.filter(user=user).values_list('count_of_views', flat=True)) == [1, 1, 1]
+
+    def test_batch_rejects_bad_ids(self):
+        """
+        Tests that ids must be integers within the range of primary keys
+        """
+        user = User.objects.create_user(username='batch_bad_ids', password='testpass')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        assert client.get('/api/v1/photos/batch/', {'ids': '1,x'}).data['message'] == 'fail'
+        assert client.get('/api/v1/photos/batch/').data['message'] == 'fail'
+        for ids in ('1,99999999999999999999', '9223372036854775808', '0', '-1'):
+            assert client.get('/api/v1/photos/batch/', {'ids': ids}).data['message'] == 'fail'
+        assert client.get('/api/v1/photos/batch/', {'ids': '9223372036854775807'}).data['missing'] == \
+            [9223372036854775807]
+
+
+class TestImageServing(PhotosTestCase):
+    """
+    Tests for serving images of photos
+    """
+
+    def test_ranges_and_validators(self):
+        """
+        Tests full, partial, conditional and unsatisfiable responses
+        """
+        user = User.objects.create_user(username='serving_user', password='testpass')
+        stranger = User.objects.create_user(username='serving_stranger', password='testpass')
+        client = APIClient()
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            photo = Photo.objects.create(title='Served', image=ContentFile(b'0123456789', name='served.jpg'),
+                                         user=user)
+            client.force_authenticate(user=stranger)
+            assert client.get(f'/api/v1/photos/{photo.pk}/image/').data['description'] == 'permission denied'
+
+            client.force_authenticate(user=user)
+            response = client.get(f'/api/v1/photos/{photo.pk}/image/', HTTP_ACCEPT='image/webp')
+            assert response.status_code == 200
+            assert b''.join(response.streaming_content) == b'0123456789'
+            assert response['Accept-Ranges'] == 'bytes'
+            assert 'immutable' in response['Cache-Control']
+            etag = response['ETag']
+
+            response = client.get(f'/api/v1/photos/{photo.pk}/image/', HTTP_RANGE='bytes=2-5')
+            assert response.status_code == 206
+            assert response['Content-Range'] == 'bytes 2-5/10'
+            assert b''.join(response.streaming_content) == b'2345'
+
+            response = client.get(f'/api/v1/photos/{photo.pk}/image/', HTTP_RANGE='bytes=-3')
+            assert b''.join(response.streaming_content) == b'789'
+
+            response = client.get(f'/api/v1/photos/{photo.pk}/image/', HTTP_RANGE='bytes=2-5',
+                                  HTTP_IF_RANGE='"stale"')
+            assert response.status_code == 200
+
+            response = client.get(f'/api/v1/photos/{photo.pk}/image/', HTTP_RANGE='bytes=20-')
+            assert response.status_code == 416
+
+            response = client.get(f'/api/v1/photos/{photo.pk}/image/', HTTP_IF_NONE_MATCH=etag)
+            assert response.status_code == 304
+
+            with mock.patch.dict(media.CONFIG, {'ACCEL': 'nginx'}):
+                response = client.get(f'/api/v1/photos/{photo.pk}/image/')
+            assert response['X-Accel-Redirect'] == '/protected-images/' + photo.image.name
+
+
+class TestCachedTokenAuthentication(PhotosTestCase):
+    """
+    Tests for token authentication with cache
+    """
+
+    def test_token_lookup_is_cached_until_logout(self):
+        """
+        Tests that repeated request skips token query and deleted token stops working
+        """
+        user = User.objects.create_user(username='token_cache_user', password='testpass')
+        token = Token.objects.create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        assert client.get('/api/v1/photos/gallery/').status_code == 200
+
+        with CaptureQueriesContext(connection) as queries:
+            assert client.get('/api/v1/photos/gallery/').status_code == 200
+        assert not any('authtoken_token' in query['sql'] for query in queries)
+        assert token_cache.stats()['hits'] >= 1
+
+        Token.objects.filter(user=user).delete()
+        assert client.get('/api/v1/photos/gallery/').status_code == 401
+
+    def test_deactivated_user_is_dropped(self):
+        """
+        Tests that saving user drops his cached tokens
+        """
+        user = User.objects.create_user(username='token_inactive_user', password='testpass')
+        token = Token.objects.create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        assert client.get('/api/v1/photos/gallery/').status_code == 200
+        user.is_active = False
+        user.save()
+        assert client.get('/api/v1/photos/gallery/').status_code == 401
+
+    def test_lru_and_ttl_bounds(self):
+        """
+        Tests that cache keeps at most max_entries and forgets expired tokens
+        """
+        users = [User.objects.create_user(username=f'token_lru_{i}', password='testpass') for i in range(3)]
+        tokens = [Token.objects.create(user=user) for user in users]
+        cache = TokenCache(max_entries=2, ttl=60)
+        for token in tokens:
+            cache.set(token)
+        assert cache.get(tokens[0].key) is None
+        assert cache.get(tokens[2].key).user == users[2]
+        expired = TokenCache(max_entries=2, ttl=-1)
+        expired.set(tokens[0])
+        assert expired.get(tokens[0].key) is None
+
+
+class TestBenchmark(PhotosTestCase):
+    """
+    Tests for seed_photos command and benchmark helpers
+    """
+
+    def test_percentile_and_compare(self):
+        """
+        Tests interpolated percentiles and relative change of metrics
+        """
+        assert percentile([], 0.5) is None
+        assert percentile([10.0], 0.99) == 10.0
+        assert percentile([10.0, 20.0, 30.0, 40.0], 0.5) == 25.0
+        lines = compare({'scenarios': {'gallery': {'p50_ms': 15.0, 'queries': 3}}},
+                        {'scenarios': {'gallery': {'p50_ms': 10.0, 'queries': 3}, 'photo': {'p50_ms': 1.0}}})
+        assert len(lines) == 2
+        assert '+50.0%' in lines[0]
+
+    def test_seed_photos(self):
+        """
+        Tests that seeded photos share images, reference counts match and queries can be counted
+        """
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            call_command('seed_photos', users=2, photos=3, images=2, prefix='seedtest', stdout=io.StringIO())
+            users = User.objects.filter(username__startswith='seedtest_')
+            assert users.count() == 2
+            assert Token.objects.filter(user__in=users).count() == 2
+            assert Photo.objects.filter(user__in=users).count() == 6
+            blobs = ImageBlob.objects.filter(name__in=Photo.objects.filter(user__in=users).values('image'))
+            assert sorted(blobs.values_list('ref_count', flat=True)) == [2, 4]
+
+            seeded = [{'token': user.auth_token.key, 'photos': list(user.photo_set.values_list('id', flat=True))}
+                      for user in users]
+            assert count_queries(Scenario('photo', seeded, b'')) >= 1
+
+
+class TestPerformanceMetrics(PhotosTestCase):
+    """
+    Tests for request phase timings and prometheus metrics
+    """
+
+    def test_server_timing_and_metrics(self):
+        """
+        Tests that phases and queries of a request land in Server-Timing and /metrics
+        """
+        user = User.objects.create_user(username='metrics_user', password='testpass')
+        token = Token.objects.create(user=user)
+        photo = Photo.objects.create(title='Timed', image='timed.jpg', user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = client.get(f'/api/v1/photos/{photo.pk}/photo/')
+        assert response.status_code == 200
+        phases = {entry.split(';')[0]: entry for entry in response['Server-Timing'].split(', ')}
+        assert set(phases) == {'auth', 'serialize', 'render', 'db', 'total'}
+        assert 'queries"' in phases['db'] and 'desc="0 queries"' not in phases['db']
+
+        metrics = Client().get('/metrics').content.decode()
+        assert 'photos_requests_total{endpoint="photo-photo",method="GET",status="200"}' in metrics
+        assert 'photos_request_phase_seconds_count{endpoint="photo-photo",phase="serialize"}' in metrics
+        assert 'photos_request_queries_bucket{endpoint="photo-photo",le="+Inf"}' in metrics
+        assert 'photos_token_cache_hits_total' in metrics
+        assert Client(REMOTE_ADDR='203.0.113.7').get('/metrics').status_code == 403
+
+    async def test_async_view_is_timed(self):
+        """
+        Tests that middleware times native async views too
+        """
+        user = await User.objects.acreate(username='metrics_async_user', password='testpass')
+        token = await Token.objects.acreate(user=user)
+        response = await AsyncClient().get('/api/v1/async/photos/gallery/',
+                                           headers={'Authorization': f'Token {token.key}'})
+        assert response.status_code == 200
+        assert response['Server-Timing'].startswith('auth;dur=')
+
+    def test_histogram_and_timings(self):
+        """
+        Tests cumulative buckets and Server-Timing format
+        """
+        histogram = Histogram('test_seconds', 'Test.', ('endpoint',), (0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(('a"b',), value)
+        lines = histogram.collect()
+        assert 'test_seconds_bucket{endpoint="a\\"b",le="0.1"} 2' in lines
+        assert 'test_seconds_bucket{endpoint="a\\"b",le="+Inf"} 4' in lines
+        assert 'test_seconds_count{endpoint="a\\"b"} 4' in lines
+
+        timings = RequestTimings()
+        timings.add('auth', 0.002)
+        timings.queries, timings.db = 2, 0.001
+        assert timings.server_timing(0.01) == 'auth;dur=2.000, db;dur=1.000;desc="2 queries", total;dur=10.000'
+        assert registry.collect().endswith('\n')
+
+
+class TestReplicaRouting(SimpleTestCase):
+    """
+    Tests for routing of reads to replicas with read-your-writes stickiness
+    """
+
+    def setUp(self):
+        caches[routers.CACHE].clear()
+        self.router = routers.PrimaryReplicaRouter(replicas=('replica0',))
+        self.replicas = mock.patch.object(routers, 'REPLICAS', ('replica0',))
+        self.replicas.start()
+
+    def tearDown(self):
+        self.replicas.stop()
+        caches[routers.CACHE].clear()
+
+    def read_db(self, method, token, status=200):
+        """
+        :return str: alias the router gives to reads of request
+        """
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(Photo))
+            return HttpResponse(status=status)
+
+        request = RequestFactory().generic(method, '/api/v1/photos/gallery/', HTTP_AUTHORIZATION=f'Token {token}')
+        ReplicaRoutingMiddleware(view)(request)
+        return seen[0]
+
+    def test_client_reads_own_writes(self):
+        """
+        Tests that unsafe requests and reads right after them go to the primary
+        """
+        assert self.read_db('GET', 'a') == 'replica0'
+        assert self.read_db('POST', 'a', status=400) == 'default'
+        assert self.read_db('GET', 'a') == 'replica0'
+        assert self.read_db('POST', 'a') == 'default'
+        assert self.read_db('GET', 'a') == 'default'
+        assert self.read_db('GET', 'b') == 'replica0'
+        caches[routers.CACHE].clear()
+        assert self.read_db('GET', 'a') == 'replica0'
+
+    def test_pins_cache_shared_between_workers(self):
+        """
+        Tests that pins live in a cache shared by processes and that a per-process one is warned about
+        """
+        assert checks.check_db_pin_cache(None) == []
+        with mock.patch.object(routers, 'CACHE', 'default'):
+            assert [warning.id for warning in checks.check_db_pin_cache(None)] == ['photos.W001']
+            with mock.patch.object(routers, 'REPLICAS', ()):
+                assert checks.check_db_pin_cache(None) == []
+
+    def test_primary_outside_requests(self):
+        """
+        Tests that writes, reads outside requests and migrations stay on the primary
+        """
+        assert self.router.db_for_read(Photo) == 'default'
+        assert self.router.db_for_write(Photo) == 'default'
+        assert self.router.allow_migrate('default', 'photos') is True
+        assert self.router.allow_migrate('replica0', 'photos') is False
+        assert self.router.allow_migrate('other', 'photos') is None
+
+
+class TestFastSerialization(TestCase):
+    """
+    Tests for read-only photo representation and orjson renderer
+    """
+
+    def test_same_bytes_as_serializer(self):
+        """
+        Tests that representation renders to the same bytes as PhotoSerializer with both renderers
+        """
+        user = User(pk=7, username='fast_user')
+        names = ['ab/cd/' + 'f' * 64 + '.jpg', 'with space ü?.png', 'a/.hidden.jpg', 'noext', '']
+        photos = [Photo(pk=pk, title='Тест\u2028', description='d', count_of_views=3,
+                        date_of_creation=date(2024, 1, 2), image=name, user=user) for pk, name in enumerate(names, 1)]
+        photos[0].width, photos[0].height, photos[0].exif = 640, 480, {'make': 'Canon', 'f_number': 2.8}
+        photos[0].taken_at = datetime(2024, 5, 1, 12, 30, tzinfo=timezone(timedelta(hours=2)))
+        expected = JSONRenderer().render({'photos': [PhotoSerializer(photo).data for photo in photos]})
+        payload = {'photos': photo_representation.photos(photos)}
+        assert JSONRenderer().render(payload) == expected
+        assert ORJSONRenderer().render(payload) == expected
+        assert ORJSONRenderer().render({'photo': photo_representation.photo(photos[0])}) == \
+            JSONRenderer().render({'photo': PhotoSerializer(photos[0]).data})
+
+    def test_gallery_rows(self):
+        """
+        Tests that gallery rows get the same urls as PhotoSerializer gives
+        """
+        rows = photo_representation.gallery([{'id': 1, 'image': 'cat.jpg'}, {'id': 2, 'image': ''}])
+        assert rows == [{'id': 1, 'image': '/api/v1/photos/1/image/',
+                         'derivatives': PhotoSerializer.get_derivatives(Photo(pk=1, image='cat.jpg'))},
+                        {'id': 2, 'image': None, 'derivatives': {}}]
+
+    def test_renderer_falls_back(self):
+        """
+        Tests that data orjson can not encode and indented output are rendered by JSONRenderer
+        """
+        renderer = ORJSONRenderer()
+        assert renderer.render({1: 'a'}) == JSONRenderer().render({1: 'a'})
+        assert renderer.render({'a': 1}, 'application/json; indent=2') == b'{\n  "a": 1\n}'
+        assert renderer.render(None) == b''
+
+
+class TestGalleryStreaming(PhotosTestCase):
+    """
+    Tests for streamed whole gallery
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='stream_user', password='testpass')
+        self.token = Token.objects.create(user=self.user)
+        for number in range(5):
+            Photo.objects.create(title=f'Streamed {number}', image=f'streamed{number}.jpg', user=self.user)
+
+    def test_json_and_ndjson(self):
+        """
+        Tests that streamed items in chunks equal items of paginated gallery
+        """
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        paginated = client.get('/api/v1/photos/gallery/').json()['gallery']
+        with mock.patch.object(streaming, 'CHUNK_SIZE', 2):
+            response = client.get('/api/v1/photos/gallery/', {'stream': '1'})
+            assert response['Content-Type'] == 'application/json'
+            assert response['ETag']
+            assert json.loads(b''.join(response.streaming_content)) == paginated
+
+            response = client.get('/api/v1/photos/gallery/', {'stream': 'ndjson'})
+            lines = b''.join(response.streaming_content).decode().splitlines()
+            assert [json.loads(line) for line in lines] == paginated
+
+    async def test_async_stream(self):
+        """
+        Tests that async gallery streams the same items
+        """
+        client = AsyncClient()
+        auth = {'headers': {'Authorization': f'Token {self.token.key}'}}
+        with mock.patch.object(streaming, 'CHUNK_SIZE', 2):
+            response = await client.get('/api/v1/async/photos/gallery/', {'stream': 'json'}, **auth)
+            content = b''.join([chunk async for chunk in response.streaming_content])
+        assert [item['title'] for item in json.loads(content)] == [f'Streamed {number}' for number in range(5)]
+
+
+class TestImageMetadata(PhotosTestCase):
+    """
+    Tests for metadata of images
+    """
+
+    @staticmethod
+    def make_jpeg():
+        """
+        :return bytes: 40x20 jpeg rotated by exif orientation 6 with camera and capture time
+        """
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Canon'
+        exif.get_ifd(0x8769)[0x9003] = '2024:05:01 12:30:00'
+        exif.get_ifd(0x8769)[0x9011] = '+02:00'
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 20), (200, 30, 30)).save(buffer, 'JPEG', exif=exif)
+        return buffer.getvalue()
+
+    def test_extract(self):
+        """
+        Tests displayed size, exif fields, capture time, color and blurhash
+        """
+        data = metadata.extract(io.BytesIO(self.make_jpeg()))
+        assert (data['width'], data['height'], data['orientation']) == (20, 40, 6)
+        assert data['exif'] == {'make': 'Canon'}
+        assert data['taken_at'] == datetime(2024, 5, 1, 10, 30, tzinfo=timezone.utc)
+        assert data['dominant_color'].startswith('#c')
+        assert len(data['blurhash']) == 28 and data['blurhash'][0] == metadata.BASE83[2 + 3 * 9]
+        assert metadata.extract(io.BytesIO(b'not an image')) == metadata.empty()
+
+    def test_upload_and_backfill(self):
+        """
+        Tests that uploaded photo gets metadata and backfill fills photos created without it
+        """
+        user = User.objects.create_user(username='metadata_user', password='testpass')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            response = client.post('/api/v1/photos/add_photo/', {
+                'title': 'Meta', 'description': '',
+                'image': SimpleUploadedFile('meta.jpg', self.make_jpeg(), content_type='image/jpeg')})
+            assert (response.data['photo']['width'], response.data['photo']['height']) == (20, 40)
+            assert response.data['photo']['blurhash'] == ''
+            job = Job.objects.get(name=tasks.read_image_pixels.job_name)
+            jobs.run(job.name, job.payload)
+            photo = Photo.objects.get(title='Meta')
+            assert photo.blurhash and photo.taken_at is not None
+
+            Photo.objects.bulk_create([Photo(title='Old', image=photo.image.name, user=user)])
+            call_command('backfill_image_metadata', workers=1, stdout=io.StringIO(), stderr=io.StringIO())
+            assert Photo.objects.get(title='Old').blurhash == photo.blurhash
+
+
+@jobs.task(lane='low', max_attempts=2)
+def record_job_run(value, fail=False):
+    """
+    task of TestJobs: remembers its runs
+    """
+    TestJobs.runs.append(value)
+    if fail:
+        raise ValueError(f'{value} is broken')
+
+
+class TestJobs(PhotosTestCase):
+    """
+    Tests for background jobs
+    """
+    runs = []
+
+    def setUp(self):
+        super().setUp()
+        TestJobs.runs = []
+
+    def test_idempotency_key(self):
+        """
+        Tests that a key gives one job while it is queued or running and may be queued again once done
+        """
+        first = jobs.enqueue(record_job_run, {'value': 'a'}, key='record:a')
+        assert jobs.enqueue(record_job_run, {'value': 'a'}, key='record:a').pk == first.pk
+        Job.objects.filter(pk=first.pk).update(state=Job.DONE)
+        assert jobs.enqueue(record_job_run, {'value': 'a'}, key='record:a').pk != first.pk
+        assert jobs.enqueue(record_job_run, {'value': 'b'}).lane == 'low'
+
+    def test_lanes_retries_and_recovery(self):
+        """
+        Tests that higher lanes are claimed first, failures are retried after backoff until
+        max_attempts and jobs of lost workers are queued again
+        """
+        jobs.enqueue(record_job_run, {'value': 'low'})
+        jobs.enqueue(record_job_run, {'value': 'high'}, lane='high')
+        jobs.enqueue(record_job_run, {'value': 'later'}, lane='high', delay=60)
+        assert [job.payload['value'] for job in jobs.claim('test', limit=1)] == ['high']
+
+        broken = jobs.enqueue(record_job_run, {'value': 'broken', 'fail': True})
+        counts = jobs.Worker(workers=2).run(once=True)
+        assert sorted(TestJobs.runs) == ['broken', 'low']
+        assert counts == {Job.DONE: 1, Job.PENDING: 1, Job.FAILED: 0}
+        broken.refresh_from_db()
+        assert broken.state == Job.PENDING and broken.attempts == 1 and 'is broken' in broken.last_error
+        assert broken.run_at > datetime.now(timezone.utc)
+
+        Job.objects.filter(pk=broken.pk).update(run_at=broken.date_of_creation)
+        jobs.Worker(lanes=['low']).run(once=True)
+        broken.refresh_from_db()
+        assert broken.state == Job.FAILED and broken.attempts == 2
+
+        lost = Job.objects.get(payload__value='high')
+        assert lost.state == Job.RUNNING
+        assert jobs.recover(lost.locked_at + timedelta(seconds=jobs.LOCK_TIMEOUT + 1))[0] == 1
+        assert Job.objects.get(pk=lost.pk).state == Job.PENDING
+
+    def test_add_photo_queues_processing(self):
+        """
+        Tests that add_photo only stores the original and derivatives are rendered by the worker
+        """
+        user = User.objects.create_user(username='jobs_user', password='testpass')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48), 'green').save(buffer, 'PNG')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            client.post('/api/v1/photos/add_photo/', {
+                'title': 'Queued', 'description': '',
+                'image': SimpleUploadedFile('queued.png', buffer.getvalue(), content_type='image/png')})
+            name = Photo.objects.get(title='Queued').image.name
+            assert not default_storage.exists(derivative_name(name, 128, 'webp'))
+            assert set(Job.objects.values_list('name', 'lane')) == {
+                (tasks.render_image_derivatives.job_name, 'high'), (tasks.read_image_pixels.job_name, 'default')}
+
+            job, = jobs.claim('test', lanes=['high'])
+            jobs.run(job.name, job.payload)
+            assert jobs.finish(job) == Job.DONE
+            assert default_storage.exists(derivative_name(name, 128, 'webp'))
+
+
+class TestSimilarity(PhotosTestCase):
+    """
+    Tests for near-duplicate lookup by perceptual hash
+    """
+
+    @staticmethod
+    def make_jpeg(size, quality):
+        """
+        :return bytes: the same shot with a gradient and shapes at any size and quality
+        """
+        image = Image.linear_gradient('L').resize(size).convert('RGB')
+        draw = ImageDraw.Draw(image)
+        width, height = size
+        draw.ellipse((width // 5, height // 4, width // 2, height * 3 // 4), fill=(220, 40, 40))
+        draw.rectangle((width * 3 // 5, height // 6, width * 9 // 10, height // 2), fill=(30, 30, 200))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=quality)
+        return buffer.getvalue()
+
+    def test_lookup_reads_chunk_indexes(self):
+        """
+        Tests that photos within distance are found through the chunk indexes, farther ones are not
+        """
+        user = User.objects.create_user(username='hash_user', password='testpass')
+        base = 0x0123456789ABCDEF
+        photos = {}
+        for bits in (0, 3, 7, 11, 12, 30):
+            value = base ^ (1 << bits) - 1 if bits else base
+            photos[bits] = Photo.objects.create(title=str(bits), image=f'{bits}.jpg', user=user, width=1,
+                                                **metadata.hash_fields(value))
+        assert len(similarity.neighbours(0, 2)) == 1 + 16 + 120
+        found = similarity.similar(photos[0], distance=similarity.MAX_DISTANCE)
+        assert [(distance, photo.title) for distance, photo in found] == [(3, '3'), (7, '7'), (11, '11')]
+        assert [photo.title for _, photo in similarity.similar(photos[0], distance=3)] == ['3']
+
+        plan = similarity.candidates(user.pk, base, similarity.DISTANCE).explain()
+        assert 'photo_user_phash_0_idx' in plan and 'photo_user_phash_3_idx' in plan
+        assert 'SCAN photos_photo' not in plan
+
+    def test_duplicate_check_and_similar_action(self):
+        """
+        Tests that a re-encoded smaller copy is marked as duplicate by its upload job
+        and both are similar to each other
+        """
+        user = User.objects.create_user(username='similar_user', password='testpass')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            for title, size, quality in (('Original', (640, 480), 95), ('Copy', (320, 240), 60)):
+                client.post('/api/v1/photos/add_photo/', {
+                    'title': title, 'description': '',
+                    'image': SimpleUploadedFile(f'{title}.jpg', self.make_jpeg(size, quality))})
+            for job in Job.objects.filter(name=tasks.read_image_pixels.job_name):
+                jobs.run(job.name, job.payload)
+            original, copy = Photo.objects.get(title='Original'), Photo.objects.get(title='Copy')
+            assert original.duplicate_of_id is None and copy.duplicate_of_id == original.pk
+
+            response = client.get(f'/api/v1/photos/{original.pk}/similar/')
+            similar = response.data['similar']
+            assert [item['photo']['title'] for item in similar] == ['Copy']
+            assert similar[0]['distance'] <= similarity.DUPLICATE_DISTANCE
+            assert similar[0]['photo']['duplicate_of'] == original.pk
+            response = client.get(f'/api/v1/photos/{original.pk}/similar/', {'distance': 64})
+            assert response.data['message'] == 'fail'
+
+
+class TestSearch(PhotosTestCase):
+    """
+    Tests for full-text search of photos
+    """
+
+    def test_ranked_prefix_search_of_own_photos(self):
+        """
+        Tests ranking of title over description, prefix matching, paging and that
+        the index follows inserts, updates and deletes made by any means
+        """
+        user = User.objects.create_user(username='search_user', password='testpass')
+        other = User.objects.create_user(username='search_other', password='testpass')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            in_description = Photo.objects.create(title='Beach', description='sunset over the sea', image='1.jpg',
+                                                  user=user)
+            in_title = Photo.objects.create(title='Sunset', description='', image='2.jpg', user=user)
+            Photo.objects.create(title='Sunset', description='', image='3.jpg', user=other)
+            Photo.objects.bulk_create([Photo(title='Sunny morning at sea', image='4.jpg', user=user)])
+
+            response = client.get('/api/v1/photos/search/', {'q': 'sunset'})
+            assert [photo['title'] for photo in response.data['photos']] == ['Sunset', 'Beach']
+            response = client.get('/api/v1/photos/search/', {'q': 'SUN sea', 'page_size': 1})
+            titles = [response.data['photos'][0]['title']]
+            response = client.get('/api/v1/photos/search/', {'q': 'SUN sea', 'cursor': response.data['next']})
+            titles += [photo['title'] for photo in response.data['photos']]
+            assert sorted(titles) == ['Beach', 'Sunny morning at sea'] and response.data['next'] is None
+
+            in_description.title = 'Sea'
+            in_description.save()
+            Photo.objects.filter(pk=in_title.pk).update(title='Dawn')
+            response = client.get('/api/v1/photos/search/', {'q': 'sunset'})
+            assert [photo['title'] for photo in response.data['photos']] == ['Sea']
+            in_description.delete()
+            assert client.get('/api/v1/photos/search/', {'q': 'dawn'}).data['photos'][0]['title'] == 'Dawn'
+            assert client.get('/api/v1/photos/search/', {'q': 'sunset'}).data['photos'] == []
+            assert client.get('/api/v1/photos/search/', {'q': ' '}).data['message'] == 'fail'
+
+    def test_rebuild_and_plan(self):
+        """
+        Tests that rebuild indexes rows missed by the triggers and that a query reads the index, not photos
+        """
+        user = User.objects.create_user(username='rebuild_user', password='testpass')
+        photo = Photo.objects.create(title='Mountains', image='1.jpg', user=user)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {search.INDEX}_insert')
+        Photo.objects.create(title='Mountain lake', image='2.jpg', user=user)
+        assert [found.pk for found in search.search(user.pk, 'mountain')] == [photo.pk]
+
+        out = io.StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        assert 'indexed 2 photos' in out.getvalue()
+        assert len(search.search(user.pk, 'mountain')) == 2
+
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + search.SEARCH.replace('%s', '?'),
+                           [search.match_expression(user.pk, ['moun']), user.pk, 10.0, 1.0, 20, 0])
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        assert 'VIRTUAL TABLE INDEX' in plan and 'SEARCH photos_photo USING INTEGER PRIMARY KEY' in plan
+
+
+class TestPhotoAdmin(PhotosTestCase):
+    """
+    Tests for changelist of photos in admin
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.client.force_login(User.objects.create_superuser(username='admin_user', password='testpass'))
+        self.owner = User.objects.create_user(username='admin_owner', password='testpass')
+
+    def changelist(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/admin/photos/photo/', params or {})
+        assert response.status_code == 200
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def test_changelist_queries_do_not_grow_with_table(self):
+        """
+        Tests that the page takes the same queries for 2 and 12 photos, none of them an unbounded count,
+        and shows thumbnails of derivatives
+        """
+        first = Photo.objects.create(title='First', image='first.jpg', user=self.owner)
+        Photo.objects.create(title='Second', image='second.jpg', user=self.owner)
+        _, few = self.changelist()
+        Photo.objects.bulk_create([Photo(title=f'More {i}', image=f'more{i}.jpg', user=self.owner, duplicate_of=first)
+                                   for i in range(10)])
+        response, many = self.changelist()
+        assert len(few) == len(many)
+        assert not [sql for sql in many if 'COUNT(' in sql and 'LIMIT' not in sql]
+        assert f'/admin/photos/photo/{first.pk}/thumbnail/' in response.content.decode()
+
+        with mock.patch('photos.admin.COUNT_LIMIT', 5):
+            response, queries = self.changelist()
+        assert response.context['cl'].result_count == Photo.objects.order_by('-pk')[0].pk
+        assert [sql for sql in queries if 'MAX(' in sql] and not [sql for sql in queries if 'COUNT(' in sql]
+
+    def test_thumbnail_served_to_staff_only(self):
+        """
+        Tests that thumbnail view sends the smallest derivative of other user's photo to staff
+        and nothing to users who are not staff or may not view photos
+        """
+        buffer = io.BytesIO()
+        Image.new('RGB', (300, 200), (30, 30, 200)).save(buffer, 'JPEG')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            photo = Photo.objects.create(title='Thumb', image=ContentFile(buffer.getvalue(), name='thumb.jpg'),
+                                         user=self.owner)
+            generate_derivatives(photo.image.name, photo.image.storage)
+            url = f'/admin/photos/photo/{photo.pk}/thumbnail/'
+            response = self.client.get(url)
+            assert response.status_code == 200
+            assert Image.open(io.BytesIO(b''.join(response.streaming_content))).size == (128, 85)
+            assert self.client.get('/admin/photos/photo/0/thumbnail/').status_code == 404
+
+            owner = Client()
+            owner.force_login(self.owner)
+            assert owner.get(url).status_code == 302
+            User.objects.filter(pk=self.owner.pk).update(is_staff=True)
+            assert owner.get(url).status_code == 403
+
+    def test_filters_and_search_use_indexes(self):
+        """
+        Tests duplicate filter and search by id or exact username, and that they read index ranges
+        """
+        first = Photo.objects.create(title='Original', image='original.jpg', user=self.owner)
+        copy = Photo.objects.create(title='Copy', image='copy.jpg', user=self.owner, duplicate_of=first)
+        other = User.objects.create_user(username='admin_other', password='testpass')
+        Photo.objects.create(title='Other', image='other.jpg', user=other)
+
+        def titles(params):
+            return sorted(photo.title for photo in self.changelist(params)[0].context['cl'].result_list)
+
+        assert titles({'duplicate': 'yes'}) == ['Copy']
+        assert titles({'q': str(copy.pk)}) == ['Copy']
+        assert titles({'q': 'admin_other'}) == ['Other']
+        assert titles({'q': 'admin'}) == []
+        numbered = User.objects.create_user(username='2024', password='testpass')
+        Photo.objects.create(title='Numbered', image='numbered.jpg', user=numbered)
+        assert titles({'q': '2024'}) == ['Numbered']
+        assert titles({'q': '99999999999999999999'}) == []
+        assert self.client.get(f'/admin/photos/photo/{copy.pk}/change/').status_code == 200
+        assert titles({'date_of_creation__gte': str(date.today())}) == ['Copy', 'Numbered', 'Original', 'Other']
+
+        _, queries = self.changelist({'duplicate': 'yes'})
+        page = [sql for sql in queries if 'ORDER BY' in sql and 'photos_photo' in sql][0]
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + page)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        assert 'photo_duplicate_date_id_idx' in plan and 'TEMP B-TREE' not in plan
+
+
+class TestViewAnalytics(PhotosTestCase):
+    """
+    Tests for time-bucketed view analytics
+    """
+
+    def test_views_are_summed_in_memory_and_upserted_in_batch(self):
+        """
+        Tests that views write nothing until flush, then land in count_of_views and in one statement
+        that adds to existing buckets
+        """
+        user = User.objects.create_user(username='analytics_user', password='testpass')
+        photo = Photo.objects.create(title='Counted', image='analytics.jpg', user=user)
+        gone = Photo.objects.create(title='Gone', image='analytics_gone.jpg', user=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        with mock.patch.object(view_counter, 'flush_interval', 3600), CaptureQueriesContext(connection) as queries:
+            for _ in range(3):
+                client.get(f'/api/v1/photos/{photo.pk}/photo/')
+            client.get('/api/v1/photos/batch/', {'ids': f'{photo.pk},{gone.pk}'})
+        assert not [query for query in queries.captured_queries
+                    if query['sql'].startswith(('INSERT', 'UPDATE')) and 'photos_galleryversion' not in query['sql']]
+        gone.delete()
+
+        with CaptureQueriesContext(connection) as queries:
+            assert view_counter.flush() == 5
+        assert len([query for query in queries.captured_queries if 'INSERT' in query['sql']]) == 1
+        assert Photo.objects.get(pk=photo.pk).count_of_views == 4
+        view_counter.add(photo, 2)
+        view_counter.flush()
+        bucket = ViewBucket.objects.get()
+        assert (bucket.photo_id, bucket.resolution, bucket.views) == (photo.pk, ViewBucket.HOUR, 6)
+        assert bucket.start == analytics.bucket_start(datetime.now(timezone.utc), ViewBucket.HOUR)
+
+    def test_series_and_rollup(self):
+        """
+        Tests series of a photo and a gallery with pending views, and that rollup keeps day totals
+        while dropping hours and expired days
+        """
+        user = User.objects.create_user(username='series_user', password='testpass')
+        first = Photo.objects.create(title='First', image='series1.jpg', user=user)
+        second = Photo.objects.create(title='Second', image='series2.jpg', user=user)
+        now = datetime(2026, 3, 10, 12, 30, tzinfo=timezone.utc)
+        for photo, hours_ago, views in ((first, 1, 2), (first, 26, 3), (second, 27, 4), (first, 24 * 10, 5),
+                                        (first, 24 * 10 + 1, 1)):
+            view_counter.add(photo, views, now=now - timedelta(hours=hours_ago))
+        view_counter.flush()
+        view_counter.add(second, 7, now=now)
+
+        days = analytics.series(ViewBucket.DAY, 3, user_id=user.pk, now=now, pending=view_counter.pending_buckets())
+        assert [(row['start'].day, row['views']) for row in days] == [(8, 0), (9, 7), (10, 9)]
+        hours = analytics.series(ViewBucket.HOUR, 2, photo_id=first.pk, now=now, pending=view_counter.pending_buckets())
+        assert [(row['start'].hour, row['views']) for row in hours] == [(11, 2), (12, 0)]
+
+        assert analytics.rollup(hourly_days=0, daily_days=30, now=now) == (4, 0)
+        assert ViewBucket.objects.filter(resolution=ViewBucket.DAY).count() == 3
+        assert analytics.series(ViewBucket.DAY, 3, user_id=user.pk, now=now,
+                                pending=view_counter.pending_buckets()) == days
+        old = analytics.series(ViewBucket.DAY, 11, photo_id=first.pk, now=now)[0]
+        assert (old['start'].day, old['views']) == (28, 6)
+        assert analytics.rollup(hourly_days=0, daily_days=5, now=now) == (0, 1)
+
+        client = APIClient()
+        client.force_authenticate(user=user)
+        client.get(f'/api/v1/photos/{second.pk}/photo/')
+        response = client.get(f'/api/v1/photos/{second.pk}/view_stats/', {'resolution': 'day', 'periods': 2})
+        assert response.data['resolution'] == 'day' and len(response.data['series']) == 2
+        assert response.data['series'][-1]['views'] == 1
+        response = client.get('/api/v1/photos/gallery_view_stats/', {'resolution': 'week'})
+        assert response.data['message'] == 'fail'
@@ -0,0 +1,242 @@
+"""
+resumable chunked uploads: chunks are streamed to a partial file and hashed on the fly
+"""
+
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from .models import UploadSession
+
+CONFIG = getattr(settings, 'PHOTOS_UPLOADS', {})
+TEMP_DIR = str(CONFIG.get('TEMP_DIR', settings.BASE_DIR / 'uploads'))
+CHUNK_SIZE = CONFIG.get('CHUNK_SIZE', 64 * 1024)
+MAX_SIZE = CONFIG.get('MAX_SIZE', 100 * 1024 * 1024)
+# seconds an unfinished upload is kept since it was started
+TTL = CONFIG.get('TTL', 24 * 60 * 60)
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+# running sha256 of partial files: {session id: (offset, hash)}
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """
+    chunk or session can not be accepted
+    """
+
+
+def part_path(session):
+    """
+    :param session: UploadSession
+    :return str: path of partial file of session
+    """
+    return os.path.join(TEMP_DIR, f'{session.pk}.part')
+
+
+def parse_content_range(header, size):
+    """
+    :param header: value of Content-Range header, e.g. 'bytes 0-65535/1000000'
+    :param size: declared size of the upload
+    :return tuple: (first byte, last byte + 1)
+    :raise UploadError: if header is missing or does not fit the upload
+    """
+    match = CONTENT_RANGE.match(header or '')
+    if match is None:
+        raise UploadError('Content-Range header is required: bytes first-last/size')
+    first, last, total = (int(value) for value in match.groups())
+    if total != size or first > last or last >= size:
+        raise UploadError('Content-Range does not fit the upload')
+    return first, last + 1
+
+
+def start(session):
+    """
+    creates empty partial file for new session
+    :param session: UploadSession
+    :raise UploadError: if declared size is too big
+    """
+    if session.size > MAX_SIZE:
+        raise UploadError(f'upload is bigger than {MAX_SIZE} bytes')
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    with open(part_path(session), 'wb'):
+        pass
+
+
+def _get_hasher(session_id, path, offset):
+    """
+    running hash of the first offset bytes of the partial file, rebuilt from disk
+    if this process did not receive the previous chunks
+    """
+    with _hashers_lock:
+        cached = _hashers.pop(session_id, None)
+    if cached is not None and cached[0] == offset:
+        return cached[1]
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as part:
+        remaining = offset
+        while remaining:
+            block = part.read(min(CHUNK_SIZE, remaining))
+            if not block:
+                raise UploadError('partial file is shorter than received bytes')
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+def write_chunk(session, stream, first, end):
+    """
+    appends bytes [first, end) read from stream to the partial file,
+    memory use is bounded by CHUNK_SIZE
+    :param session: UploadSession
+    :param stream: file-like request body
+    :param first: offset of the chunk
+    :param end: offset right after the chunk
+    :return int: count of received bytes of the upload
+    :raise UploadError: if chunk is not the next one or body is short
+    """
+    if stream is None:
+        raise UploadError('request body is empty')
+    path = part_path(session)
+    with open(path, 'r+b') as part:
+        fcntl.flock(part, fcntl.LOCK_EX)
+        session.refresh_from_db(fields=['received'])
+        if first != session.received:
+            raise UploadError(f'expected chunk starting at {session.received}')
+        hasher = _get_hasher(session.pk, path, first)
+        part.seek(first)
+        remaining = end - first
+        while remaining:
+            block = stream.read(min(CHUNK_SIZE, remaining))
+            if not block:
+                part.truncate(first)
+                raise UploadError('request body is shorter than Content-Range')
+            part.write(block)
+            hasher.update(block)
+            remaining -= len(block)
+        part.truncate(end)
+        part.flush()
+        type(session).objects.filter(pk=session.pk).update(received=end)
+        session.received = end
+        with _hashers_lock:
+            _hashers[session.pk] = (end, hasher)
+    return end
+
+
+def finish(session, storage):
+    """
+    moves completed partial file into storage
+    :param session: UploadSession with all bytes received
+    :param storage: filesystem storage of photos
+    :return tuple: (name in storage, sha256 hex digest)
+    :raise UploadError: if upload is incomplete, corrupted or not an image
+    """
+    path = part_path(session)
+    try:
+        part = open(path, 'rb')
+    except FileNotFoundError:
+        raise UploadError('upload is already finalized') from None
+    with part:
+        # same lock as write_chunk, so the file is moved once however many finalize requests race
+        fcntl.flock(part, fcntl.LOCK_EX)
+        if not os.path.exists(path):
+            raise UploadError('upload is already finalized')
+        session.refresh_from_db(fields=['received'])
+        return _finish(session, storage, path)
+
+
+def _finish(session, storage, path):
+    """
+    finish of session whose partial file is locked
+    """
+    if session.received != session.size:
+        raise UploadError(f'received {session.received} of {session.size} bytes')
+    digest = _get_hasher(session.pk, path, session.received).hexdigest()
+    if session.sha256 and session.sha256.lower() != digest:
+        raise UploadError('sha256 of received bytes does not match')
+    try:
+        # only the header is parsed here, pixels are not decoded
+        with Image.open(path) as image:
+            extension = image.format.lower()
+    except (UnidentifiedImageError, OSError) as e:
+        raise UploadError('upload is not an image') from e
+    base, ext = os.path.splitext(os.path.basename(session.file_name))
+    if hasattr(storage, 'adopt'):
+        # content-addressed storage takes the file under the digest computed while receiving it
+        return storage.adopt(path, digest, ext or '.' + extension), digest
+    name = storage.get_available_name(storage.get_valid_name(f'{base or "upload"}{ext or "." + extension}'))
+    target = storage.path(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.move(path, target)
+    return name, digest
+
+
+def discard(session):
+    """
+    removes partial file and cached hash of session
+    :param session: UploadSession
+    """
+    with _hashers_lock:
+        _hashers.pop(session.pk, None)
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def expire(ttl=TTL, now=None):
+    """
+    drops uploads abandoned for longer than ttl and partial files left without a session,
+    e.g. by a crash between finalize and discard
+    :param ttl: seconds an upload is kept since it was started
+    :param now: current time, defaults to timezone.now()
+    :return tuple: (count of deleted sessions, count of removed orphan partial files)
+    """
+    now = now or timezone.now()
+    expired = list(UploadSession.objects.filter(date_of_creation__lt=now - timedelta(seconds=ttl)))
+    for session in expired:
+        # discard before delete, which resets the primary key the partial file is named by
+        discard(session)
+        session.delete()
+    removed = 0
+    try:
+        entries = list(os.scandir(TEMP_DIR))
+    except FileNotFoundError:
+        return len(expired), removed
+    cutoff = time.time() - ttl
+    names = {entry.name[:-len('.part')]: entry for entry in entries
+             if entry.name.endswith('.part') and entry.stat().st_mtime < cutoff}
+    known = {str(pk) for pk in UploadSession.objects.filter(pk__in=[
+        name for name in names if _is_uuid(name)]).values_list('pk', flat=True)}
+    for name, entry in names.items():
+        if name not in known:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return len(expired), removed
+
+
+def _is_uuid(value):
+    """
+    :param value: name of partial file without extension
+    :return bool: True if value is a session id
+    """
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
@@ -3,13 +3,59 @@ ViewSet for photos
 """
 from django.conf import settings
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
-from .serializers import PhotoSerializer
-from .models import Photo
+from .serializers import GALLERY_FIELDS, PhotoSerializer, UploadSessionSerializer, photo_representation
+from .streaming import stream_format, stream_gallery
+from .models import MAX_PHOTO_ID, ImageBlob, Photo, UploadSession, ViewBucket
+from . import analytics, batch, leaderboard, media, search, similarity, tasks, uploads
+from .media import PassThroughNegotiation
+from .signals import register_created_photos
+from .pagination import GalleryPagination, decode_cursor, encode_cursor
+from .counters import view_counter
+from .derivatives import FORMATS, SIZES, derivative_name
+from .jobs import enqueue
+from .authentication import token_cache
+from .cache import gallery_cache
+from .conditional import gallery_etag, get_gallery_version, not_modified, photo_etag, set_validators
+from .metrics import TimedAuthenticationMixin
 
+BATCH_MAX_IDS = getattr(settings, 'PHOTOS_BATCH_MAX_IDS', 100)
 
-class PhotosViewSet(GenericViewSet):
+
+def schedule_processing(photo):
+    """
+    queues jobs rendering derivatives of photo's image, unless equal content was uploaded
+    and processed before, and reading its colors and perceptual hash followed by the duplicate check,
+    so the request returns once the original is stored
+    :param photo: just created Photo
+    """
+    if not photo.image:
+        return
+    name = photo.image.name
+    if not ImageBlob.objects.filter(name=name, ref_count__gt=1).exists():
+        enqueue(tasks.render_image_derivatives, {'name': name}, key=f'derivatives:{name}')
+    if photo.phash is None:
+        enqueue(tasks.read_image_pixels, {'name': name}, key=f'pixels:{name}')
+
+
+def series_params(request):
+    """
+    :param request: drf request with optional 'resolution' ('day' or 'hour') and 'periods' query params
+    :return tuple: (resolution, periods)
+    :raise ValueError: if a param is invalid
+    """
+    resolution = request.GET.get('resolution', ViewBucket.DAY)
+    if resolution not in analytics.STEPS:
+        raise ValueError(f'resolution must be one of {", ".join(analytics.STEPS)}')
+    periods = request.GET.get('periods', str(analytics.PERIODS))
+    if not periods.isdigit() or not 1 <= int(periods) <= analytics.MAX_PERIODS:
+        raise ValueError(f'periods must be 1..{analytics.MAX_PERIODS}')
+    return resolution, int(periods)
+
+
+class PhotosViewSet(TimedAuthenticationMixin, GenericViewSet):
     """
     ViewSet for Photos
     """
@@ -19,34 +65,239 @@ class PhotosViewSet(GenericViewSet):
     @action(methods=['get'], detail=False)
     def gallery(self, request):
         """
-        user's gallery
+        user's gallery, one page at a time or whole
+        :param request: method GET: optional 'cursor' and 'page_size' query params,
+                        'sort' query param: date (default), views or title, '-' prefixed for descending,
+                        'date_from' / 'date_to' inclusive YYYY-MM-DD bounds of date_of_creation,
+                        If-None-Match / If-Modified-Since headers,
+                        'stream' query param '1' / 'json' or 'ndjson' to get the whole gallery
+        :return Response: json that includes page of user's photos
+                          and 'next' cursor (None on the last page), served from gallery_cache
+                          while the gallery is unchanged, 304 without body if client's copy of the page is fresh;
+                          with 'stream' a streamed json array or ndjson of all user's photos
+        """
+        version, date_of_change = get_gallery_version(request.user.pk)
+        etag = gallery_etag(request, version)
+        response = not_modified(request, etag, date_of_change)
+        if response is not None:
+            return set_validators(response, etag, date_of_change)
+        fmt = stream_format(request)
+        if fmt is not None:
+            try:
+                return set_validators(stream_gallery(request, fmt), etag, date_of_change)
+            except ValueError as e:
+                return Response({'message': 'fail', 'description': str(e)})
+        page_key = gallery_cache.page_key(request)
+        payload = gallery_cache.get(request.user.pk, version, page_key)
+        if payload is not None:
+            return set_validators(Response(payload), etag, date_of_change)
+        paginator = GalleryPagination()
+        rows = Photo.objects.filter(user=request.user).values(*GALLERY_FIELDS)
+        try:
+            gallery = paginator.paginate_queryset(rows, request, self)
+        except ValueError as e:
+            return Response({'message': 'fail', 'description': str(e)})
+        photo_representation.gallery(gallery)
+        payload = {'gallery': gallery, 'next': paginator.next_cursor}
+        gallery_cache.set(request.user.pk, version, page_key, payload)
+        return set_validators(Response(payload), etag, date_of_change)
+
+    @action(methods=['get'], detail=False, permission_classes=[IsAdminUser])
+    def gallery_cache_stats(self, request):
+        """
+        hit/miss counters of gallery cache of the serving process, for staff only
+        :param request: method GET
+        :return Response: {'hits': int, 'misses': int, 'hit_rate': float}
+        """
+        return Response(gallery_cache.stats())
+
+    @action(methods=['get'], detail=False, permission_classes=[IsAdminUser])
+    def token_cache_stats(self, request):
+        """
+        hit/miss counters of token cache of the serving process, for staff only
         :param request: method GET
-        :return Response: json that includes queryset of user's photos
+        :return Response: {'hits': int, 'misses': int, 'hit_rate': float, 'entries': int}
         """
-        gallery = Photo.objects.filter(user=request.user).values()
-        for photo in gallery:
-            photo['image'] = request.get_host() + settings.STATIC_URL + settings.MEDIA_URL[1:] + photo['image']
-        return Response({'gallery': gallery})
+        return Response(token_cache.stats())
 
     @action(methods=['get'], detail=True)
     def photo(self, request, pk):
         """
-        show user his photo defined by pk
+        show user his photo defined by pk, the view is counted by view_counter
+        and written to db in batches
         :param request: method GET
         :param pk: primary key - photo.id
         :return Response: if success defined photo json representation
+                          (304 if If-None-Match holds its ETag)
                           else {'message': 'fail', 'description': 'permission denied'}
         """
         try:
             photo = Photo.objects.get(pk=pk)
-            if photo.user != request.user:
+            if photo.user_id != request.user.pk:
                 return Response({'message': 'fail', 'description': 'permission denied'})
-            photo.count_of_views += 1
-            photo.save()
-            photo['image'] = request.get_host() + settings.STATIC_URL + settings.MEDIA_URL[1:] + photo['image']
-            return Response({'photo': PhotoSerializer(photo).data})
+            view_counter.add(photo)
+            etag = photo_etag(photo)
+            response = not_modified(request, etag)
+            if response is None:
+                photo.count_of_views += view_counter.pending(photo.pk)
+                response = Response({'photo': photo_representation.photo(photo)})
+            view_counter.flush_if_due()
+            return set_validators(response, etag)
+        except Photo.DoesNotExist as e:
+            return Response({'message': 'fail', 'description': str(e)})
+
+    @action(methods=['get'], detail=False, url_path='batch')
+    def photos_batch(self, request):
+        """
+        show user many of his photos at once, views are counted like in photo
+        and land in db as one UPDATE ... WHERE id IN (...) per flush
+        :param request: method GET: 'ids' query param, comma separated photo ids, 1 to 2 ** 63 - 1
+        :return Response: {'photos': [photo json representation, ...] in order of ids,
+                           'missing': [ids of photos not found or not owned by user]}
+                          else {'message': 'fail', 'description': reason}
+        """
+        try:
+            ids = list(dict.fromkeys(int(pk) for pk in request.GET.get('ids', '').split(',') if pk))
+        except ValueError as e:
+            return Response({'message': 'fail', 'description': str(e)})
+        if not ids:
+            return Response({'message': 'fail', 'description': "'ids'"})
+        if len(ids) > BATCH_MAX_IDS:
+            return Response({'message': 'fail', 'description': f'more than {BATCH_MAX_IDS} ids'})
+        for pk in ids:
+            if not 0 < pk <= MAX_PHOTO_ID:
+                return Response({'message': 'fail', 'description': f'id {pk} is out of range'})
+        photos = {photo.pk: photo for photo in Photo.objects.filter(user=request.user, pk__in=ids)}
+        view_counter.add_many(photos.values())
+        found = [photos[pk] for pk in ids if pk in photos]
+        pending = view_counter.pending_many(photos)
+        for photo in found:
+            photo.count_of_views += pending.get(photo.pk, 0)
+        data = photo_representation.photos(found)
+        view_counter.flush_if_due()
+        return Response({'photos': data, 'missing': [pk for pk in ids if pk not in photos]})
+
+    @action(methods=['get'], detail=True)
+    def view_stats(self, request, pk):
+        """
+        views of user's photo defined by pk per hour or day
+        :param request: method GET: optional 'resolution' ('day' or 'hour') and 'periods' query params
+        :param pk: primary key - photo.id
+        :return Response: {'resolution': str, 'series': [{'start': datetime, 'views': int}, ...]} oldest first
+                          else {'message': 'fail', 'description': reason}
+        """
+        try:
+            resolution, periods = series_params(request)
+            photo = Photo.objects.only('user_id').get(pk=pk)
+        except (ValueError, Photo.DoesNotExist) as e:
+            return Response({'message': 'fail', 'description': str(e)})
+        if photo.user_id != request.user.pk:
+            return Response({'message': 'fail', 'description': 'permission denied'})
+        return Response({'resolution': resolution,
+                         'series': analytics.series(resolution, periods, photo_id=photo.pk,
+                                                           pending=view_counter.pending_buckets())})
+
+    @action(methods=['get'], detail=False)
+    def gallery_view_stats(self, request):
+        """
+        views of all user's photos per hour or day
+        :param request: method GET: optional 'resolution' ('day' or 'hour') and 'periods' query params
+        :return Response: {'resolution': str, 'series': [{'start': datetime, 'views': int}, ...]} oldest first
+                          else {'message': 'fail', 'description': reason}
+        """
+        try:
+            resolution, periods = series_params(request)
+        except ValueError as e:
+            return Response({'message': 'fail', 'description': str(e)})
+        return Response({'resolution': resolution,
+                         'series': analytics.series(resolution, periods, user_id=request.user.pk,
+                                                    pending=view_counter.pending_buckets())})
+
+    @action(methods=['get'], detail=False)
+    def leaderboard(self, request):
+        """
+        user's most viewed photos, counting views not written to db yet like photo does
+        :param request: method GET: optional 'limit' query param
+        :return Response: {'photos': [photo json representation, ...]} most viewed first
+                          else {'message': 'fail', 'description': reason}
+        """
+        limit = request.GET.get('limit', str(leaderboard.LIMIT))
+        if not limit.isdigit() or not 1 <= int(limit) <= leaderboard.MAX_LIMIT:
+            return Response({'message': 'fail', 'description': f'limit must be 1..{leaderboard.MAX_LIMIT}'})
+        return Response({'photos': photo_representation.photos(leaderboard.top(request.user.pk, int(limit)))})
+
+    @action(methods=['get'], detail=False)
+    def search(self, request):
+        """
+        user's photos with every word of query as a prefix of a word of title or description,
+        best matches first, from the full-text index
+        :param request: method GET: 'q' query param, optional 'cursor' and 'page_size' query params
+        :return Response: {'photos': [photo json representation, ...], 'next': cursor or None}
+                          else {'message': 'fail', 'description': reason}
+        """
+        text = request.GET.get('q', '')
+        if not text.strip():
+            return Response({'message': 'fail', 'description': "'q'"})
+        try:
+            size = max(1, min(int(request.GET.get('page_size', search.PAGE_SIZE)), search.MAX_PAGE_SIZE))
+            offset = decode_cursor(request.GET['cursor'], 1)[0] if 'cursor' in request.GET else 0
+            if not isinstance(offset, int) or offset < 0:
+                raise ValueError('invalid cursor')
+        except ValueError as e:
+            return Response({'message': 'fail', 'description': str(e)})
+        found = search.search(request.user.pk, text, size + 1, offset)
+        return Response({'photos': photo_representation.photos(found[:size]),
+                         'next': encode_cursor([offset + size]) if len(found) > size else None})
+
+    @action(methods=['get'], detail=True)
+    def similar(self, request, pk):
+        """
+        show user his photos looking like his photo defined by pk: re-encoded, resized or retouched copies
+        :param request: method GET: optional 'distance' query param, max hamming distance of perceptual hashes
+        :param pk: primary key - photo.id
+        :return Response: {'similar': [{'distance': int, 'photo': photo json representation}, ...]}
+                          nearest first, else {'message': 'fail', 'description': reason}
+        """
+        try:
+            photo = Photo.objects.get(pk=pk)
         except Photo.DoesNotExist as e:
             return Response({'message': 'fail', 'description': str(e)})
+        if photo.user_id != request.user.pk:
+            return Response({'message': 'fail', 'description': 'permission denied'})
+        distance = request.GET.get('distance', str(similarity.DISTANCE))
+        if not distance.isdigit() or int(distance) > similarity.MAX_DISTANCE:
+            return Response({'message': 'fail',
+                             'description': f'distance must be 0..{similarity.MAX_DISTANCE}'})
+        if photo.phash is None:
+            return Response({'message': 'fail', 'description': 'photo is not processed yet'})
+        found = similarity.similar(photo, int(distance))
+        data = photo_representation.photos(other for _, other in found)
+        return Response({'similar': [{'distance': other_distance, 'photo': representation}
+                                     for (other_distance, _), representation in zip(found, data)]})
+
+    @action(methods=['get'], detail=True, content_negotiation_class=PassThroughNegotiation)
+    def image(self, request, pk):
+        """
+        sends image of user's photo defined by pk or one of its derivatives,
+        supports Range / If-Range, ETag / Last-Modified and X-Accel-Redirect / X-Sendfile
+        :param request: method GET: optional 'size' and 'format' query params of derivative
+        :param pk: primary key - photo.id
+        :return HttpResponse: image bytes
+                              else {'message': 'fail', 'description': reason}
+        """
+        try:
+            photo = Photo.objects.only('user_id', 'image').get(pk=pk)
+        except Photo.DoesNotExist as e:
+            return Response({'message': 'fail', 'description': str(e)})
+        if photo.user_id != request.user.pk:
+            return Response({'message': 'fail', 'description': 'permission denied'})
+        name = photo.image.name
+        if 'size' in request.GET:
+            size, fmt = request.GET['size'], request.GET.get('format', 'jpeg')
+            if not size.isdigit() or int(size) not in SIZES or fmt not in FORMATS:
+                return Response({'message': 'fail', 'description': 'unknown derivative'})
+            name = derivative_name(name, int(size), fmt)
+        return media.serve(request, photo.image.storage, name)
 
     @action(methods=['post'], detail=True)
     def change_photo_title(self, request, pk):
@@ -63,9 +314,8 @@ class PhotosViewSet(GenericViewSet):
                 return Response({'message': 'fail', 'description': 'permission denied'})
             data = request.POST
             photo.title = data['title']
-            photo.save()
-            photo['image'] = request.get_host() + settings.STATIC_URL + settings.MEDIA_URL[1:] + photo['image']
-            return Response({'photo': PhotoSerializer(photo).data})
+            photo.save(update_fields=['title'])
+            return set_validators(Response({'photo': PhotoSerializer(photo).data}), photo_etag(photo))
         except Photo.DoesNotExist as e:
             return Response({'message': 'fail', 'description': str(e)})
         except KeyError as e:
@@ -74,7 +324,7 @@ class PhotosViewSet(GenericViewSet):
     @action(methods=['post'], detail=False)
     def add_photo(self, request):
         """
-        allows user to add photo
+        allows user to add photo, resized copies and colors are made by background jobs
         :param request: method POST: image file, dict = {'title': 'value'
                                                          'description': 'value'}
         :return Response: added photo json representation
@@ -88,7 +338,7 @@ class PhotosViewSet(GenericViewSet):
                 description=data['description'],
                 image=image,
                 user=user)
-            photo['image'] = request.get_host() + settings.STATIC_URL + settings.MEDIA_URL[1:] + photo['image']
+            schedule_processing(photo)
             return Response({'photo': PhotoSerializer(photo).data})
         except KeyError as e:
             return Response({'message': 'fail', 'description': str(e)})
@@ -98,3 +348,130 @@ class PhotosViewSet(GenericViewSet):
             return Response({'message': 'fail', 'description': str(e)})
         except Exception as e:
             return Response({'message': 'fail', 'description': str(e)})
+
+    @action(methods=['post'], detail=False)
+    def add_photos(self, request):
+        """
+        allows user to add many photos in one request, images are decoded and stored in parallel
+        and rows are inserted with one query
+        :param request: method POST: image files, 'title' and 'description' values in the same order
+        :return Response: {'photos': [added photo json representation
+                                      or {'message': 'fail', 'description': reason}, ...]}
+        """
+        images = request.FILES.getlist('image')
+        titles = request.POST.getlist('title')
+        descriptions = request.POST.getlist('description')
+        if not images:
+            return Response({'message': 'fail', 'description': "'image'"})
+        if len(images) > batch.MAX_FILES:
+            return Response({'message': 'fail', 'description': f'more than {batch.MAX_FILES} images'})
+        results = [None] * len(images)
+        accepted = []
+        for index, image in enumerate(images):
+            if index < len(titles) and titles[index]:
+                accepted.append(index)
+            else:
+                results[index] = {'message': 'fail', 'description': f"{image.name}: 'title'"}
+        storage = Photo.image.field.storage
+        stored = batch.store_images([images[index] for index in accepted], storage)
+        photos = {}
+        for index, (name, metadata, error) in zip(accepted, stored):
+            if error is not None:
+                results[index] = {'message': 'fail', 'description': error}
+                continue
+            photos[index] = Photo(
+                title=titles[index],
+                description=descriptions[index] if index < len(descriptions) else '',
+                image=name,
+                user=request.user,
+                **metadata)
+        created = Photo.objects.bulk_create(photos.values())
+        for name in register_created_photos(created):
+            enqueue(tasks.render_image_derivatives, {'name': name}, key=f'derivatives:{name}')
+        if created:
+            enqueue(tasks.find_duplicates, {'ids': [photo.pk for photo in created]})
+        for index, photo in photos.items():
+            results[index] = {'photo': PhotoSerializer(photo).data}
+        return Response({'photos': results})
+
+
+class UploadsViewSet(TimedAuthenticationMixin, GenericViewSet):
+    """
+    ViewSet for resumable chunked uploads of photos:
+    create session, PUT chunks with Content-Range, then finalize
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def create(self, request):
+        """
+        starts upload session
+        :param request: method POST: dict = {'title': 'value', 'description': 'value',
+                                             'file_name': 'value', 'size': bytes,
+                                             'sha256': optional hex digest}
+        :return Response: upload session json representation
+        """
+        serializer = UploadSessionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'message': 'fail', 'description': serializer.errors})
+        session = serializer.save(user=request.user)
+        try:
+            uploads.start(session)
+        except uploads.UploadError as e:
+            session.delete()
+            return Response({'message': 'fail', 'description': str(e)})
+        return Response({'upload': UploadSessionSerializer(session).data})
+
+    def retrieve(self, request, pk):
+        """
+        shows how many bytes were received, so client knows where to resume
+        :param request: method GET
+        :param pk: primary key - upload_session.id
+        :return Response: upload session json representation
+        """
+        return Response({'upload': UploadSessionSerializer(self.get_object()).data})
+
+    @action(methods=['put'], detail=True)
+    def chunk(self, request, pk):
+        """
+        appends chunk to the upload, body is streamed to disk
+        :param request: method PUT: raw bytes, header Content-Range: bytes first-last/size
+        :param pk: primary key - upload_session.id
+        :return Response: upload session json representation
+                          else {'message': 'fail', 'description': reason}
+        """
+        session = self.get_object()
+        try:
+            first, end = uploads.parse_content_range(request.headers.get('Content-Range'), session.size)
+            uploads.write_chunk(session, request.stream, first, end)
+        except uploads.UploadError as e:
+            return Response({'message': 'fail', 'description': str(e),
+                             'upload': UploadSessionSerializer(session).data})
+        return Response({'upload': UploadSessionSerializer(session).data})
+
+    @action(methods=['post'], detail=True)
+    def finalize(self, request, pk):
+        """
+        turns completed upload into photo
+        :param request: method POST
+        :param pk: primary key - upload_session.id
+        :return Response: added photo json representation
+                          else {'message': 'fail', 'description': reason}
+        """
+        session = self.get_object()
+        try:
+            name, _ = uploads.finish(session, Photo.image.field.storage)
+        except uploads.UploadError as e:
+            return Response({'message': 'fail', 'description': str(e)})
+        photo = Photo.objects.create(
+            title=session.title,
+            description=session.description,
+            image=name,
+            user=request.user)
+        uploads.discard(session)
+        session.delete()
+        schedule_processing(photo)
+        return Response({'photo': PhotoSerializer(photo).data})